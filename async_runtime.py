@@ -0,0 +1,284 @@
+"""
+Альтернативний asyncio-рантайм бота на AsyncTeleBot, aiomysql та aiohttp.
+
+    pip install aiomysql aiohttp
+    python async_runtime.py
+
+Оновлення кожного чату обробляються по черзі (AsyncChatDispatcher), різних чатів - одночасно.
+Нативно в event loop виконуються лише дві команди, що читають дані й чекають на I/O ("мій айді",
+"статус усіх серверів"). Решта команд і всі багатокрокові діалоги (register_next_step_handler)
+передаються тим самим обробникам bot.py у пулі з DISPATCH_WORKERS потоків, тож бізнес-логіка в обох
+рантаймах одна, але для цих команд одночасність обмежена пулом так само, як у синхронному рантаймі.
+Відповіді нативних команд проходять через той самий SendLimiter, що й відповіді bot.py.
+"""
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.asyncio_helper import ApiTelegramException
+
+import bot as sync
+from dispatcher import AsyncChatDispatcher, update_chat_id
+from hetzner import API_URL, HetznerClientBase, HetznerError
+from router import TextRouter
+
+POLL_TIMEOUT = 30  # секунди long polling getUpdates
+
+
+class AsyncHetznerClient(HetznerClientBase):
+    """Асинхронний клієнт Hetzner Cloud API з тією ж політикою повторів, що й HetznerClient."""
+
+    def _session(self, token):
+        import aiohttp
+
+        session = self._sessions.get(token)
+        if session is None:
+            session = aiohttp.ClientSession(
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.read_timeout),
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+            )
+            self._sessions[token] = session
+        return session
+
+    async def request(self, token, method, path, params=None):
+        import aiohttp
+
+        session = self._session(token)
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                async with session.request(method, API_URL + path, params=params) as response:
+                    status = response.status
+                    headers = response.headers
+                    text = await response.text()
+            except aiohttp.ClientConnectorError as err:
+                # Запит навіть не дійшов до сервера - можна повторювати будь-який метод
+                if last:
+                    raise HetznerError(None, f"Hetzner API недоступний: {err}")
+                await asyncio.sleep(self._delay(attempt))
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                if last or method != "GET":
+                    raise HetznerError(None, f"Помилка з'єднання з Hetzner API: {err}")
+                await asyncio.sleep(self._delay(attempt))
+                continue
+            self._record_rate_limit(token, headers)
+            if self._retryable(method, status) and not last:
+                logging.warning(f"Hetzner API {method} {path}: {status}, повтор {attempt + 1}")
+                await asyncio.sleep(self._delay(attempt, status, headers))
+                continue
+            if status >= 400:
+                raise HetznerError(status, self._error_message(status, text))
+            return json.loads(text) if text else {}
+
+    async def get_server(self, token, server_id):
+        return (await self.request(token, "GET", f"/servers/{server_id}")).get("server", {})
+
+    async def list_servers(self, token, per_page=50, concurrency=2):
+        first = await self.request(token, "GET", "/servers", params={"page": 1, "per_page": per_page})
+        servers = first.get("servers", [])
+        last_page = (first.get("meta") or {}).get("pagination", {}).get("last_page") or 1
+        if last_page > 1:
+            limit = asyncio.Semaphore(concurrency)
+
+            async def fetch(page):
+                async with limit:
+                    response = await self.request(token, "GET", "/servers",
+                                                  params={"page": page, "per_page": per_page})
+                return response.get("servers", [])
+
+            for page_servers in await asyncio.gather(*(fetch(page) for page in range(2, last_page + 1))):
+                servers.extend(page_servers)
+        return servers
+
+    async def close(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+
+class AsyncDB:
+    """Пул aiomysql з тією ж семантикою, що й execute_db у bot.py (помилка - None, commit - True)."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @classmethod
+    async def connect(cls, size, **connect_args):
+        import aiomysql
+
+        return cls(await aiomysql.create_pool(maxsize=size, autocommit=True, **connect_args))
+
+    async def execute(self, query, params=None, fetchone=False, commit=False):
+        import aiomysql
+
+        try:
+            async with self.pool.acquire() as connection:
+                async with connection.cursor() as cursor:
+                    await cursor.execute(query, params)
+                    if commit:
+                        return True
+                    return await cursor.fetchone() if fetchone else await cursor.fetchall()
+        except aiomysql.Error as err:
+            logging.error(f"Error executing query: {err}")
+            return None
+
+    async def close(self):
+        self.pool.close()
+        await self.pool.wait_closed()
+
+
+class AsyncRuntime:
+    def __init__(self, db, hetzner):
+        from telebot.async_telebot import AsyncTeleBot
+
+        self.bot = AsyncTeleBot(sync.TOKEN)
+        self.db = db
+        self.hetzner = hetzner
+        self.dispatcher = AsyncChatDispatcher(self.process_update, queue_size=sync.DISPATCH_QUEUE_SIZE)
+        self.executor = ThreadPoolExecutor(max_workers=sync.DISPATCH_WORKERS, thread_name_prefix="sync-handler")
+        self.native = {
+            "мій айді": self.my_id,
+            "статус усіх серверів": self.all_servers_status,
+        }
+
+    def native_handler(self, update):
+        message = update.message
+        if message is None or not message.text:
+            return None
+        # Чат посеред діалогу (register_next_step_handler) - відповідь чекає синхронний обробник
+        if message.chat.id in sync.bot.next_step_backend.handlers:
+            return None
+        return self.native.get(TextRouter.normalize(message.text))
+
+    async def process_update(self, update):
+        if not sync.principals_ready.is_set():
+            # Перевірки прав у event loop не повинні блокувати його, поки індекс користувачів завантажується
+            await asyncio.get_running_loop().run_in_executor(self.executor, sync.principals_ready.wait,
+                                                             sync.PRINCIPALS_LOAD_TIMEOUT)
+        handler = self.native_handler(update)
+        if handler is not None:
+            await handler(update.message)
+            return
+        loop = asyncio.get_running_loop()
+        # Через HetznerBot._process_update, як у синхронному рантаймі: /stats рахує й делеговані взаємодії
+        await loop.run_in_executor(self.executor, sync.bot._process_update, update)
+
+    async def send(self, chat_id, text, priority=sync.PRIORITY_NORMAL, **kwargs):
+        """send_message через SendLimiter синхронного бота: обидва рантайми ділять ліміти Telegram."""
+        limiter = sync.bot.limiter
+        loop = asyncio.get_running_loop()
+        for attempt in range(limiter.retries + 1):
+            # acquire блокує потік, тож дозвіл чекається в пулі за замовчуванням, а не в пулі обробників
+            await loop.run_in_executor(None, limiter.acquire, chat_id, priority)
+            try:
+                return await self.bot.send_message(chat_id, text, **kwargs)
+            except ApiTelegramException as err:
+                if err.error_code != 429 or attempt == limiter.retries:
+                    raise
+                parameters = (err.result_json or {}).get("parameters") or {}
+                limiter.penalize(chat_id, parameters.get("retry_after", 1))
+
+    async def my_id(self, message):
+        if not sync.is_user(message.chat.id):
+            return
+        await self.send(message.chat.id, f"Ваш user ID: {message.chat.id}",
+                        reply_to_message_id=message.message_id,
+                        reply_markup=sync.commands_menu_markup(message.chat.id))
+
+    async def fetch_servers_by_token(self, tokens):
+        limit = asyncio.Semaphore(max(1, sync.DASHBOARD_MAX_TOKENS))
+
+        async def fetch(token):
+            async with limit:
+                try:
+                    servers = await self.hetzner.list_servers(token, concurrency=sync.DASHBOARD_TOKEN_CONCURRENCY)
+                except HetznerError as err:
+                    return token, err
+            by_id = {}
+            for server in servers:
+                by_id[str(server["id"])] = server
+                sync.status_cache.put(token, server["id"], server)
+            return token, by_id
+
+        return dict(await asyncio.gather(*(fetch(token) for token in tokens)))
+
+    async def all_servers_status(self, message):
+        if not sync.is_user(message.chat.id):
+            return
+        if sync.is_moderator(message.from_user.id):
+            query, params = sync.group_servers_query()
+        else:
+            group_name = sync.get_user_group(message.from_user.id)
+            query, params = sync.group_servers_query(group_name) if group_name else (None, None)
+        rows = await self.db.execute(query, params) if query else None
+        groups = sync.group_servers_from_rows(rows or [])
+        menu = sync.commands_menu_markup(message.chat.id)
+        if not groups:
+            await self.send(message.chat.id, "Немає доданих серверів.", reply_markup=menu)
+            return
+        started = time.monotonic()
+        results = await self.fetch_servers_by_token({key for _, key, _ in groups.values()})
+        elapsed = time.monotonic() - started
+        messages = sync.render_status_table(groups, results)
+        messages[-1] += f"\n\nОновлено за {elapsed:.1f} с"
+        try:
+            for text in messages[:-1]:
+                await self.send(message.chat.id, text, priority=sync.PRIORITY_BULK, parse_mode="HTML")
+            await self.send(message.chat.id, messages[-1], parse_mode="HTML", reply_markup=menu)
+        except Exception as err:
+            logging.error(f"Не вдалося надіслати статус серверів у чат {message.chat.id}: {err}")
+            await self.send(message.chat.id, f"❌ Не вдалося надіслати статус серверів: {err}", reply_markup=menu)
+
+    async def run(self):
+        # getUpdates не працює, поки встановлено webhook
+        await self.bot.delete_webhook()
+        print("Бот запущено (asyncio)")
+        sync.mark_ready()
+        offset = None
+        try:
+            while True:
+                try:
+                    updates = await self.bot.get_updates(offset=offset, timeout=POLL_TIMEOUT,
+                                                         request_timeout=POLL_TIMEOUT + 10)
+                except Exception as err:
+                    logging.error(f"Помилка getUpdates: {err}")
+                    await asyncio.sleep(3)
+                    continue
+                for update in updates:
+                    offset = update.update_id + 1
+                    await self.dispatcher.submit(update_chat_id(update), update)
+        finally:
+            await self.close()
+
+    async def close(self):
+        await self.hetzner.close()
+        await self.db.close()
+        await self.bot.close_session()
+        self.executor.shutdown(wait=False)
+
+
+async def run():
+    db = await AsyncDB.connect(sync.DB_POOL_SIZE, host=sync.DB_HOST, user=sync.DB_USER,
+                               password=sync.DB_PASSWORD, db=sync.DB_NAME)
+    hetzner = AsyncHetznerClient(connect_timeout=sync.HETZNER_CONNECT_TIMEOUT, read_timeout=sync.HETZNER_READ_TIMEOUT,
+                                 retries=sync.HETZNER_RETRIES)
+    await AsyncRuntime(db, hetzner).run()
+
+
+def main():
+    sync.qr_renderer.start()
+    sync.check_and_update_version()
+    sync.start_warmup()
+    sync.enable_step_persistence()
+    if sync.WATCHER_ENABLED:
+        sync.status_watcher.start()
+    sync.one_time_codes.start()
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
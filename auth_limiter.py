@@ -0,0 +1,181 @@
+import logging
+import threading
+import time
+
+import mysql.connector
+
+# Читання лічильників при першій спробі користувача; план перевіряє check_query_plans.py
+READ_FAILURES_QUERY = ("SELECT window_length, bucket, failures FROM auth_failures "
+                       "WHERE subject = %s AND expires_at > NOW()")
+
+
+class _Window:
+    """
+    Ковзне вікно з двох відрізків довжиною length: поточного і попереднього.
+    Оцінка кількості подій за останні length секунд - поточний + частина попереднього,
+    що ще потрапляє у вікно. Пам'ять і час - O(1) на суб'єкт.
+    """
+    __slots__ = ("bucket", "current", "previous")
+
+    def __init__(self):
+        self.bucket = 0
+        self.current = 0
+        self.previous = 0
+
+    def roll(self, bucket):
+        if bucket != self.bucket:
+            self.previous = self.current if bucket == self.bucket + 1 else 0
+            self.current = 0
+            self.bucket = bucket
+
+    def estimate(self, now, length):
+        bucket, offset = divmod(now, length)
+        self.roll(int(bucket))
+        return self.previous * (1 - offset / length) + self.current
+
+
+class AttemptLimiter:
+    """
+    Ліміт невдалих спроб введення 2FA-коду або одноразового коду для кожного користувача.
+    Понад throttle_limit невдач за throttle_window секунд спроби відхиляються; понад block_limit
+    за block_window користувач блокується (on_block), якщо exempt(subject) не повертає True - такі суб'єкти
+    (модератори, які розблоковують інших) лише тимчасово обмежуються. allow() перевіряє лише пам'ять, тож відхилена
+    спроба не звертається ні до бази, ні до pyotp. Лічильники дублюються в таблицю auth_failures,
+    тому їх бачать інші процеси бота і вони переживають перезапуск.
+    """
+
+    def __init__(self, pool=None, throttle_limit=5, throttle_window=600, block_limit=20, block_window=86400,
+                 on_block=None, exempt=None, sweep_interval=3600, sweep_batch=1000):
+        self.pool = pool
+        self.limits = ((throttle_window, throttle_limit), (block_window, block_limit))
+        self.on_block = on_block
+        self.exempt = exempt
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.blocked = set()
+        self._subjects = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + sweep_interval
+        self.stats = {"checked": 0, "rejected": 0, "failures": 0, "blocked": 0}
+
+    def _execute(self, query, params, fetch=False):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall() if fetch else cursor.rowcount
+            finally:
+                cursor.close()
+
+    def _merge(self, windows, rows, now):
+        # Інший процес міг зарахувати більше невдач - беремо більше з двох значень
+        for length, bucket, failures in rows:
+            for window, (window_length, _) in zip(windows, self.limits):
+                if window_length != length:
+                    continue
+                current = int(now // length)
+                window.roll(current)
+                if bucket == current:
+                    window.current = max(window.current, failures)
+                elif bucket == current - 1:
+                    window.previous = max(window.previous, failures)
+
+    def _read(self, subject):
+        return self._execute(READ_FAILURES_QUERY, (subject,), fetch=True)
+
+    def _load(self, subject):
+        """Перша спроба користувача в цьому процесі: лічильники беруться з бази, далі - лише з пам'яті."""
+        windows = [_Window() for _ in self.limits]
+        if self.pool is not None:
+            try:
+                self._merge(windows, self._read(subject), time.time())
+            except mysql.connector.Error as err:
+                logging.error(f"Не вдалося прочитати невдалі спроби {subject}: {err}")
+        with self._lock:
+            if len(self._subjects) > 10000:
+                self._prune(time.time())
+            return self._subjects.setdefault(subject, windows)
+
+    def _prune(self, now):
+        for subject in [subject for subject, windows in self._subjects.items()
+                        if not any(window.estimate(now, length) for window, (length, _) in zip(windows, self.limits))]:
+            del self._subjects[subject]
+
+    def allow(self, subject):
+        subject = int(subject)
+        windows = self._subjects.get(subject)
+        if windows is None and subject not in self.blocked:
+            windows = self._load(subject)
+        with self._lock:
+            self.stats["checked"] += 1
+            (throttle_window, throttle_limit), _ = self.limits
+            if subject in self.blocked or windows[0].estimate(time.time(), throttle_window) >= throttle_limit:
+                self.stats["rejected"] += 1
+                return False
+        return True
+
+    def failed(self, subject):
+        """Зараховує невдалу спробу. Повертає True, якщо користувача щойно заблоковано."""
+        subject = int(subject)
+        windows = self._subjects.get(subject) or self._load(subject)
+        now = time.time()
+        with self._lock:
+            self.stats["failures"] += 1
+            for window, (length, _) in zip(windows, self.limits):
+                window.estimate(now, length)
+                window.current += 1
+        if self.pool is not None:
+            self._store(subject, windows, now)
+        (block_window, block_limit) = self.limits[1]
+        if self.exempt and self.exempt(subject):
+            return False
+        with self._lock:
+            if subject in self.blocked or windows[1].estimate(now, block_window) < block_limit:
+                return False
+            self.blocked.add(subject)
+            self.stats["blocked"] += 1
+        logging.error(f"Користувач {subject} заблокований: {block_limit} невдалих спроб за {block_window} с")
+        if self.on_block:
+            self.on_block(subject)
+        return True
+
+    def _store(self, subject, windows, now):
+        try:
+            for length, _ in self.limits:
+                self._execute("""
+                    INSERT INTO auth_failures (subject, window_length, bucket, failures, expires_at)
+                    VALUES (%s, %s, %s, 1, NOW() + INTERVAL %s SECOND)
+                    ON DUPLICATE KEY UPDATE failures = failures + 1
+                """, (subject, length, int(now // length), 2 * length))
+            rows = self._read(subject)
+            with self._lock:
+                self._merge(windows, rows, now)
+            if time.monotonic() >= self._next_sweep:
+                self.sweep()
+        except mysql.connector.Error as err:
+            logging.error(f"Не вдалося зберегти невдалу спробу {subject}: {err}")
+
+    def succeeded(self, subject):
+        """Вдала спроба скидає лічильники (запит у базу - лише якщо були невдачі)."""
+        subject = int(subject)
+        windows = self._subjects.get(subject)
+        if windows and any(window.current or window.previous for window in windows):
+            self.reset(subject)
+
+    def reset(self, subject):
+        """Скидає лічильники і блокування, напр. після ручного розблокування модератором."""
+        subject = int(subject)
+        with self._lock:
+            self._subjects.pop(subject, None)
+            self.blocked.discard(subject)
+        if self.pool is not None:
+            try:
+                self._execute("DELETE FROM auth_failures WHERE subject = %s", (subject,))
+            except mysql.connector.Error as err:
+                logging.error(f"Не вдалося скинути невдалі спроби {subject}: {err}")
+
+    def sweep(self):
+        self._next_sweep = time.monotonic() + self.sweep_interval
+        while self._execute("DELETE FROM auth_failures WHERE expires_at <= NOW() LIMIT %s",
+                            (self.sweep_batch,)) >= self.sweep_batch:
+            pass
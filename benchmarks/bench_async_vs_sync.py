@@ -0,0 +1,116 @@
+"""
+Порівнює диспетчери оновлень: синхронний (ChatDispatcher, пул потоків) та асинхронний
+(AsyncChatDispatcher, asyncio) при великій кількості чатів одночасно.
+
+    python benchmarks/bench_async_vs_sync.py --chats 1000 --messages 3 --workers 8 --native-share 0.3
+
+Обробник імітує типову команду: запит до MySQL, запит до Hetzner API і відповідь у Telegram
+(затримки задаються параметрами) через time.sleep у пулі потоків і asyncio.sleep в event loop.
+Звертань до мережі немає, обробники bot.py та async_runtime.py не викликаються, тож це модель,
+а не вимірювання рантаймів. Як і async_runtime.py, асинхронний варіант виконує в event loop лише
+частку оновлень --native-share, а решту віддає пулу з --workers потоків; з --native-share 1
+(усі оновлення нативні) результат - верхня межа виграшу, недосяжна з двома нативними командами.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dispatcher import AsyncChatDispatcher, ChatDispatcher  # noqa: E402
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def report(name, total, elapsed, latencies):
+    print(f"{name:6} {elapsed:8.2f} с  {total / elapsed:9.1f} оновл./с  "
+          f"p50 {percentile(latencies, 0.5) * 1000:8.1f} мс  p95 {percentile(latencies, 0.95) * 1000:8.1f} мс")
+
+
+def bench_sync(args, delays):
+    total = args.chats * args.messages
+    latencies = []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def handler(enqueued):
+        for delay in delays:
+            time.sleep(delay)
+        with lock:
+            latencies.append(time.perf_counter() - enqueued)
+            if len(latencies) == total:
+                done.set()
+
+    dispatcher = ChatDispatcher(handler, workers=args.workers, queue_size=total)
+    started = time.perf_counter()
+    for _ in range(args.messages):
+        for chat_id in range(args.chats):
+            dispatcher.submit(chat_id, time.perf_counter())
+    done.wait()
+    elapsed = time.perf_counter() - started
+    dispatcher.stop()
+    return total, elapsed, latencies
+
+
+async def bench_async(args, delays):
+    total = args.chats * args.messages
+    latencies = []
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    loop = asyncio.get_running_loop()
+
+    def delegated():
+        for delay in delays:
+            time.sleep(delay)
+
+    async def handler(item):
+        enqueued, native = item
+        if native:
+            for delay in delays:
+                await asyncio.sleep(delay)
+        else:
+            await loop.run_in_executor(executor, delegated)
+        latencies.append(time.perf_counter() - enqueued)
+
+    dispatcher = AsyncChatDispatcher(handler, queue_size=total)
+    started = time.perf_counter()
+    for _ in range(args.messages):
+        for chat_id in range(args.chats):
+            # Частка чатів з нативними командами; решта - як делеговані обробники bot.py
+            native = chat_id % 100 < args.native_share * 100
+            await dispatcher.submit(chat_id, (time.perf_counter(), native))
+    await dispatcher.join()
+    executor.shutdown()
+    return total, time.perf_counter() - started, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=3, help="оновлень від кожного чату")
+    parser.add_argument("--workers", type=int, default=8, help="потоків у синхронному рантаймі")
+    parser.add_argument("--db-ms", type=float, default=5)
+    parser.add_argument("--api-ms", type=float, default=150)
+    parser.add_argument("--send-ms", type=float, default=40)
+    parser.add_argument("--native-share", type=float, default=1.0,
+                        help="частка оновлень, які async обробляє в event loop (решта - у пулі потоків)")
+    parser.add_argument("--skip-sync", action="store_true", help="лише asyncio (sync при 1k чатів довгий)")
+    args = parser.parse_args()
+
+    delays = [args.db_ms / 1000, args.api_ms / 1000, args.send_ms / 1000]
+    print(f"{args.chats} чатів x {args.messages} оновлень, I/O на оновлення: "
+          f"{sum(delays) * 1000:.0f} мс, потоків: {args.workers}, нативних в async: {args.native_share:.0%}")
+    if not args.skip_sync:
+        report("sync", *bench_sync(args, delays))
+    report("async", *asyncio.run(bench_async(args, delays)))
+
+
+if __name__ == "__main__":
+    main()
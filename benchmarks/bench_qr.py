@@ -0,0 +1,96 @@
+"""
+Генерація QR-кодів 2FA: qrcode.make + PNG через Pillow (як було в обробниках) проти render_png,
+а також затримка під хвилею реєстрацій: рендер в обробнику проти QRRenderer.
+
+    python benchmarks/bench_qr.py --codes 200 --users 50 --workers 8
+
+Під хвилею --users користувачів одночасно отримують QR-код у --workers потоках-обробниках,
+поки інші обробники відповідають на легкі оновлення; для них вимірюється затримка відповіді.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from qr_render import QRRenderer, render_png  # noqa: E402
+
+URI = "otpauth://totp/HetznerBot:{}?secret=JBSWY3DPEHPK3PXPJBSWY3DPEHPK3PXP&issuer=HetznerBot"
+
+
+def make_png_pillow(data):
+    import qrcode
+
+    bio = BytesIO()
+    qrcode.make(data).save(bio, format="PNG")
+    return bio.getvalue()
+
+
+def run(name, render, codes):
+    sizes = []
+    started = time.perf_counter()
+    for index in range(codes):
+        sizes.append(len(render(URI.format(index))))
+    elapsed = time.perf_counter() - started
+    print(f"{name:28} {elapsed / codes * 1000:8.2f} мс/код  {statistics.mean(sizes):8.0f} байт")
+
+
+def onboarding_wave(name, render, users, workers):
+    """Затримка легких оновлень (на кшталт 'мій айді'), поки інші обробники рендерять QR-коди."""
+    latencies = []
+    done = threading.Event()
+
+    def ticker():
+        while not done.is_set():
+            # Оновлення "надходить" через 1 мс; затримка - від надходження до кінця обробки, разом з очікуванням GIL
+            arrived = time.perf_counter() + 0.001
+            time.sleep(0.001)
+            sum(range(1000))
+            latencies.append(time.perf_counter() - arrived)
+
+    with ThreadPoolExecutor(workers) as executor:
+        thread = threading.Thread(target=ticker)
+        thread.start()
+        started = time.perf_counter()
+        list(executor.map(lambda index: render(URI.format(index)), range(users)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        thread.join()
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{name:28} хвиля {elapsed:6.2f} с, легкі оновлення p50 {statistics.median(latencies) * 1000:.3f} мс, "
+          f"p99 {p99:.3f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codes", type=int, default=200)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args()
+
+    try:
+        make_png_pillow(URI.format(0))
+    except ImportError:
+        print("qrcode або Pillow не встановлено - порівняння з ними пропущено")
+    else:
+        run("qrcode.make + Pillow", make_png_pillow, args.codes)
+    run("render_png", render_png, args.codes)
+
+    onboarding_wave("рендер в обробнику", render_png, args.users, args.workers)
+    renderer = QRRenderer(processes=args.processes)
+    renderer.start()
+    try:
+        onboarding_wave(f"QRRenderer ({args.processes} проц.)", renderer.render, args.users, args.workers)
+    finally:
+        renderer.shutdown()
+
+
+if __name__ == "__main__":
+    main()
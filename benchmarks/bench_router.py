@@ -0,0 +1,79 @@
+"""
+Вартість вибору обробника текстового повідомлення залежно від кількості команд:
+перебір func-фільтрів, як у telebot (кожен фільтр сам робить strip().lower()), проти TextRouter.
+
+    python benchmarks/bench_router.py --commands 10 30 100 300
+
+Для кожного розміру вимірюються три випадки: перша команда в списку, остання і текст без команди
+(потрапляє до загального обробника після перевірки всіх фільтрів).
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from router import TextRouter  # noqa: E402
+
+
+class Message:
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+
+def handler(message):
+    return message
+
+
+def linear_handlers(texts):
+    handlers = [(lambda message, text=text: message.text.strip().lower() == text, handler) for text in texts]
+    # Загальний обробник content_types=['text'] - останній у списку
+    handlers.append((lambda message: True, handler))
+    return handlers
+
+
+def linear_dispatch(handlers, message):
+    for test, func in handlers:
+        if test(message):
+            return func(message)
+
+
+def build_router(texts):
+    router = TextRouter()
+    for text in texts:
+        router.command(text)(handler)
+    router.default(handler)
+    return router
+
+
+def measure(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--commands", type=int, nargs="+", default=[10, 30, 100, 300])
+    parser.add_argument("--number", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'команд':>7} {'випадок':>9} {'перебір, нс':>12} {'dict, нс':>9}")
+    for count in args.commands:
+        texts = [f"команда номер {index}" for index in range(count)]
+        handlers = linear_handlers(texts)
+        router = build_router(texts)
+        cases = {
+            "перша": Message("  Команда номер 0 "),
+            "остання": Message(f"Команда номер {count - 1}"),
+            "промах": Message("довільний текст"),
+        }
+        for name, message in cases.items():
+            linear = measure(lambda: linear_dispatch(handlers, message), args.number)
+            routed = measure(lambda: router.dispatch(message), args.number)
+            print(f"{count:>7} {name:>9} {linear:>12.0f} {routed:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Холодний запуск bot.py: профіль імпортів (як python -X importtime) і час до першого обробленого оновлення.
+
+    python benchmarks/bench_startup.py --runs 5 --top 15
+    python benchmarks/bench_startup.py --first-update
+
+Імпорт bot.py не звертається ні до бази, ні до мережі, тож профіль імпортів знімається без них.
+Для --first-update потрібна база з налаштувань bot.py: бот запускається через main(), а Telegram
+замінює локальний HTTP-сервер, що одразу віддає одне оновлення - як повідомлення, яке чекало,
+поки бот перезапускався. Час рахується від старту процесу і порівнюється з STARTUP_TARGET з bot.py.
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Процес бота: Telegram API - локальний сервер, після першого обробленого оновлення друкує startup_stats
+FIRST_UPDATE_SCRIPT = """
+import json, os, threading, time
+import telebot.apihelper
+telebot.apihelper.API_URL = "http://127.0.0.1:{port}/bot{{0}}/{{1}}"
+import bot
+threading.Thread(target=bot.main, daemon=True).start()
+while bot.startup_stats["first_update"] is None:
+    time.sleep(0.002)
+print("STARTUP", json.dumps(dict(bot.startup_stats, target=bot.STARTUP_TARGET)), flush=True)
+os._exit(0)
+"""
+
+
+def run_python(args, cwd):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    # Окрема група процесів, щоб разом з ботом завершити і його дочірні процеси (рендер QR-кодів)
+    return subprocess.Popen([sys.executable, *args], cwd=cwd, env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, text=True, start_new_session=True)
+
+
+def parse_importtime(stderr):
+    """Рядки 'import time: self | cumulative | name' -> [(self_us, cumulative_us, глибина, name)]."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return rows
+
+
+def import_profile(args, cwd):
+    walls, rows = [], []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        process = run_python(["-X", "importtime", "-c", "import bot"], cwd)
+        _, stderr = process.communicate()
+        walls.append(time.perf_counter() - started)
+        if process.returncode:
+            sys.exit(f"import bot завершився з помилкою:\n{stderr}")
+        rows = parse_importtime(stderr)
+    total = next(cumulative for _, cumulative, depth, name in rows if depth == 0 and name == "bot")
+    print(f"python -c 'import bot': {statistics.median(walls) * 1000:.0f} мс (медіана {args.runs} запусків), "
+          f"з них імпорт bot: {total / 1000:.0f} мс")
+    print("\nНайдовші прямі імпорти bot.py (сумарно з вкладеними):")
+    direct = sorted((row for row in rows if row[2] == 1), key=lambda row: -row[1])
+    for _, cumulative, _, name in direct[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} мс  {name}")
+    print("\nНайдовші модулі за власним часом:")
+    for self_us, _, _, name in sorted(rows, key=lambda row: -row[0])[:args.top]:
+        print(f"  {self_us / 1000:8.1f} мс  {name}")
+
+
+class FakeTelegram(BaseHTTPRequestHandler):
+    """Telegram Bot API, що віддає одне оновлення на перший getUpdates і підтверджує решту запитів."""
+    update = None
+    delivered = threading.Event()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        method = urlsplit(self.path).path.rsplit("/", 1)[-1]
+        if method == "getUpdates":
+            if FakeTelegram.delivered.is_set():
+                time.sleep(1)
+                result = []
+            else:
+                FakeTelegram.delivered.set()
+                result = [FakeTelegram.update]
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method.startswith("send"):
+            result = dict(FakeTelegram.update["message"], message_id=2)
+        else:
+            result = True
+        body = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # Бота вже зупинено посеред long polling
+            pass
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+def first_update(args, cwd):
+    chat = {"id": args.chat, "type": "private", "first_name": "bench"}
+    FakeTelegram.update = {"update_id": 1, "message": {
+        "message_id": 1, "date": int(time.time()), "chat": chat, "from": dict(chat, is_bot=False), "text": args.text,
+    }}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTelegram)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        started = time.perf_counter()
+        process = run_python(["-c", FIRST_UPDATE_SCRIPT.format(port=server.server_address[1])], cwd)
+        # Дочірні процеси бота тримають stdout відкритим, тож читання закінчується на рядку STARTUP, а не на EOF
+        lines = []
+
+        def read_stats():
+            for line in process.stdout:
+                if line.startswith("STARTUP "):
+                    lines.append(line[len("STARTUP "):])
+                    return
+
+        reader = threading.Thread(target=read_stats, daemon=True)
+        reader.start()
+        reader.join(args.timeout)
+        elapsed = time.perf_counter() - started
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    finally:
+        server.shutdown()
+    if not lines:
+        sys.exit(f"Бот не обробив оновлення за {args.timeout} с:\n{process.stderr.read()}")
+    stats = json.loads(lines[0])
+    print(f"Від старту процесу до першого обробленого оновлення: {elapsed:.2f} с "
+          f"({'✅' if elapsed <= stats['target'] else '❌'} ціль {stats['target']} с)")
+    warmed = "-" if stats["warmed"] is None else f"{stats['warmed']:.2f} с"
+    print(f"Від початку виконання bot.py: готовність {stats['ready']:.2f} с, "
+          f"перше оновлення {stats['first_update']:.2f} с, прогрів {warmed}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--first-update", action="store_true", help="запустити бота (потрібна база з bot.py)")
+    parser.add_argument("--chat", type=int, default=1, help="chat id відправника оновлення")
+    parser.add_argument("--text", default="мій айді")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    # bot.log, .handler-saves/ та інші файли бота створюються в тимчасовій теці
+    with tempfile.TemporaryDirectory() as cwd:
+        import_profile(args, cwd)
+        if args.first_update:
+            print()
+            first_update(args, cwd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Швидкість перевірки 2FA-кодів: pyotp.TOTP(secret).verify (як було в обробниках) проти TOTPEngine.
+
+    python benchmarks/bench_totp.py --users 1000 --checks 200000
+
+Для кожної перевірки береться випадковий користувач і його поточний код. Щоб захист від повтору
+не відхиляв той самий код, кожна перевірка TOTPEngine виконується від імені нового subject.
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from totp_engine import TOTPEngine  # noqa: E402
+
+
+class UncachedEngine(TOTPEngine):
+    """TOTPEngine, що щоразу заново розкодовує ключ і обчислює коди вікна."""
+
+    def _valid_codes(self, secret, step):
+        self.forget(secret)
+        return super()._valid_codes(secret, step)
+
+
+def random_secret(rng):
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZ234567"
+    return "".join(rng.choice(alphabet) for _ in range(32))
+
+
+def run(name, verify, cases):
+    started = time.perf_counter()
+    accepted = sum(1 for secret, code in cases if verify(secret, code))
+    elapsed = time.perf_counter() - started
+    print(f"{name:28} {len(cases) / elapsed:12.0f} перевірок/с  ({elapsed:.2f} с, прийнято {accepted})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--checks", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    secrets_ = [random_secret(rng) for _ in range(args.users)]
+    reference = TOTPEngine()
+    step = int(time.time() // reference.interval)
+    current = {secret: reference.code_at(secret, step) for secret in secrets_}
+    cases = []
+    for _ in range(args.checks):
+        secret = rng.choice(secrets_)
+        # Кожна десята спроба - невірний код
+        cases.append((secret, current[secret] if rng.random() > 0.1 else "000000"))
+
+    try:
+        import pyotp
+    except ImportError:
+        print("pyotp не встановлено - порівняння з ним пропущено")
+    else:
+        run("pyotp.TOTP(...).verify", lambda secret, code: pyotp.TOTP(secret).verify(code), cases)
+
+    subjects = itertools.count()
+    uncached = UncachedEngine(max_cached=args.checks + 1)
+    run("TOTPEngine без кешу", lambda secret, code: uncached.verify(next(subjects), secret, code), cases)
+    engine = TOTPEngine(max_cached=args.checks + 1)
+    run("TOTPEngine", lambda secret, code: engine.verify(next(subjects), secret, code), cases)
+    print(f"обчислень вікна: {engine.stats['precomputed']} на {args.users} користувачів")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Відтворює записані оновлення Telegram (WEBHOOK_RECORD_FILE) на локальний webhook бота
+і вимірює пропускну здатність (оновлень/с) та затримку відповіді.
+
+    python benchmarks/bench_webhook.py --url http://127.0.0.1:8080/telegram --secret SECRET \\
+        --file updates.jsonl --concurrency 16 --count 2000
+
+Без --file генеруються синтетичні текстові оновлення "мій айді" від різних chat id.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def synthetic_updates(chats):
+    for n in itertools.count(1):
+        chat_id = 100000 + n % chats
+        yield json.dumps({
+            "update_id": n,
+            "message": {
+                "message_id": n,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private", "first_name": "bench"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "bench"},
+                "text": "мій айді",
+            },
+        }).encode("utf-8")
+
+
+def recorded_updates(path):
+    with open(path, "rb") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if not lines:
+        raise SystemExit(f"{path}: немає записаних оновлень")
+    # update_id робимо унікальними, щоб повторне відтворення не виглядало дублікатом
+    for n, line in enumerate(itertools.cycle(lines), start=1):
+        update = json.loads(line)
+        update["update_id"] = n
+        yield json.dumps(update).encode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8080/telegram")
+    parser.add_argument("--secret", required=True)
+    parser.add_argument("--file")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--chats", type=int, default=50)
+    args = parser.parse_args()
+
+    source = recorded_updates(args.file) if args.file else synthetic_updates(args.chats)
+    bodies = list(itertools.islice(source, args.count))
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def post(body):
+        request = urllib.request.Request(args.url, data=body, method="POST", headers={
+            "Content-Type": "application/json",
+            "X-Telegram-Bot-Api-Secret-Token": args.secret,
+        })
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+        except urllib.error.URLError as err:
+            with lock:
+                errors.append(str(err))
+            return
+        with lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(post, bodies))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Оновлень: {len(bodies)}, помилок: {len(errors)}, час: {elapsed:.2f} с")
+    print(f"Пропускна здатність: {len(latencies) / elapsed:.1f} оновлень/с")
+    if latencies:
+        p50 = latencies[len(latencies) // 2] * 1000
+        p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+        print(f"Затримка: p50 {p50:.1f} мс, p95 {p95:.1f} мс")
+    if errors:
+        print(f"Перша помилка: {errors[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,79 @@
-import telebot
 import mysql.connector
-import pyotp
-import qrcode
 import logging
-import requests
 import secrets
-import string
 import functools
+import html
+import json
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from telebot.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-
+from auth_limiter import AttemptLimiter
+from cluster import ChangeCounter, Lease, UpdateRouter, poll_updates, run_worker
+from db_pool import ConnectionPool
+from dispatcher import DispatchingTeleBot
+from markup_cache import MarkupCache
+from migrations import MigrationError, migrate
+from one_time_codes import OneTimeCodes
+from qr_render import QRRenderer
+from totp_engine import TOTPEngine
+from router import TextRouter
+from send_queue import PRIORITY_BULK, PRIORITY_NORMAL, PRIORITY_URGENT, RateLimitedSendMixin, SendLimiter
+from state_store import DBStateStore, MemoryStateStore
+from hetzner import ActionTracker, HetznerClient, HetznerError, ServerStatusCache, StatusWatcher
+from webhook_server import WebhookServer
+
+STARTED_AT = time.monotonic()  # від цього моменту рахуються час запуску і час до першого обробленого оновлення
 
 # ==================== Налаштування Telegram бота ====================
 TOKEN = "TELEGRAM_TOKEN"
 first_moderator_id = "MODERATOR"
-bot = telebot.TeleBot(TOKEN)
+DISPATCH_WORKERS = 8  # скільки чатів обробляється паралельно
+DISPATCH_QUEUE_SIZE = 1000  # максимум оновлень, що чекають на обробку
+SEND_GLOBAL_RATE = 30  # вихідних повідомлень за секунду на весь бот (ліміт Telegram)
+SEND_PER_CHAT_RATE = 1  # повідомлень за секунду в один чат
+SEND_PER_CHAT_BURST = 3  # скільки повідомлень поспіль можна надіслати в чат без очікування
+
+
+class HetznerBot(RateLimitedSendMixin, DispatchingTeleBot):
+    """DispatchingTeleBot, вихідні повідомлення якого проходять через SendLimiter."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._interactions_lock = threading.Lock()
+        self.interaction_stats = {"updates": 0, "api_calls": 0}
+
+    def _process_update(self, update):
+        # Скільки запитів до Telegram коштує одна взаємодія - видно в /stats
+        calls = self.calls_made(super()._process_update, update)
+        with self._interactions_lock:
+            self.interaction_stats["updates"] += 1
+            self.interaction_stats["api_calls"] += calls
+            first = self.interaction_stats["updates"] == 1
+        if first:
+            record_first_update()
+
+
+bot = HetznerBot(TOKEN, workers=DISPATCH_WORKERS, queue_size=DISPATCH_QUEUE_SIZE)
+text_router = TextRouter()  # кнопки меню й текстові команди, див. router.py
+
+# ==================== Режим отримання оновлень ====================
+UPDATE_MODE = "polling"  # "polling" - long polling, "webhook" - вбудований HTTP-сервер
+WEBHOOK_URL = ""  # публічна https-адреса, напр. https://bot.example.com/telegram (проксі -> WEBHOOK_LISTEN)
+WEBHOOK_LISTEN = "127.0.0.1"
+WEBHOOK_PORT = 8080
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_SECRET = ""  # якщо порожній, генерується при кожному запуску
+WEBHOOK_RECORD_FILE = None  # шлях до .jsonl, щоб записувати оновлення для benchmarks/bench_webhook.py
+CLUSTER_WORKERS = 0  # 0 - один процес; N - ingress + N процесів-обробників (оновлення розподіляються за chat id)
+CLUSTER_LEASE_TTL = 90  # скільки секунд діє оренда ролі poller-а (для кількох ingress у режимі polling)
+PRINCIPALS_CHECK_INTERVAL = 2  # як часто процеси-обробники перевіряють зміни users/admins_2fa, секунди
+# Ліміт Telegram спільний для всього бота, тому в кластері ділиться між процесами-обробниками
+bot.limiter = SendLimiter(global_rate=SEND_GLOBAL_RATE / max(1, CLUSTER_WORKERS), per_chat_rate=SEND_PER_CHAT_RATE,
+                          per_chat_burst=SEND_PER_CHAT_BURST)
 
 logging.basicConfig(level=logging.INFO, filename="bot.log", format="%(asctime)s - %(levelname)s - %(message)s")
 
@@ -23,11 +82,57 @@ DB_HOST = "localhost"
 DB_USER = "USER"
 DB_PASSWORD = "PASSWORD"
 DB_NAME = "DB_NAME"
-# ==================== Версія коду ====================
-VERSION = "1.2"
+DB_POOL_SIZE = 5  # максимальна кількість одночасно відкритих з'єднань
+DB_POOL_TIMEOUT = 10  # скільки секунд чекати на вільне з'єднання
+DB_POOL_PING_INTERVAL = 30  # після скількох секунд простою перевіряти з'єднання ping-ом
+# ==================== Hetzner Cloud API ====================
+HETZNER_CONNECT_TIMEOUT = 5  # секунди на встановлення з'єднання
+HETZNER_READ_TIMEOUT = 20  # секунди на відповідь
+HETZNER_RETRIES = 3  # повтори при 429/5xx
+SERVER_STATUS_TTL = 10  # скільки секунд показувати закешований статус сервера
+DASHBOARD_TOKEN_CONCURRENCY = 2  # паралельні запити сторінок GET /servers на один токен
+DASHBOARD_MAX_TOKENS = 4  # скільки токенів (проєктів) опитувати одночасно
+STATUS_TABLE_LIMIT = 3500  # символів таблиці статусів в одному <pre> (ліміт Telegram - 4096 на повідомлення)
+BULK_ACTION_CONCURRENCY = 5  # скільки серверів обробляти одночасно при масовій дії
+GROUPS_PAGE_SIZE = 5  # груп на сторінці "список груп"
+GROUP_PICKER_PAGE_SIZE = 20  # кнопок-груп на сторінці вибору групи
+WATCHER_ENABLED = True  # фонове стеження за статусами для підписаних груп
+WATCHER_MIN_INTERVAL = 30  # мінімальний інтервал опитування одного токена, секунди
+WATCHER_MAX_INTERVAL = 600  # максимальний інтервал опитування, секунди
+WATCHER_BUDGET_SHARE = 0.3  # частка ліміту запитів токена, яку може витрачати спостерігач
+# ==================== Стан діалогів ====================
+STATE_BACKEND = "memory"  # "memory" - у пам'яті процесу, "db" - таблиця conversation_state (переживає перезапуск)
+STATE_TTL = 900  # скільки секунд зберігається стан незавершеного діалогу
+QR_RENDER_PROCESSES = 1  # процесів для рендеру QR-кодів 2FA (0 - окремий потік)
+QR_SCALE = 4  # пікселів на модуль QR-коду
+TOTP_VALID_WINDOW = 0  # скільки сусідніх 30-секундних кроків 2FA-коду ще приймати (0 - лише поточний, як pyotp)
+AUTH_THROTTLE_LIMIT = 5  # невдалих спроб 2FA/одноразового коду, після яких спроби тимчасово відхиляються
+AUTH_THROTTLE_WINDOW = 600  # за скільки секунд рахуються спроби для тимчасового обмеження
+AUTH_BLOCK_LIMIT = 20  # невдалих спроб, після яких користувач потрапляє в blocked_users
+AUTH_BLOCK_WINDOW = 86400  # за скільки секунд рахуються спроби для блокування
+ONE_TIME_CODE_TTL = 86400  # скільки секунд дійсний одноразовий код реєстрації
+ONE_TIME_CODES_SWEEP_INTERVAL = 600  # як часто видаляти прострочені та погашені коди (секунди)
+# Зберігати очікування наступного кроку на диск (.handler-saves/). Дані діалогів лежать у state, тож без
+# STATE_BACKEND = "db" відновлені після перезапуску кроки все одно не знайшли б свого стану
+SAVE_NEXT_STEP_HANDLERS = STATE_BACKEND == "db"
+STARTUP_TARGET = 1.0  # ціль: секунд від запуску до обробки оновлення, що чекало під час перезапуску (bench_startup.py)
+PRINCIPALS_LOAD_TIMEOUT = 30  # скільки секунд оновлення, що прийшло під час запуску, чекає на індекс користувачів
+PRINCIPALS_RETRY_INTERVAL = 5  # через скільки секунд повторити завантаження індексу, якщо база не відповіла
 
 
 # ==================== Декоратори для перевірки реєстрації та ролі ====================
+def attempt_limited(func):
+    """Для кроків, що чекають 2FA/одноразовий код: понад ліміт спроб відповідь відхиляється до будь-якої перевірки."""
+    @functools.wraps(func)
+    def wrapper(message, *args, **kwargs):
+        if not auth_limiter.allow(message.from_user.id):
+            reply_with_menu(message.chat.id, "⛔ Забагато невдалих спроб. Спробуйте пізніше.")
+            return
+        return func(message, *args, **kwargs)
+
+    return wrapper
+
+
 def registered_only(func):
     @functools.wraps(func)
     def wrapper(message, *args, **kwargs):
@@ -69,272 +174,377 @@ def moderator_callback_only(func):
     return wrapper
 
 
-# ==================== Функція перевірки версії бази даних ====================
+# ==================== Допоміжна функція для роботи з базою даних ====================
+db_pool = ConnectionPool(
+    size=DB_POOL_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    ping_interval=DB_POOL_PING_INTERVAL,
+    host=DB_HOST,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    database=DB_NAME
+)
 
 
-# ==================== Допоміжна функція для роботи з базою даних ====================
 def execute_db(query, params=None, fetchone=False, commit=False):
+    started = time.monotonic()
     try:
-        connection = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-        cursor = connection.cursor()
-        cursor.execute(query, params)
-        result = None
-        if commit:
-            connection.commit()
-        else:
-            result = cursor.fetchone() if fetchone else cursor.fetchall()
-        cursor.close()
-        connection.close()
+        with db_pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(query, params)
+                result = None
+                if commit:
+                    connection.commit()
+                    result = True
+                else:
+                    result = cursor.fetchone() if fetchone else cursor.fetchall()
+            finally:
+                cursor.close()
         return result
     except mysql.connector.Error as err:
         logging.error(f"Error executing query: {err}")
         return None
-
-
-# ==================== Створення таблиць ====================
-create_groups_table = """
-CREATE TABLE IF NOT EXISTS groups_for_hetzner (
-    group_name VARCHAR(255) NOT NULL,
-    key_hetzner VARCHAR(255) NOT NULL,
-    group_signature VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci DEFAULT NULL,
-    PRIMARY KEY (group_name)
-);
-"""
-create_users_table = """
-CREATE TABLE IF NOT EXISTS users (
-    user_id VARCHAR(50) NOT NULL,
-    username VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci DEFAULT NULL,
-    group_name VARCHAR(255) NOT NULL,
-    secret_key VARCHAR(255) NOT NULL,
-    PRIMARY KEY (user_id),
-    FOREIGN KEY (group_name) REFERENCES groups_for_hetzner(group_name) ON DELETE CASCADE
-);
-"""
-create_emergency_bot_subscribers = """
-CREATE TABLE IF NOT EXISTS emergency_bot_subscribers (
-    chat_id VARCHAR(50),
-    admin_id VARCHAR(50),
-    FOREIGN KEY (admin_id) REFERENCES admins_2fa(admin_id) ON DELETE CASCADE
-);
-"""
-create_time_secret_key = """
-CREATE TABLE IF NOT EXISTS time_key (
-    group_name VARCHAR(255) NOT NULL,
-    time_key VARCHAR(255) NOT NULL,
-    FOREIGN KEY (group_name) REFERENCES groups_for_hetzner(group_name) ON DELETE CASCADE
-);
-"""
-create_admins_table = """
-CREATE TABLE IF NOT EXISTS admins_2fa (
-    admin_id VARCHAR(50) NOT NULL PRIMARY KEY,
-    username VARCHAR(255) NOT NULL,
-    secret_key VARCHAR(255) NOT NULL
-);
-"""
-create_pending_admins_table = """
-CREATE TABLE IF NOT EXISTS pending_admins (
-    moderator_id VARCHAR(50) NOT NULL PRIMARY KEY
-);
+    finally:
+        db_pool.record_query(time.monotonic() - started)
+
+
+# ==================== Гарячі запити ====================
+# Запити, що виконуються на кожну взаємодію; їхні плани перевіряє check_query_plans.py
+GROUP_SERVERS_QUERY = "SELECT server_id, server_name FROM hetzner_servers WHERE group_name = %s"
+GROUP_KEY_QUERY = "SELECT key_hetzner FROM groups_for_hetzner WHERE group_name = %s"
+BLOCKED_USER_QUERY = "SELECT nickname FROM blocked_users WHERE user_id = %s"
+PENDING_ADMIN_QUERY = "SELECT moderator_id FROM pending_admins WHERE moderator_id = %s"
+EMERGENCY_SUBSCRIBER_QUERY = "SELECT chat_id FROM emergency_bot_subscribers WHERE chat_id = %s"
+EMERGENCY_UNSUBSCRIBE_QUERY = "DELETE FROM emergency_bot_subscribers WHERE chat_id = %s"
+WATCH_SUBSCRIPTION_QUERY = "SELECT chat_id FROM server_watch_subscribers WHERE chat_id = %s AND group_name = %s"
+# Лише ті, хто досі в групі: видалений користувач чи модератор з іншою групою сповіщень не отримує
+WATCH_TARGETS_QUERY = """
+    SELECT DISTINCT g.key_hetzner, s.server_id
+    FROM server_watch_subscribers w
+    JOIN users u ON u.user_id = w.chat_id AND u.group_name = w.group_name
+    JOIN groups_for_hetzner g ON g.group_name = w.group_name
+    JOIN hetzner_servers s ON s.group_name = w.group_name
 """
-create_hetzner_servers_table = """
-CREATE TABLE IF NOT EXISTS hetzner_servers (
-    group_name VARCHAR(255) NOT NULL,
-    server_id VARCHAR(255) NOT NULL,
-    server_name VARCHAR(255) DEFAULT NULL,
-    PRIMARY KEY (group_name, server_id),
-    FOREIGN KEY (group_name) REFERENCES groups_for_hetzner(group_name) ON DELETE CASCADE
-);
+WATCH_NOTIFY_QUERY = """
+    SELECT w.chat_id, s.server_id, s.server_name
+    FROM server_watch_subscribers w
+    JOIN users u ON u.user_id = w.chat_id AND u.group_name = w.group_name
+    JOIN groups_for_hetzner g ON g.group_name = w.group_name
+    JOIN hetzner_servers s ON s.group_name = w.group_name
+    WHERE g.key_hetzner = %s AND s.server_id IN ({placeholders})
 """
-create_blocked_users = """
-CREATE TABLE IF NOT EXISTS blocked_users (
-    user_id VARCHAR(50) PRIMARY KEY,
-    block_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    nickname VARCHAR(255),
-    reason TEXT
-);
-"""
-def startup_initial():
-    for query in [create_blocked_users, create_groups_table, create_users_table, create_time_secret_key,
-                  create_admins_table, create_pending_admins_table, create_hetzner_servers_table,
-                  create_emergency_bot_subscribers]:
-        execute_db(query, commit=True)
+
+
+# ==================== Міграції бази даних ====================
 def check_and_update_version():
     try:
-        connection = mysql.connector.connect(
-            host=DB_HOST,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-        cursor = connection.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS version (
-                id INT PRIMARY KEY,
-                version VARCHAR(10) NOT NULL
-            )
-        """)
-        connection.commit()
-        cursor.execute("SELECT version FROM version WHERE id = 1")
-        row = cursor.fetchone()
-        if row:
-            db_version = row[0]
-            if db_version == VERSION:
-                print("База даних актуальна. Ініціалізація пропущена.")
-                print(f"Ваша версія {db_version}")
-            elif round(float(db_version) + 0.1, 1) == float(VERSION):
-                print(f"Оновлення бази даних з версії {db_version} до {VERSION}...")
-                cursor.execute("DROP TABLE emergency_bot_subscribers;")
-                cursor.execute(create_emergency_bot_subscribers)
-                cursor.execute("UPDATE version SET version = %s WHERE id = 1", (VERSION,))
-                connection.commit()
-            else:
-                print("Помилка: версія бази несумісна з поточною версією коду!")
-                print(f"Ваша версія {db_version} а мінімальна {VERSION} ")
+        applied = migrate(db_pool)
+    except (mysql.connector.Error, MigrationError) as err:
+        print(f"Помилка при оновленні схеми бази: {err}")
+        logging.error(f"Помилка при оновленні схеми бази: {err}")
+        exit(1)
+    if applied:
+        print(f"Базу даних оновлено: застосовано міграцій {len(applied)}")
 
-                connection.close()
-                exit(1)
-        else:
-            print("Створення бази данних")
-            cursor.execute("INSERT INTO version (id, version) VALUES (1, %s)", (VERSION,))
-            connection.commit()
-            startup_initial()
-        connection.close()
+
+# ==================== Глобальні змінні та клавіатури ====================
+hetzner = HetznerClient(connect_timeout=HETZNER_CONNECT_TIMEOUT, read_timeout=HETZNER_READ_TIMEOUT,
+                        retries=HETZNER_RETRIES)
+status_cache = ServerStatusCache(hetzner, ttl=SERVER_STATUS_TTL)
+action_tracker = ActionTracker(hetzner)
+qr_renderer = QRRenderer(processes=QR_RENDER_PROCESSES, scale=QR_SCALE)
+one_time_codes = OneTimeCodes(db_pool, ttl=ONE_TIME_CODE_TTL, sweep_interval=ONE_TIME_CODES_SWEEP_INTERVAL)
+
+
+def block_after_failures(user_id):
+    record = get_principal(user_id)
+    execute_db("INSERT IGNORE INTO blocked_users (user_id, nickname, reason) VALUES (%s, %s, %s)",
+               (user_id, record.username if record else None, "Вичерпано кількість спроб введення коду"),
+               commit=True)
+    principals_changed()
+
+
+auth_limiter = AttemptLimiter(db_pool, throttle_limit=AUTH_THROTTLE_LIMIT, throttle_window=AUTH_THROTTLE_WINDOW,
+                              block_limit=AUTH_BLOCK_LIMIT, block_window=AUTH_BLOCK_WINDOW,
+                              on_block=block_after_failures, exempt=lambda user_id: is_moderator(user_id))
+
+
+# Спільна перевірка 2FA для всіх обробників: кеш ключів, коди кроку обчислюються раз, захист від повтору коду
+totp_engine = TOTPEngine(valid_window=TOTP_VALID_WINDOW)
+
+
+def check_totp(message, secret):
+    """Перевіряє 2FA-код з повідомлення; невдала спроба зараховується в auth_limiter."""
+    if totp_engine.verify(message.from_user.id, secret, message.text):
+        auth_limiter.succeeded(message.from_user.id)
+        return True
+    auth_limiter.failed(message.from_user.id)
+    return False
+
+# Клавіатури будуються один раз і зберігаються готовим JSON; див. keyboards_changed()
+markup_cache = MarkupCache()
+# У кластері інші процеси дізнаються про зміну серверів/груп через лічильник і скидають свої клавіатури
+# (створюється в create_change_counters() після міграцій)
+keyboards_changes = None
+
+
+def keyboards_changed(*scopes):
+    """Скидає клавіатури, побудовані з hetzner_servers ("servers") чи groups_for_hetzner ("groups")."""
+    markup_cache.invalidate(*scopes)
+    if keyboards_changes is None:
+        return
+    try:
+        keyboards_changes.bump()
     except mysql.connector.Error as err:
-        print(f"Помилка при роботі з версією бази: {err}")
-        logging.error(f"Помилка при роботі з версією бази: {err}")
-        exit(1)
+        logging.error(f"Не вдалося повідомити інші процеси про зміну клавіатур: {err}")
 
 
-check_and_update_version()
+def main_markup():
+    def build():
+        markup = ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
+        markup.add(KeyboardButton("мій айді"), KeyboardButton("керування сервером"))
+        markup.add(KeyboardButton("статус усіх серверів"), KeyboardButton("масова дія"))
+        return markup
 
+    return markup_cache.get(("menu", "main"), build)
 
-# ==================== Глобальні змінні та клавіатури ====================
-main_markup = ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
-main_markup.add(KeyboardButton("мій айді"), KeyboardButton("керування сервером"))
-
-qr_message_id = {}
-admin_qr_msg_id = {}
-registration_info = {}
-selected_server = {}
-pending_deletion = {}
-secret_message_id = {}
-admin_secret_message_id = {}
-pending_removals = {}
-wrong_attempts = {}
-pending_unblock = {}
-users_cache = set()
-admins_cache = set()
-pending_group_deletion = {}
 
+# Стан багатокрокових діалогів: простір імен (напр. "registration") + id чату -> значення з TTL.
+# Значення мають серіалізуватися в JSON (для STATE_BACKEND = "db"), тому без set/tuple.
+if STATE_BACKEND == "db":
+    state = DBStateStore(db_pool, default_ttl=STATE_TTL)
+else:
+    state = MemoryStateStore(default_ttl=STATE_TTL)
+
+
+def enable_step_persistence(filename="./.handler-saves/step.save"):
+    # Після перезапуску бот продовжує чекати на відповідь у розпочатих діалогах
+    if SAVE_NEXT_STEP_HANDLERS:
+        bot.enable_save_next_step_handlers(delay=2, filename=filename)
+        bot.load_next_step_handlers(filename=filename)
 
-# ==================== Функції перевірки прав доступу ====================
-def update_users_cache():
-    global users_cache, admins_cache
-    users = execute_db("SELECT user_id FROM users", fetchone=False)
-    admins = execute_db("SELECT admin_id FROM admins_2fa", fetchone=False)
-    users_cache = {str(row[0]) for row in users} if users else set()
-    admins_cache = {str(row[0]) for row in admins} if admins else set()
+
+# ==================== Індекс користувачів і модераторів ====================
+class Principal:
+    """
+    Запис про користувача/модератора в пам'яті.
+    user_secret і group_name заповнені для рядка з users, admin_secret - для рядка з admins_2fa.
+    """
+    __slots__ = ("username", "group_name", "user_secret", "admin_secret")
+
+    def __init__(self):
+        self.username = None
+        self.group_name = None
+        self.user_secret = None
+        self.admin_secret = None
 
 
-update_users_cache()
+# Ключ - chat id (int). Оновлюється точково при кожному записі в users/admins_2fa.
+principals = {}
+principals_lock = threading.Lock()
+# Перше завантаження індексу йде у фоні (warm_caches), поки бот уже приймає оновлення
+principals_ready = threading.Event()
+# У кластері інші процеси дізнаються про зміни через лічильник і перечитують індекс повністю
+# (створюється в create_change_counters() після міграцій)
+principals_changes = None
+
+
+def principals_changed():
+    if principals_changes is None:
+        return
+    try:
+        principals_changes.bump()
+    except mysql.connector.Error as err:
+        logging.error(f"Не вдалося повідомити інші процеси про зміну користувачів: {err}")
+
+
+def load_principals():
+    """Перечитує індекс користувачів. Якщо хоч один запит не вдався, лишає попередній індекс і повертає False."""
+    global principals
+    users = execute_db("SELECT user_id, username, group_name, secret_key FROM users", fetchone=False)
+    admins = execute_db("SELECT admin_id, username, secret_key FROM admins_2fa", fetchone=False)
+    blocked = execute_db("SELECT user_id FROM blocked_users", fetchone=False)
+    if users is None or admins is None or blocked is None:
+        logging.error("Не вдалося завантажити індекс користувачів, залишається попередній")
+        return False
+    index = {}
+    for user_id, username, group_name, secret in users:
+        record = index.setdefault(int(user_id), Principal())
+        record.username = username
+        record.group_name = group_name
+        record.user_secret = secret
+    for admin_id, username, secret in admins:
+        record = index.setdefault(int(admin_id), Principal())
+        record.username = record.username or username
+        record.admin_secret = secret
+    with principals_lock:
+        principals = index
+    # Модератор не блокується автоматично, інакше він не зміг би розблокувати ні себе, ні інших
+    auth_limiter.blocked = {int(user_id) for user_id, in blocked
+                            if int(user_id) not in index or index[int(user_id)].admin_secret is None}
+    principals_ready.set()
+    return True
+
+
+def index_user(user_id, username, group_name, secret):
+    with principals_lock:
+        record = principals.setdefault(int(user_id), Principal())
+        record.username = username
+        record.group_name = group_name
+        record.user_secret = secret
+    principals_changed()
+
+
+def index_admin(admin_id, username, secret):
+    with principals_lock:
+        record = principals.setdefault(int(admin_id), Principal())
+        record.username = record.username or username
+        record.admin_secret = secret
+    principals_changed()
+
+
+def unindex_user(user_id):
+    with principals_lock:
+        record = principals.get(int(user_id))
+        if record is not None:
+            totp_engine.forget(record.user_secret)
+            record.group_name = None
+            record.user_secret = None
+            if record.admin_secret is None:
+                del principals[int(user_id)]
+    principals_changed()
+
+
+def unindex_admin(admin_id):
+    with principals_lock:
+        record = principals.get(int(admin_id))
+        if record is not None:
+            totp_engine.forget(record.admin_secret)
+            record.admin_secret = None
+            if record.user_secret is None:
+                del principals[int(admin_id)]
+    principals_changed()
+
+
+def unindex_group(group_name):
+    # Рядки users видаляються каскадно разом з групою
+    with principals_lock:
+        for user_id in [uid for uid, record in principals.items() if record.group_name == group_name]:
+            record = principals[user_id]
+            totp_engine.forget(record.user_secret)
+            record.group_name = None
+            record.user_secret = None
+            if record.admin_secret is None:
+                del principals[user_id]
+    principals_changed()
+
+
+# ==================== Функції перевірки прав доступу ====================
+def get_principal(user_id):
+    if not principals_ready.is_set():
+        # Інакше оновлення, що прийшло під час запуску, вважало б зареєстрованого користувача чужим
+        principals_ready.wait(PRINCIPALS_LOAD_TIMEOUT)
+    try:
+        return principals.get(int(user_id))
+    except (TypeError, ValueError):
+        return None
 
 
 def is_moderator(user_id):
-    return str(user_id) in admins_cache
+    record = get_principal(user_id)
+    return record is not None and record.admin_secret is not None
 
 
 def is_registered_user(user_id):
-    return str(user_id) in users_cache
+    record = get_principal(user_id)
+    return record is not None and record.user_secret is not None
 
 
 def is_user(user_id):
     return is_registered_user(user_id) or is_moderator(user_id)
 
 
-# ==================== Меню та команди для Telegram бота ====================
-def send_commands_menu(message):
-    """
-    Надсилає користувачу меню з кнопками під клавіатурою.
-    Після натискання кнопки її текст просто надсилається в чат.
-    """
-    markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+def get_admin_secret(user_id):
+    record = get_principal(user_id)
+    return record.admin_secret if record else None
 
-    # Команди для звичайного користувача
-    user_commands = ["мій айді", "керування сервером"]
-
-    admin_commands = [
-        "групи",
-        "розблокувати користувача",
-        "модератори",
-        "коди",
-        "підписатися на розсилку про вильоти"
-    ]
-
-    # Додаємо кнопки відповідно до прав користувача
-    buttons = user_commands + admin_commands
-    for button in buttons:
-        markup.add(button)
 
-    bot.send_message(message.chat.id, "Оберіть команду або вкладку:", reply_markup=markup)
+def get_user_secret(user_id):
+    record = get_principal(user_id)
+    return record.user_secret if record else None
 
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "групи")
-def send_commands_menu_gruo(message):
-    markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+def get_user_group(user_id):
+    record = get_principal(user_id)
+    return record.group_name if record else None
+
+
+def get_group_key(group_name):
+    result = execute_db(GROUP_KEY_QUERY, (group_name,), fetchone=True)
+    return result[0] if result else None
 
-    admin_commands = [
-        "створити групу",
-        "змінити групу",
-        "список груп",
-        "видалити групу",
-        "додати сервер",
-        "повернутися назад"
-    ]
 
-    buttons = admin_commands
+# ==================== Меню та команди для Telegram бота ====================
+MENUS = {
+    # Команди для звичайного користувача
+    "user": ["мій айді", "керування сервером", "статус усіх серверів", "масова дія", "сповіщення про статус"],
+    "moderator": ["мій айді", "керування сервером", "статус усіх серверів", "масова дія", "сповіщення про статус",
+                  "групи", "розблокувати користувача", "модератори", "коди", "підписатися на розсилку про вильоти"],
+    "groups": ["створити групу", "змінити групу", "список груп", "видалити групу", "додати сервер",
+               "повернутися назад"],
+    "moderators": ["додати модератора", "керування модераторами", "повернутися назад"],
+    "codes": ["створити одноразовий код", "список одноразових кодів", "повернутися назад"],
+}
+
+
+def column_keyboard(buttons):
+    markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
     for button in buttons:
         markup.add(button)
+    return markup
 
-    bot.send_message(message.chat.id, "Оберіть команду:", reply_markup=markup)
 
+def menu_markup(name):
+    return markup_cache.get(("menu", name), lambda: column_keyboard(MENUS[name]))
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "модератори")
-def send_commands_menu_moder(message):
-    markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
 
-    admin_commands = [
-        "додати модератора",
-        "керування модераторами",
-        "повернутися назад"
-    ]
+def commands_menu_markup(user_id):
+    """Клавіатура головного меню з кнопками відповідно до прав user_id (спільна для bot.py та async_runtime.py)."""
+    return menu_markup("moderator" if is_moderator(user_id) else "user")
 
-    buttons = admin_commands
-    for button in buttons:
-        markup.add(button)
 
-    bot.send_message(message.chat.id, "Оберіть команду:", reply_markup=markup)
+def send_commands_menu(message):
+    """
+    Надсилає користувачу меню з кнопками під клавіатурою.
+    Після натискання кнопки її текст просто надсилається в чат.
+    """
+    bot.send_message(message.chat.id, "Оберіть команду або вкладку:",
+                     reply_markup=commands_menu_markup(message.chat.id), priority=PRIORITY_BULK)
 
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "коди")
-def send_commands_menu_key(message):
-    markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+def reply_with_menu(chat_id, text, **kwargs):
+    """Надсилає результат дії одразу з клавіатурою меню - один запит замість send_message + send_commands_menu."""
+    return bot.send_message(chat_id, text, reply_markup=commands_menu_markup(chat_id), **kwargs)
 
-    admin_commands = [
-        "створити одноразовий код",
-        "список одноразових кодів",
-        "повернутися назад"
-    ]
 
-    buttons = admin_commands
-    for button in buttons:
-        markup.add(button)
+@text_router.command("групи")
+@moderator_only
+def send_commands_menu_gruo(message):
+    bot.send_message(message.chat.id, "Оберіть команду:", reply_markup=menu_markup("groups"), priority=PRIORITY_BULK)
 
-    bot.send_message(message.chat.id, "Оберіть команду:", reply_markup=markup)
+
+@text_router.command("модератори")
+@moderator_only
+def send_commands_menu_moder(message):
+    bot.send_message(message.chat.id, "Оберіть команду:", reply_markup=menu_markup("moderators"),
+                     priority=PRIORITY_BULK)
+
+
+@text_router.command("коди")
+@moderator_only
+def send_commands_menu_key(message):
+    bot.send_message(message.chat.id, "Оберіть команду:", reply_markup=menu_markup("codes"), priority=PRIORITY_BULK)
 
 
 @bot.message_handler(commands=["start"])
@@ -344,108 +554,111 @@ def start(message):
     send_commands_menu(message)
 
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "мій айді")
+@text_router.command("мій айді")
 @registered_only
 def my_id(message):
-    bot.reply_to(message, f"Ваш user ID: {message.chat.id}")
-    send_commands_menu(message)
+    bot.reply_to(message, f"Ваш user ID: {message.chat.id}", reply_markup=commands_menu_markup(message.chat.id))
 
 
 # ==================== Реєстрація користувача ====================
 @bot.message_handler(commands=["register"])
 def register(message):
-    if execute_db("SELECT * FROM users WHERE user_id = %s", (str(message.chat.id),), fetchone=True):
-        bot.send_message(message.chat.id, "Ви вже зареєстровані.")
-        send_commands_menu(message)
+    if is_registered_user(message.chat.id):
+        reply_with_menu(message.chat.id, "Ви вже зареєстровані.")
+        return
+    # Множина заблокованих завантажується разом з індексом користувачів, тож запиту в базу немає
+    if message.chat.id in auth_limiter.blocked:
+        bot.send_message(message.chat.id, "⛔ Реєстрацію заблоковано. Зверніться до модератора.")
         return
     bot.register_next_step_handler(message, verify_one_time_code)
 
 
+@attempt_limited
 def verify_one_time_code(message):
     user_id = message.chat.id
-    one_time_code = message.text.strip()
-    result = execute_db("SELECT group_name FROM time_key WHERE time_key = %s", (one_time_code,), fetchone=True)
-    if result:
-        wrong_attempts.pop(user_id, None)
-        group_name = result[0]
-        execute_db("DELETE FROM time_key WHERE time_key = %s AND group_name = %s", (one_time_code, group_name),
-                   commit=True)
+    try:
+        group_name = one_time_codes.claim(message.text.strip(), user_id)
+    except mysql.connector.Error as err:
+        logging.error(f"Помилка перевірки одноразового коду: {err}")
+        reply_with_menu(user_id, "Не вдалося перевірити код, спробуйте пізніше.")
+        return
+    if group_name:
+        auth_limiter.succeeded(user_id)
         username = message.chat.username if message.chat.username else message.from_user.first_name
+        import pyotp
+
         secret = pyotp.random_base32()
-        registration_info[str(user_id)] = {"username": username, "group_name": group_name, "secret": secret}
+        state.set("registration", user_id, {"username": username, "group_name": group_name, "secret": secret})
         send_qr(message, secret)
     else:
         logging.warning(f"Користувач {user_id} ввів невірний тимчасовий код.")
-        wrong_attempts[user_id] = wrong_attempts.get(user_id, 0) + 1
-        if wrong_attempts[user_id] >= 5:
-            nickname = message.chat.username if message.chat.username else message.from_user.first_name
-            execute_db("INSERT IGNORE INTO blocked_users (user_id, nickname, reason) VALUES (%s, %s, %s)",
-                       (str(user_id), nickname, "Вичерпано кількість спроб введення тимчасового коду"), commit=True)
-            logging.error(f"Користувач {user_id} заблокований після 5 невдалих спроб.")
-        else:
+        if not auth_limiter.failed(user_id):
             bot.register_next_step_handler(message, verify_one_time_code)
 
 
 def send_qr(message, secret):
+    import pyotp
+
     totp = pyotp.TOTP(secret)
     uri = totp.provisioning_uri(
         name=message.chat.username if message.chat.username else message.from_user.first_name,
         issuer_name="hetzner_bot_control"
     )
-    qr = qrcode.make(uri)
-    bio = BytesIO()
-    qr.save(bio, format="PNG")
-    bio.seek(0)
     sent_msg = bot.send_photo(
         message.chat.id,
-        bio,
+        BytesIO(qr_renderer.render(uri)),
         caption="Відскануйте QR-код для Google Authenticator або скопіюйте код, який знаходиться нижче."
     )
-    qr_message_id[message.chat.id] = sent_msg.message_id
     secret_msg = bot.send_message(message.chat.id, f"{secret}")
-    secret_message_id[message.chat.id] = secret_msg.message_id
-    bot.send_message(message.chat.id, "Введіть код з аутентифікатора:")
-    bot.register_next_step_handler(message, verify_2fa, secret)
+    state.set("qr_messages", message.chat.id, [sent_msg.message_id, secret_msg.message_id])
+    bot.send_message(message.chat.id, "Введіть код з аутентифікатора:", priority=PRIORITY_URGENT)
+    # Секрет не передається в аргументах кроку: їх зберігає на диск step persistence
+    bot.register_next_step_handler(message, verify_2fa)
 
 
-def verify_2fa(message, secret):
-    totp = pyotp.TOTP(secret)
-    if totp.verify(message.text.strip()):
-        bot.send_message(message.chat.id, "✅ Код правильний! Реєстрація завершена.")
-        info = registration_info.get(str(message.chat.id))
+def delete_secret_messages(chat_id, namespace):
+    """Видаляє з чату QR-код і секрет, id яких збережено в state під namespace."""
+    for message_id in state.pop(namespace, chat_id, []):
+        try:
+            bot.delete_message(chat_id, message_id)
+        except Exception as e:
+            print(f"Помилка видалення QR-коду або секретного коду: {e}")
+
+
+@attempt_limited
+def verify_2fa(message):
+    info = state.get("registration", message.chat.id)
+    if info is None:
+        delete_secret_messages(message.chat.id, "qr_messages")
+        reply_with_menu(message.chat.id, "Час на реєстрацію минув. Почніть заново: /register")
+        return
+    if check_totp(message, info["secret"]):
+        text = "✅ Код правильний! Реєстрація завершена."
+        info = state.pop("registration", message.chat.id)
         if info:
             try:
-                execute_db(
+                if execute_db(
                     "INSERT INTO users (user_id, username, group_name, secret_key) VALUES (%s, %s, %s, %s)",
-                    (str(message.chat.id), info["username"], info["group_name"], info["secret"]),
+                    (message.chat.id, info["username"], info["group_name"], info["secret"]),
                     commit=True
-                )
-                update_users_cache()
+                ):
+                    index_user(message.chat.id, info["username"], info["group_name"], info["secret"])
             except Exception as err:
-                bot.send_message(message.chat.id, f"Помилка збереження даних: {err}")
-            registration_info.pop(str(message.chat.id), None)
-        send_commands_menu(message)
-        try:
-            bot.delete_message(message.chat.id, qr_message_id[message.chat.id])
-        except Exception as e:
-            print(f"Помилка видалення QR-коду: {e}")
-        try:
-            bot.delete_message(message.chat.id, secret_message_id[message.chat.id])
-        except Exception as e:
-            print(f"Помилка видалення секретного коду: {e}")
+                text += f"\nПомилка збереження даних: {err}"
+        reply_with_menu(message.chat.id, text)
+        delete_secret_messages(message.chat.id, "qr_messages")
     else:
         bot.send_message(message.chat.id, "❌ Невірний код. Будь ласка, спробуйте ще раз.")
-        bot.register_next_step_handler(message, verify_2fa, secret)
+        bot.register_next_step_handler(message, verify_2fa)
 
 
 # ==================== Команди для модераторів ====================
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "розблокувати користувача")
+@text_router.command("розблокувати користувача")
 @moderator_only
 def unblock_user(message):
     blocked = execute_db("SELECT user_id, nickname FROM blocked_users", fetchone=False)
     if not blocked:
-        bot.send_message(message.chat.id, "Немає заблокованих користувачів.")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, "Немає заблокованих користувачів.")
         return
     markup = InlineKeyboardMarkup()
     for user in blocked:
@@ -462,112 +675,143 @@ def confirm_unblock_callback(call):
     if len(parts) != 2:
         bot.answer_callback_query(call.id, "Невірний формат даних.")
         return
-    unblock_user_id = parts[1]
+    unblock_user_id = int(parts[1])
     admin_id = call.from_user.id
-    pending_unblock[admin_id] = unblock_user_id
+    state.set("pending_unblock", admin_id, unblock_user_id)
     bot.answer_callback_query(call.id, "Будь ласка, введіть свій 2FA-код для підтвердження розблокування.")
-    bot.send_message(call.message.chat.id, "Введіть свій 2FA-код для підтвердження розблокування:")
+    bot.send_message(call.message.chat.id, "Введіть свій 2FA-код для підтвердження розблокування:",
+                     priority=PRIORITY_URGENT)
     bot.register_next_step_handler(call.message, process_unblock_2fa)
 
 
+@attempt_limited
 def process_unblock_2fa(message):
     admin_id = message.from_user.id
-    res = execute_db("SELECT secret_key FROM admins_2fa WHERE admin_id = %s", (str(admin_id),), fetchone=True)
-    if res:
-        admin_secret = res[0]
-    else:
-        bot.send_message(message.chat.id, "Не знайдено ваш секретний ключ для 2FA.")
-        send_commands_menu(message)
-        pending_unblock.pop(admin_id, None)
+    admin_secret = get_admin_secret(admin_id)
+    if not admin_secret:
+        reply_with_menu(message.chat.id, "Не знайдено ваш секретний ключ для 2FA.")
+        state.pop("pending_unblock", admin_id)
         return
-    totp = pyotp.TOTP(admin_secret)
-    if not totp.verify(message.text.strip()):
-        bot.send_message(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
-        send_commands_menu(message)
-        pending_unblock.pop(admin_id, None)
+    if not check_totp(message, admin_secret):
+        reply_with_menu(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
+        state.pop("pending_unblock", admin_id)
+        return
+    unblock_user_id = state.pop("pending_unblock", admin_id)
+    if unblock_user_id is None:
+        reply_with_menu(message.chat.id, "Час на підтвердження минув. Почніть розблокування заново.")
         return
-    unblock_user_id = pending_unblock.pop(admin_id)
-    result = execute_db("SELECT nickname FROM blocked_users WHERE user_id = %s", (str(unblock_user_id),), fetchone=True)
+    result = execute_db(BLOCKED_USER_QUERY, (unblock_user_id,), fetchone=True)
     if result:
-        nickname = result[0]
-        execute_db("DELETE FROM blocked_users WHERE user_id = %s", (str(unblock_user_id),), commit=True)
-        wrong_attempts.pop(unblock_user_id, None)
+        nickname = result[0] or unblock_user_id
+        execute_db("DELETE FROM blocked_users WHERE user_id = %s", (unblock_user_id,), commit=True)
+        auth_limiter.reset(unblock_user_id)
+        principals_changed()
         logging.info(f"Користувача {unblock_user_id} ({nickname}) розблоковано адміністратором {admin_id}.")
-        bot.send_message(message.chat.id, f"Користувача {nickname} (ID: {unblock_user_id}) успішно розблоковано.")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, f"Користувача {nickname} (ID: {unblock_user_id}) успішно розблоковано.")
     else:
-        bot.send_message(message.chat.id, "Користувача з таким ID не знайдено у списку заблокованих.")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, "Користувача з таким ID не знайдено у списку заблокованих.")
 
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "змінити групу")
+@text_router.command("змінити групу")
 @moderator_only
 def switch_group(message):
-    groups = execute_db("SELECT group_name FROM groups_for_hetzner", fetchone=False)
-    if not groups:
-        bot.send_message(message.chat.id, "Немає доступних груп для перемикання.")
-        send_commands_menu(message)
-        return
-    markup = InlineKeyboardMarkup()
-    for group in groups:
-        markup.add(InlineKeyboardButton(group[0], callback_data=f"switch_group:{group[0]}"))
-    bot.send_message(message.chat.id, "Оберіть групу для перемикання:", reply_markup=markup)
+    if not send_group_picker(message.chat.id, "switch"):
+        reply_with_menu(message.chat.id, "Немає доступних груп для перемикання.")
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("switch_group:"))
 @moderator_callback_only
 def confirm_switch_group(call):
     new_group = call.data.split(":", 1)[1]
-    user_id = str(call.from_user.id)
-    res = execute_db("SELECT secret_key FROM admins_2fa WHERE admin_id = %s", (user_id,), fetchone=True)
-    if res:
-        admin_secret = res[0]
-    else:
-        bot.send_message(call.message.chat.id, "Ваш секретний ключ для 2FA не знайдено.")
-        send_commands_menu(call.message)
+    user_id = call.from_user.id
+    if not get_admin_secret(user_id):
+        reply_with_menu(call.message.chat.id, "Ваш секретний ключ для 2FA не знайдено.")
         return
-    bot.send_message(call.message.chat.id, "Введіть 2FA-код для підтвердження зміни групи:")
+    bot.send_message(call.message.chat.id, "Введіть 2FA-код для підтвердження зміни групи:", priority=PRIORITY_URGENT)
     bot.register_next_step_handler(call.message, verify_switch_group_2fa, new_group, user_id, call.message.message_id)
 @bot.message_handler(commands=["stop"])
 @moderator_only
 def stop_bot(message):
-    bot.send_message(message.chat.id, "Введіть свій 2FA-код для підтвердження зупинки бота:")
+    bot.send_message(message.chat.id, "Введіть свій 2FA-код для підтвердження зупинки бота:", priority=PRIORITY_URGENT)
     bot.register_next_step_handler(message, confirm_stop)
 
+@bot.message_handler(commands=["stats"])
+@moderator_only
+def bot_stats(message):
+    stats = db_pool.snapshot()
+    avg_ms = stats["query_time"] / stats["queries"] * 1000 if stats["queries"] else 0.0
+    queue_stats = bot.dispatcher.snapshot()
+    avg_wait_ms = queue_stats["wait_time"] / queue_stats["processed"] * 1000 if queue_stats["processed"] else 0.0
+    send_stats = bot.limiter.snapshot()
+    avg_send_wait_ms = send_stats["wait_time"] / send_stats["waits"] * 1000 if send_stats["waits"] else 0.0
+    interactions = dict(bot.interaction_stats)
+    markup_stats = dict(markup_cache.stats)
+    totp_stats = dict(totp_engine.stats)
+    auth_stats = dict(auth_limiter.stats)
+    calls_per_update = interactions["api_calls"] / interactions["updates"] if interactions["updates"] else 0.0
+    bot.send_message(
+        message.chat.id,
+        f"Пул з'єднань: {stats['open']}/{stats['size']} відкрито, {stats['idle']} вільних\n"
+        f"Видач: {stats['checkouts']}, очікувань: {stats['waits']} ({stats['wait_time']:.3f} с)\n"
+        f"Нових з'єднань: {stats['created']}, перепідключень: {stats['reconnects']}, "
+        f"відкинуто: {stats['discarded']}\n"
+        f"Запитів: {stats['queries']}, середній час: {avg_ms:.1f} мс\n\n"
+        f"Черга оновлень: {queue_stats['depth']}/{queue_stats['queue_size']} "
+        f"(максимум {queue_stats['max_depth']}), потоків: {queue_stats['workers']}, "
+        f"активних чатів: {queue_stats['active_chats']}\n"
+        f"Оброблено: {queue_stats['processed']}, з помилкою: {queue_stats['failed']}, "
+        f"очікувань на повну чергу: {queue_stats['full_waits']}\n"
+        f"Час у черзі: середній {avg_wait_ms:.1f} мс, максимальний {queue_stats['max_wait'] * 1000:.1f} мс\n\n"
+        f"Надіслано в Telegram: {send_stats['sent']}, чекали на ліміт: {send_stats['waits']} "
+        f"(середньо {avg_send_wait_ms:.1f} мс), відповідей 429: {send_stats['retry_after']}\n"
+        f"Чекають зараз: {send_stats['waiting']} (максимум {send_stats['max_waiting']})\n"
+        f"Запитів до Telegram на оновлення: {calls_per_update:.2f} "
+        f"({interactions['api_calls']} на {interactions['updates']})\n"
+        f"Клавіатур у кеші: {len(markup_cache)}, повторних використань: {markup_stats['hits']}, "
+        f"побудов: {markup_stats['builds']}, скидань: {markup_stats['invalidations']}\n"
+        f"2FA: перевірок {totp_stats['verified']}, прийнято {totp_stats['accepted']}, "
+        f"повторних кодів відхилено {totp_stats['replays']}, відхилено лімітом спроб {auth_stats['rejected']}\n"
+        f"Запуск: готовність {format_startup_time('ready')}, прогрів {format_startup_time('warmed')}, "
+        f"перше оновлення {format_startup_time('first_update')}"
+    )
+
+
+@attempt_limited
 def confirm_stop(message):
-    admin_id = str(message.from_user.id)
-    res = execute_db("SELECT secret_key FROM admins_2fa WHERE admin_id = %s", (admin_id,), fetchone=True)
-    if not res:
+    admin_id = message.from_user.id
+    secret = get_admin_secret(admin_id)
+    if not secret:
         bot.send_message(message.chat.id, "Секретний ключ не знайдено. Операція скасована.")
         return
-    secret = res[0]
-    totp = pyotp.TOTP(secret)
-    if totp.verify(message.text.strip()):
+    if check_totp(message, secret):
         bot.send_message(message.chat.id, "2FA підтверджено. Зупинка бота...")
+        if CLUSTER_WORKERS:
+            # Процес-обробник кластера: зупиняє ingress, а той - усі процеси
+            os.kill(os.getppid(), signal.SIGINT)
+            return
+        if webhook_server:
+            webhook_server.shutdown()
         bot.stop_polling()
         import sys
         sys.exit(0)
     else:
         bot.send_message(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
 
+@attempt_limited
 def verify_switch_group_2fa(message, new_group, user_id, msg_id):
-    res = execute_db("SELECT secret_key FROM admins_2fa WHERE admin_id = %s", (str(user_id),), fetchone=True)
-    if not res:
-        bot.send_message(message.chat.id, "Не знайдено секретного ключа для 2FA.")
-        send_commands_menu(message)
+    admin_secret = get_admin_secret(user_id)
+    if not admin_secret:
+        reply_with_menu(message.chat.id, "Не знайдено секретного ключа для 2FA.")
         return
-    admin_secret = res[0]
 
-    totp = pyotp.TOTP(admin_secret)
-    if not totp.verify(message.text.strip()):
-        bot.send_message(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
-        send_commands_menu(message)
+    if not check_totp(message, admin_secret):
+        reply_with_menu(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
         return
 
     try:
         username = message.from_user.username or message.from_user.first_name
 
-        execute_db(
+        saved = execute_db(
             """
             INSERT INTO users (user_id, username, group_name, secret_key)
             VALUES (%s, %s, %s, %s)
@@ -578,14 +822,16 @@ def verify_switch_group_2fa(message, new_group, user_id, msg_id):
             (user_id, username, new_group, admin_secret),
             commit=True
         )
-        update_users_cache()
+        if saved:
+            index_user(user_id, username, new_group, admin_secret)
+            # Сповіщення про сервери попередньої групи більше не надсилаються
+            execute_db("DELETE FROM server_watch_subscribers WHERE chat_id = %s AND group_name <> %s",
+                       (user_id, new_group), commit=True)
 
-        bot.send_message(message.chat.id, f"✅ Ви тепер працюєте в групі '{new_group}'")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, f"✅ Ви тепер працюєте в групі '{new_group}'")
 
     except Exception as e:
-        bot.send_message(message.chat.id, f"❌ Помилка оновлення даних: {str(e)}")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, f"❌ Помилка оновлення даних: {str(e)}")
         return
 
     try:
@@ -604,71 +850,52 @@ add_moderator_standart_executed = False
 def add_moderator_standart(message):
     global add_moderator_standart_executed
     if add_moderator_standart_executed:
-
         return
 
     try:
         # Перевіряємо, чи існує вже запис з цим moderator_id
         result = execute_db(
             "SELECT COUNT(*) as count FROM pending_admins WHERE moderator_id = %s",
-            (str(first_moderator_id),),
+            (first_moderator_id,),
             fetchone=True
         )
         # Якщо результат повертається як кортеж, використовуємо індекс 0
         if result and int(result[0]) > 0:
-
             return
 
         # Якщо запису немає, вставляємо новий
         execute_db(
             "INSERT INTO pending_admins (moderator_id) VALUES (%s)",
-            (str(first_moderator_id),),
+            (first_moderator_id,),
             commit=True
         )
-        bot.send_message(message.chat.id, "Перший модератор доданий успішно")
-        send_commands_menu(message)
-
-
-
+        reply_with_menu(message.chat.id, "Перший модератор доданий успішно")
         # Встановлюємо прапорець в пам'яті, що команда виконана
         add_moderator_standart_executed = True
     except Exception as err:
-        bot.send_message(message.chat.id, f"Помилка: {err}")
-        send_commands_menu(message)
-
+        reply_with_menu(message.chat.id, f"Помилка: {err}")
 
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "створити одноразовий код")
+@text_router.command("створити одноразовий код")
 @moderator_only
 def create_time_key(message):
-    res = execute_db("SELECT secret_key FROM admins_2fa WHERE admin_id = %s", (str(message.from_user.id),),
-                     fetchone=True)
-    if not res:
-        bot.send_message(message.chat.id, "Ваш секретний ключ для 2FA не знайдено.")
-        send_commands_menu(message)
+    secret = get_admin_secret(message.from_user.id)
+    if not secret:
+        reply_with_menu(message.chat.id, "Ваш секретний ключ для 2FA не знайдено.")
         return
-    secret = res[0]
-    bot.send_message(message.chat.id, "Введіть код 2FA для генерації одноразового коду:")
-    bot.register_next_step_handler(message, verify_create_time_key_2fa, secret)
+    bot.send_message(message.chat.id, "Введіть код 2FA для генерації одноразового коду:", priority=PRIORITY_URGENT)
+    bot.register_next_step_handler(message, verify_create_time_key_2fa)
 
 
-def verify_create_time_key_2fa(message, secret):
-    totp = pyotp.TOTP(secret)
-    if totp.verify(message.text.strip()):
-        bot.send_message(message.chat.id, "✅ Код підтверджено! Оберіть групу для генерації одноразового коду:")
-        groups = execute_db("SELECT group_name, group_signature FROM groups_for_hetzner", fetchone=False)
-        if not groups:
-            bot.send_message(message.chat.id, "Немає доступних груп.")
-            return
-        markup = InlineKeyboardMarkup()
-        for group in groups:
-            gname, gsign = group
-            display = gsign if gsign and gsign.strip() != "" else gname
-            markup.add(InlineKeyboardButton(display, callback_data=f"create_time_key:{gname}"))
-        bot.send_message(message.chat.id, "Оберіть групу:", reply_markup=markup)
+@attempt_limited
+def verify_create_time_key_2fa(message):
+    secret = get_admin_secret(message.from_user.id)
+    if secret and check_totp(message, secret):
+        if not send_group_picker(message.chat.id, "time_key",
+                                 title="✅ Код підтверджено! Оберіть групу для генерації одноразового коду:"):
+            reply_with_menu(message.chat.id, "✅ Код підтверджено, але немає доступних груп.")
     else:
-        bot.send_message(message.chat.id, "❌ Невірний код 2FA. Операція скасована.")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, "❌ Невірний код 2FA. Операція скасована.")
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("create_time_key:"))
@@ -676,77 +903,74 @@ def verify_create_time_key_2fa(message, secret):
 def callback_create_time_key(call):
     group_name = call.data.split(":", 1)[1]
     try:
-        bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
-    except Exception as e:
-        print(f"Помилка редагування повідомлення: {e}")
-    length = 25
-    chars = string.ascii_letters + string.digits + string.punctuation
-    one_key = ''.join(secrets.choice(chars) for _ in range(length))
-    try:
-        execute_db("INSERT INTO time_key (group_name, time_key) VALUES (%s, %s)", (group_name, one_key), commit=True)
+        one_key = one_time_codes.create(group_name)
         bot.answer_callback_query(call.id, f"Одноразовий код для групи '{group_name}' згенеровано!")
-        bot.send_message(call.message.chat.id, f"Одноразовий код для групи '{group_name}':")
-        bot.send_message(call.message.chat.id, one_key)
-        send_commands_menu(call.message)
+        # Список груп перетворюється на заголовок; сам код - окремим повідомленням, щоб його було зручно копіювати
+        bot.edit_message_text(f"Одноразовий код для групи '{group_name}' (дійсний {ONE_TIME_CODE_TTL // 3600} год, "
+                              f"показується лише зараз):", call.message.chat.id, call.message.message_id)
+        reply_with_menu(call.message.chat.id, one_key)
     except Exception as err:
-        bot.send_message(call.message.chat.id, f"Помилка генерації коду: {err}")
-        send_commands_menu(call.message)
+        reply_with_menu(call.message.chat.id, f"Помилка генерації коду: {err}")
 
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "створити групу")
+@text_router.command("створити групу")
 @moderator_only
 def create_group(message):
-    res = execute_db("SELECT secret_key FROM admins_2fa WHERE admin_id = %s", (str(message.from_user.id),),
-                     fetchone=True)
-    if not res:
-        bot.send_message(message.chat.id, "Ваш секретний ключ для 2FA не знайдено.")
-        send_commands_menu(message)
+    secret = get_admin_secret(message.from_user.id)
+    if not secret:
+        reply_with_menu(message.chat.id, "Ваш секретний ключ для 2FA не знайдено.")
         return
-    secret = res[0]
-    bot.send_message(message.chat.id, "Введіть код 2FA для створення групи:")
-    bot.register_next_step_handler(message, verify_create_group, secret)
+    bot.send_message(message.chat.id, "Введіть код 2FA для створення групи:", priority=PRIORITY_URGENT)
+    bot.register_next_step_handler(message, verify_create_group)
 
 
-def verify_create_group(message, secret):
-    totp = pyotp.TOTP(secret)
-    if totp.verify(message.text.strip()):
+@attempt_limited
+def verify_create_group(message):
+    secret = get_admin_secret(message.from_user.id)
+    if secret and check_totp(message, secret):
         bot.send_message(message.chat.id, "✅ Код підтверджено! Введіть назву нової групи (ідентифікатор):")
         bot.register_next_step_handler(message, process_add_group)
     else:
-        bot.send_message(message.chat.id, "❌ Невірний код. Операція скасована.")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, "❌ Невірний код. Операція скасована.")
 
 
 def process_add_group(message):
     group_name = message.text.strip()
-    registration_info[str(message.chat.id)] = {"group_name": group_name}
+    state.set("new_group", message.chat.id, {"group_name": group_name})
     bot.send_message(message.chat.id, "Введіть ключ Hetzner для цієї групи:")
     bot.register_next_step_handler(message, process_group_key)
 
 
 def process_group_key(message):
     group_key = message.text.strip()
-    registration_info[str(message.chat.id)]["key_hetzner"] = group_key
+    info = state.get("new_group", message.chat.id)
+    if info is None:
+        reply_with_menu(message.chat.id, "Час на створення групи минув. Почніть заново.")
+        return
+    info["key_hetzner"] = group_key
+    state.set("new_group", message.chat.id, info)
     bot.send_message(message.chat.id, "Введіть підпис для групи:")
     bot.register_next_step_handler(message, process_group_signature)
 
 
 def process_group_signature(message):
     group_signature = message.text.strip()
-    info = registration_info.pop(str(message.chat.id))
+    info = state.pop("new_group", message.chat.id)
+    if info is None:
+        reply_with_menu(message.chat.id, "Час на створення групи минув. Почніть заново.")
+        return
     try:
         execute_db("INSERT INTO groups_for_hetzner (group_name, key_hetzner, group_signature) VALUES (%s, %s, %s)",
                    (info["group_name"], info["key_hetzner"], group_signature if group_signature != "" else None),
                    commit=True)
+        keyboards_changed("groups")
         display = group_signature if group_signature and group_signature.strip() != "" else info["group_name"]
-        bot.send_message(message.chat.id, f"✅ Групу '{display}' (ід: {info['group_name']}) успішно створено!")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, f"✅ Групу '{display}' (ід: {info['group_name']}) успішно створено!")
     except Exception as err:
-        bot.send_message(message.chat.id, f"❌ Помилка створення групи: {err}")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, f"❌ Помилка створення групи: {err}")
 
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "додати модератора")
+@text_router.command("додати модератора")
 @moderator_only
 def add_moderator(message):
     bot.send_message(message.chat.id, "Введіть ID модератора для додавання:")
@@ -755,76 +979,213 @@ def add_moderator(message):
 
 def process_add_moderator_request(message):
     moderator_id = message.text.strip()
+    if not moderator_id.lstrip("-").isdigit():
+        reply_with_menu(message.chat.id, "❌ ID модератора має бути числом. Операція скасована.")
+        return
+    moderator_id = int(moderator_id)
     # Після введення ID, запитуємо 2FA-код для підтвердження операції
-    bot.send_message(message.chat.id, "Введіть ваш 2FA-код для підтвердження додавання модератора:")
+    bot.send_message(message.chat.id, "Введіть ваш 2FA-код для підтвердження додавання модератора:",
+                     priority=PRIORITY_URGENT)
     bot.register_next_step_handler(message, verify_add_moderator_2fa, moderator_id)
 
 
+@attempt_limited
 def verify_add_moderator_2fa(message, moderator_id):
-    admin_id = str(message.from_user.id)
-    res = execute_db("SELECT secret_key FROM admins_2fa WHERE admin_id = %s", (admin_id,), fetchone=True)
-    if not res:
-        bot.send_message(message.chat.id, "Не знайдено ваш секретний ключ для 2FA.")
-        send_commands_menu(message)
+    admin_id = message.from_user.id
+    admin_secret = get_admin_secret(admin_id)
+    if not admin_secret:
+        reply_with_menu(message.chat.id, "Не знайдено ваш секретний ключ для 2FA.")
         return
-    admin_secret = res[0]
-    totp = pyotp.TOTP(admin_secret)
-    if totp.verify(message.text.strip()):
+    if check_totp(message, admin_secret):
         try:
             execute_db("INSERT IGNORE INTO pending_admins (moderator_id) VALUES (%s)", (moderator_id,), commit=True)
-            bot.send_message(message.chat.id, f"Модератор з ID {moderator_id} доданий до списку очікування.")
+            reply_with_menu(message.chat.id, f"Модератор з ID {moderator_id} доданий до списку очікування.")
         except Exception as err:
-            bot.send_message(message.chat.id, f"❌ Помилка додавання модератора: {err}")
+            reply_with_menu(message.chat.id, f"❌ Помилка додавання модератора: {err}")
     else:
-        bot.send_message(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
-    send_commands_menu(message)
+        reply_with_menu(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "список груп")
-@moderator_only
-def list_groups(message):
-    groups = execute_db("SELECT group_name, group_signature FROM groups_for_hetzner", fetchone=False)
-    if not groups:
-        bot.send_message(message.chat.id, "Немає створених груп.")
-        send_commands_menu(message)
-        return
-    for group in groups:
-        group_name, group_signature = group
+# ==================== Посторінковий вивід груп ====================
+GROUP_PICKERS = {
+    "switch": ("Оберіть групу для перемикання:", "switch_group"),
+    "time_key": ("Оберіть групу:", "create_time_key"),
+    "add_server": ("Оберіть групу, до якої бажаєте додати сервер:", "select_group_add_server"),
+    "delete": ("Оберіть групу для видалення:", "select_group_to_delete"),
+}
+
+
+def query_groups_page(columns, after=None, before=None, limit=GROUP_PICKER_PAGE_SIZE):
+    """
+    Keyset-пагінація groups_for_hetzner (аліас g) за group_name.
+    Повертає (рядки, є попередня сторінка, є наступна сторінка).
+    """
+    query = f"SELECT g.group_name, {columns} FROM groups_for_hetzner g"
+    if before is not None:
+        query += " WHERE g.group_name < %s ORDER BY g.group_name DESC LIMIT %s"
+        params = (before, limit + 1)
+    elif after is not None:
+        query += " WHERE g.group_name > %s ORDER BY g.group_name LIMIT %s"
+        params = (after, limit + 1)
+    else:
+        query += " ORDER BY g.group_name LIMIT %s"
+        params = (limit + 1,)
+    rows = execute_db(query, params, fetchone=False) or []
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        return rows[::-1], more, True
+    return rows, after is not None, more
+
+
+def add_page_buttons(markup, kind, rows, has_prev, has_next):
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"groups_page:{kind}:p:{rows[0][0]}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Далі ➡️", callback_data=f"groups_page:{kind}:n:{rows[-1][0]}"))
+    if buttons:
+        markup.row(*buttons)
+
+
+def group_picker_page(kind, after=None, before=None):
+    title, prefix = GROUP_PICKERS[kind]
+
+    def build():
+        rows, has_prev, has_next = query_groups_page("g.group_signature", after, before)
+        if not rows:
+            return None
+        markup = InlineKeyboardMarkup()
+        for gname, gsign in rows:
+            display = gsign if gsign and gsign.strip() != "" else gname
+            markup.add(InlineKeyboardButton(display, callback_data=f"{prefix}:{gname}"))
+        add_page_buttons(markup, kind, rows, has_prev, has_next)
+        return markup
+
+    markup = markup_cache.get(("groups", kind, after, before), build)
+    return (title, markup) if markup else (None, None)
+
+
+def send_group_picker(chat_id, kind, title=None):
+    default_title, markup = group_picker_page(kind)
+    if not markup:
+        return False
+    bot.send_message(chat_id, title or default_title, reply_markup=markup)
+    return True
+
+
+def split_message(blocks, limit=4000):
+    """
+    Склеює блоки через порожній рядок у повідомлення до limit символів (ліміт Telegram - 4096 на повідомлення).
+    Блок, довший за limit, ділиться по рядках, тож таке ділення безпечне лише для простого тексту. Для HTML
+    (parse_mode="HTML") кожен блок має бути коректним і коротшим за limit - див. render_status_table.
+    """
+    messages, current = [], ""
+    for block in blocks:
+        if current and len(current) + len(block) + 2 > limit:
+            messages.append(current)
+            current = ""
+        current = f"{current}\n\n{block}" if current else block
+        while len(current) > limit:
+            cut = current.rfind("\n", 0, limit)
+            cut = cut if cut > 0 else limit
+            messages.append(current[:cut])
+            current = current[cut:].lstrip("\n")
+    if current:
+        messages.append(current)
+    return messages
+
+
+def groups_list_page(after=None, before=None):
+    """Сторінка "список груп": повідомлення (клавіатура - під останнім) і клавіатура; (None, None) - груп немає."""
+    # Учасники та сервери всієї сторінки приходять тим самим запитом, без запиту на кожну групу
+    rows, has_prev, has_next = query_groups_page("""
+        g.group_signature,
+        (SELECT JSON_ARRAYAGG(JSON_ARRAY(u.user_id, u.username)) FROM users u WHERE u.group_name = g.group_name),
+        (SELECT JSON_ARRAYAGG(JSON_ARRAY(s.server_id, s.server_name))
+         FROM hetzner_servers s WHERE s.group_name = g.group_name)
+    """, after, before, limit=GROUPS_PAGE_SIZE)
+    if not rows:
+        return None, None
+    blocks = []
+    markup = InlineKeyboardMarkup()
+    for group_name, group_signature, participants, servers in rows:
         display_name = group_signature if group_signature and group_signature.strip() != "" else group_name
-        participants = execute_db("SELECT user_id, username FROM users WHERE group_name = %s", (group_name,),
-                                  fetchone=False)
         participants_text = ""
-        for p in participants:
-            user_id, username = p
+        for user_id, username in json.loads(participants) if participants else []:
             role = "Модератор" if is_moderator(user_id) else "Користувач"
             participants_text += f"ID: {user_id}, Ім'я: {username}, Роль: {role}\n"
         if not participants_text:
-            participants_text = "Немає учасників."
-        servers = execute_db("SELECT server_id, server_name FROM hetzner_servers WHERE group_name = %s", (group_name,),
-                             fetchone=False)
+            participants_text = "Немає учасників.\n"
         servers_text = ""
-        for s in servers:
-            server_id, server_name = s
+        for server_id, server_name in json.loads(servers) if servers else []:
             display = server_name if server_name and server_name.strip() != "" else server_id
             servers_text += f"ID: {server_id}, Назва: {display}\n"
         if not servers_text:
-            servers_text = "Немає серверів."
-        text = (f"Група: {display_name} (ід: {group_name})\n\n"
-                f"Учасники:\n{participants_text}\n"
-                f"Сервери:\n{servers_text}")
-        markup = InlineKeyboardMarkup()
-        markup.add(InlineKeyboardButton("Видалити користувача", callback_data=f"delete_user_group:{group_name}"))
-        markup.add(InlineKeyboardButton("Видалити сервер", callback_data=f"delete_server_group:{group_name}"))
-        bot.send_message(message.chat.id, text, reply_markup=markup)
+            servers_text = "Немає серверів.\n"
+        blocks.append(f"Група: {display_name} (ід: {group_name})\n\n"
+                      f"Учасники:\n{participants_text}\n"
+                      f"Сервери:\n{servers_text}")
+        markup.row(
+            InlineKeyboardButton(f"Видалити користувача ({display_name})",
+                                 callback_data=f"delete_user_group:{group_name}"),
+            InlineKeyboardButton(f"Видалити сервер ({display_name})",
+                                 callback_data=f"delete_server_group:{group_name}")
+        )
+    add_page_buttons(markup, "list", rows, has_prev, has_next)
+    return split_message(blocks), markup
+
+
+@text_router.command("список груп")
+@moderator_only
+def list_groups(message):
+    texts, markup = groups_list_page()
+    if not markup:
+        reply_with_menu(message.chat.id, "Немає створених груп.")
+        return
+    send_groups_list(message.chat.id, texts, markup)
     send_commands_menu(message)
 
+
+def send_groups_list(chat_id, texts, markup):
+    for text in texts[:-1]:
+        bot.send_message(chat_id, text, priority=PRIORITY_BULK)
+    bot.send_message(chat_id, texts[-1], reply_markup=markup, priority=PRIORITY_BULK)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("groups_page:"))
+@moderator_callback_only
+def groups_page_callback(call):
+    _, kind, direction, group_name = call.data.split(":", 3)
+    after = group_name if direction == "n" else None
+    before = group_name if direction == "p" else None
+    if kind == "list":
+        texts, markup = groups_list_page(after, before)
+        bot.answer_callback_query(call.id)
+        if not markup:
+            return
+        if len(texts) == 1:
+            bot.edit_message_text(texts[0], call.message.chat.id, call.message.message_id, reply_markup=markup)
+            return
+        # Сторінка не вміщується в одне повідомлення - надсилаємо її заново, а кнопки прибираємо зі старої
+        bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
+        send_groups_list(call.message.chat.id, texts, markup)
+        return
+    text, markup = group_picker_page(kind, after, before)
+    bot.answer_callback_query(call.id)
+    if not markup:
+        return
+    bot.edit_message_text(text, call.message.chat.id, call.message.message_id, reply_markup=markup)
+
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith("delete_user_group:"))
 @moderator_callback_only
 def delete_user_group_callback(call):
     group_name = call.data.split(":", 1)[1]
     bot.answer_callback_query(call.id, "Введіть 2FA-код для підтвердження видалення користувача.")
-    bot.send_message(call.message.chat.id, "Введіть 2FA-код для підтвердження видалення користувача:")
-    pending_deletion[str(call.from_user.id)] = {"action": "list_users", "group": group_name,
-                                                "chat_id": call.message.chat.id}
+    bot.send_message(call.message.chat.id, "Введіть 2FA-код для підтвердження видалення користувача:",
+                     priority=PRIORITY_URGENT)
+    state.set("pending_deletion", call.message.chat.id, {"action": "list_users", "group": group_name})
+    bot.register_next_step_handler(call.message, process_deletion_2fa)
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("delete_server_group:"))
@@ -832,39 +1193,44 @@ def delete_user_group_callback(call):
 def delete_server_group_callback(call):
     group_name = call.data.split(":", 1)[1]
     bot.answer_callback_query(call.id, "Введіть 2FA-код для підтвердження видалення сервера.")
-    bot.send_message(call.message.chat.id, "Введіть 2FA-код для підтвердження видалення сервера:")
-    pending_deletion[str(call.from_user.id)] = {"action": "list_servers", "group": group_name,
-                                                "chat_id": call.message.chat.id}
+    bot.send_message(call.message.chat.id, "Введіть 2FA-код для підтвердження видалення сервера:",
+                     priority=PRIORITY_URGENT)
+    state.set("pending_deletion", call.message.chat.id, {"action": "list_servers", "group": group_name})
+    bot.register_next_step_handler(call.message, process_deletion_2fa)
 
 
-@bot.message_handler(
-    func=lambda m: str(m.from_user.id) in pending_deletion and pending_deletion[str(m.from_user.id)]["action"] in [
-        "list_users", "list_servers"])
-@registered_only
+def delete_servers_markup(group_name):
+    servers = execute_db(GROUP_SERVERS_QUERY, (group_name,), fetchone=False)
+    if not servers:
+        return None
+    markup = InlineKeyboardMarkup()
+    for server_id, server_name in servers:
+        display = server_name if server_name and server_name.strip() != "" else server_id
+        markup.add(InlineKeyboardButton(f"Видалити сервер {display}",
+                                        callback_data=f"confirm_delete_server:{group_name}:{server_id}"))
+    return markup
+
+
+@attempt_limited
 def process_deletion_2fa(message):
-    info = pending_deletion.pop(str(message.from_user.id), None)
+    info = state.pop("pending_deletion", message.chat.id)
     if not info:
+        reply_with_menu(message.chat.id, "Час на підтвердження минув. Операція скасована.")
         return
-    res = execute_db("SELECT secret_key FROM admins_2fa WHERE admin_id = %s", (str(message.from_user.id),),
-                     fetchone=True)
-    if not res:
-        bot.send_message(message.chat.id, "Не знайдено ваш секретний ключ для 2FA.")
-        send_commands_menu(message)
+    user_secret = get_admin_secret(message.from_user.id)
+    if not user_secret:
+        reply_with_menu(message.chat.id, "Не знайдено ваш секретний ключ для 2FA.")
         return
-    user_secret = res[0]
-    totp = pyotp.TOTP(user_secret)
-    if not totp.verify(message.text.strip()):
-        bot.send_message(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
-        send_commands_menu(message)
+    if not check_totp(message, user_secret):
+        reply_with_menu(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
         return
     group_name = info["group"]
-    chat_id = info["chat_id"]
+    chat_id = message.chat.id
     if info["action"] == "list_users":
         participants = execute_db("SELECT user_id, username FROM users WHERE group_name = %s", (group_name,),
                                   fetchone=False)
         if not participants:
-            bot.send_message(chat_id, f"Немає учасників для видалення у групі {group_name}.")
-            send_commands_menu(message)
+            reply_with_menu(chat_id, f"Немає учасників для видалення у групі {group_name}.")
             return
         markup = InlineKeyboardMarkup()
         for p in participants:
@@ -873,18 +1239,11 @@ def process_deletion_2fa(message):
                                             callback_data=f"confirm_delete_user:{group_name}:{user_id}"))
         bot.send_message(chat_id, "Оберіть користувача для видалення:", reply_markup=markup)
     elif info["action"] == "list_servers":
-        servers = execute_db("SELECT server_id, server_name FROM hetzner_servers WHERE group_name = %s", (group_name,),
-                             fetchone=False)
-        if not servers:
-            bot.send_message(chat_id, f"Немає серверів для видалення у групі {group_name}.")
-            send_commands_menu(message)
+        markup = markup_cache.get(("servers", "delete", group_name),
+                                  functools.partial(delete_servers_markup, group_name))
+        if not markup:
+            reply_with_menu(chat_id, f"Немає серверів для видалення у групі {group_name}.")
             return
-        markup = InlineKeyboardMarkup()
-        for s in servers:
-            server_id, server_name = s
-            display = server_name if server_name and server_name.strip() != "" else server_id
-            markup.add(InlineKeyboardButton(f"Видалити сервер {display}",
-                                            callback_data=f"confirm_delete_server:{group_name}:{server_id}"))
         bot.send_message(chat_id, "Оберіть сервер для видалення:", reply_markup=markup)
 
 
@@ -896,13 +1255,14 @@ def confirm_delete_user_callback(call):
     user_id = data[2]
     try:
         execute_db("DELETE FROM users WHERE user_id = %s AND group_name = %s", (user_id, group_name), commit=True)
-        update_users_cache()
+        execute_db("DELETE FROM server_watch_subscribers WHERE chat_id = %s AND group_name = %s",
+                   (user_id, group_name), commit=True)
+        if get_user_group(user_id) == group_name:
+            unindex_user(user_id)
         bot.answer_callback_query(call.id, f"Користувача з ID {user_id} видалено.")
-        bot.send_message(call.message.chat.id, f"Користувача з ID {user_id} видалено з групи {group_name}.")
-        send_commands_menu(call.message)
+        reply_with_menu(call.message.chat.id, f"Користувача з ID {user_id} видалено з групи {group_name}.")
     except Exception as err:
-        bot.send_message(call.message.chat.id, f"❌ Помилка видалення користувача: {err}")
-        send_commands_menu(call.message)
+        reply_with_menu(call.message.chat.id, f"❌ Помилка видалення користувача: {err}")
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("confirm_delete_server:"))
@@ -914,77 +1274,77 @@ def confirm_delete_server_callback(call):
     try:
         execute_db("DELETE FROM hetzner_servers WHERE server_id = %s AND group_name = %s", (server_id, group_name),
                    commit=True)
+        keyboards_changed("servers")
         bot.answer_callback_query(call.id, f"Сервер з ID {server_id} видалено.")
-        bot.send_message(call.message.chat.id, f"Сервер з ID {server_id} видалено з групи {group_name}.")
-        send_commands_menu(call.message)
+        reply_with_menu(call.message.chat.id, f"Сервер з ID {server_id} видалено з групи {group_name}.")
     except Exception as err:
-        bot.send_message(call.message.chat.id, f"❌ Помилка видалення сервера: {err}")
-        send_commands_menu(call.message)
+        reply_with_menu(call.message.chat.id, f"❌ Помилка видалення сервера: {err}")
 
 
 @bot.message_handler(commands=["register_admin"])
 def register_admin(message):
-    user_id = str(message.from_user.id)
-    if not execute_db("SELECT moderator_id FROM pending_admins WHERE moderator_id = %s", (user_id,), fetchone=True):
+    user_id = message.from_user.id
+    if not execute_db(PENDING_ADMIN_QUERY, (user_id,), fetchone=True):
         return
+    import pyotp
+
     secret = pyotp.random_base32()
+    state.set("admin_registration", message.chat.id, {"secret": secret})
     bot.send_message(message.chat.id, "Відправляємо QR-код для налаштування 2FA адміністраторів...")
     send_admin_qr(message, secret)
 
 
 def send_admin_qr(message, secret):
+    import pyotp
+
     totp = pyotp.TOTP(secret)
     uri = totp.provisioning_uri(
         name=message.chat.username if message.chat.username else message.from_user.first_name,
         issuer_name="hetzner_bot_control_admin"
     )
-    qr = qrcode.make(uri)
-    bio = BytesIO()
-    qr.save(bio, format="PNG")
-    bio.seek(0)
     sent_msg = bot.send_photo(
         message.chat.id,
-        bio,
+        BytesIO(qr_renderer.render(uri)),
         caption="Відскануйте цей QR-код для налаштування 2FA адміністраторів."
     )
-    admin_qr_msg_id[message.chat.id] = sent_msg.message_id
     admin_secret_msg = bot.send_message(message.chat.id, f"{secret}")
-    admin_secret_message_id[message.chat.id] = admin_secret_msg.message_id
-    bot.send_message(message.chat.id, "Введіть код з Google Authenticator для завершення реєстрації:")
-    bot.register_next_step_handler(message, verify_admin_2fa, secret)
-
-
-def verify_admin_2fa(message, secret):
-    totp = pyotp.TOTP(secret)
-    if totp.verify(message.text.strip()):
-        user_id = str(message.from_user.id)
+    state.set("admin_qr_messages", message.chat.id, [sent_msg.message_id, admin_secret_msg.message_id])
+    bot.send_message(message.chat.id, "Введіть код з Google Authenticator для завершення реєстрації:",
+                     priority=PRIORITY_URGENT)
+    bot.register_next_step_handler(message, verify_admin_2fa)
+
+
+@attempt_limited
+def verify_admin_2fa(message):
+    info = state.get("admin_registration", message.chat.id)
+    if info is None:
+        delete_secret_messages(message.chat.id, "admin_qr_messages")
+        reply_with_menu(message.chat.id, "Час на реєстрацію минув. Почніть заново: /register_admin")
+        return
+    secret = info["secret"]
+    if check_totp(message, secret):
+        state.pop("admin_registration", message.chat.id)
+        user_id = message.from_user.id
         username = message.chat.username if message.chat.username else message.from_user.first_name
         try:
-            execute_db(
+            if execute_db(
                 "INSERT INTO admins_2fa (admin_id, username, secret_key) VALUES (%s, %s, %s)",
                 (user_id, username, secret),
                 commit=True
-            )
-            update_users_cache()
-            bot.send_message(message.chat.id, "✅ Ви успішно зареєстровані як адміністратор!")
+            ):
+                index_admin(user_id, username, secret)
             execute_db("DELETE FROM pending_admins WHERE moderator_id = %s", (user_id,), commit=True)
+            text = "✅ Ви успішно зареєстровані як адміністратор!"
         except Exception as err:
-            bot.send_message(message.chat.id, f"❌ Помилка реєстрації: {err}")
-        try:
-            bot.delete_message(message.chat.id, admin_qr_msg_id[message.chat.id])
-            send_commands_menu(message)
-        except Exception as e:
-            print(f"Помилка при видаленні QR-коду: {e}")
-        try:
-            bot.delete_message(message.chat.id, admin_secret_message_id[message.chat.id])
-        except Exception as e:
-            print(f"Помилка при видаленні секретного коду: {e}")
+            text = f"❌ Помилка реєстрації: {err}"
+        delete_secret_messages(message.chat.id, "admin_qr_messages")
+        reply_with_menu(message.chat.id, text)
     else:
         bot.send_message(message.chat.id, "❌ Невірний код. Будь ласка, спробуйте ще раз.")
-        bot.register_next_step_handler(message, verify_admin_2fa, secret)
+        bot.register_next_step_handler(message, verify_admin_2fa)
 
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "керування модераторами")
+@text_router.command("керування модераторами")
 @moderator_only
 def manage_moderators(message):
     moderators = execute_db("SELECT admin_id, username FROM admins_2fa", fetchone=False)
@@ -996,7 +1356,7 @@ def manage_moderators(message):
         mod_id, mod_username = mod
         markup.add(
             InlineKeyboardButton(f"Видалити {mod_username} (ID: {mod_id})", callback_data=f"remove_moderator:{mod_id}"))
-    bot.send_message(message.chat.id, "Список модераторів:", reply_markup=markup)
+    bot.send_message(message.chat.id, "Список модераторів:", reply_markup=markup, priority=PRIORITY_BULK)
     send_commands_menu(message)
 
 
@@ -1005,71 +1365,74 @@ def manage_moderators(message):
 def remove_moderator_callback(call):
     mod_id = call.data.split(":", 1)[1]
     chat_id = call.message.chat.id
-    try:
-        bot.edit_message_reply_markup(chat_id=chat_id, message_id=call.message.message_id, reply_markup=None)
-    except Exception as e:
-        print(f"Помилка редагування повідомлення: {e}")
-    pending_removals[str(chat_id)] = mod_id
     bot.answer_callback_query(call.id)
-    bot.send_message(chat_id, f"Введіть код з аутентифікатора для підтвердження видалення модератора з ID {mod_id}:")
+    bot.edit_message_text(f"Введіть код з аутентифікатора для підтвердження видалення модератора з ID {mod_id}:",
+                          chat_id, call.message.message_id, priority=PRIORITY_URGENT)
     bot.register_next_step_handler(call.message, verify_remove_moderator, mod_id)
 
 
+@attempt_limited
 def verify_remove_moderator(message, mod_id):
     chat_id = message.chat.id
-    res = execute_db("SELECT secret_key FROM admins_2fa WHERE admin_id = %s", (str(chat_id),), fetchone=True)
-    if res is None:
+    secret = get_admin_secret(chat_id)
+    if secret is None:
         bot.send_message(chat_id, "Не знайдено секретного ключа для 2FA.")
-        pending_removals.pop(str(chat_id), None)
         return
-    secret = res[0]
-    totp = pyotp.TOTP(secret)
-    if totp.verify(message.text.strip()):
+    if check_totp(message, secret):
         try:
             execute_db("DELETE FROM admins_2fa WHERE admin_id = %s", (mod_id,), commit=True)
-            update_users_cache()
-            bot.send_message(chat_id, f"Модератор з ID {mod_id} успішно видалено.")
-            send_commands_menu(message)
+            unindex_admin(mod_id)
+            reply_with_menu(chat_id, f"Модератор з ID {mod_id} успішно видалено.")
         except Exception as err:
-            bot.send_message(chat_id, f"❌ Помилка видалення модератора: {err}")
-            send_commands_menu(message)
+            reply_with_menu(chat_id, f"❌ Помилка видалення модератора: {err}")
     else:
         bot.send_message(chat_id, "❌ Невірний 2FA-код. Операцію скасовано.")
-    pending_removals.pop(str(chat_id), None)
 
 
 # ==================== Команди для керування Hetzner-серверами ====================
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "керування сервером")
+def servers_keyboard(group_name):
+    def build():
+        servers = execute_db(GROUP_SERVERS_QUERY, (group_name,), fetchone=False)
+        if not servers:
+            return None
+        markup = ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
+        for server_id, server_name in servers:
+            display = server_name if server_name and server_name.strip() != "" else server_id
+            markup.add(KeyboardButton(display))
+        return markup
+
+    return markup_cache.get(("servers", "control", group_name), build)
+
+
+def server_actions_keyboard():
+    def build():
+        markup = ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
+        markup.add(KeyboardButton("Увімкнути"), KeyboardButton("Вимкнути"))
+        markup.add(KeyboardButton("Перезавантажити"), KeyboardButton("Перевірити статус"))
+        markup.add(KeyboardButton("Меню"))
+        return markup
+
+    return markup_cache.get(("menu", "server_actions"), build)
+
+
+@text_router.command("керування сервером")
 @registered_only
 def server_control(message):
-    user_id = message.from_user.id
-    group_result = execute_db("SELECT group_name FROM users WHERE user_id = %s", (str(user_id),), fetchone=True)
-    group_name = group_result[0] if group_result else None
+    group_name = get_user_group(message.from_user.id)
     if not group_name:
-        bot.send_message(message.chat.id, "Ви не зареєстровані або не прив'язані до групи.")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, "Ви не зареєстровані або не прив'язані до групи.")
         return
-    servers = execute_db("SELECT server_id, server_name FROM hetzner_servers WHERE group_name = %s", (group_name,),
-                         fetchone=False)
-    if not servers:
-        bot.send_message(message.chat.id, "Для вашої групи немає доданих серверів.")
-        send_commands_menu(message)
+    markup = servers_keyboard(group_name)
+    if not markup:
+        reply_with_menu(message.chat.id, "Для вашої групи немає доданих серверів.")
         return
-    markup = ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
-    for server in servers:
-        server_id, server_name = server
-        display = server_name if server_name and server_name.strip() != "" else server_id
-        markup.add(KeyboardButton(display))
     bot.send_message(message.chat.id, "Оберіть сервер:", reply_markup=markup)
     bot.register_next_step_handler(message, process_server_selection)
 
 
 def process_server_selection(message):
-    user_id = message.from_user.id
-    group_result = execute_db("SELECT group_name FROM users WHERE user_id = %s", (str(user_id),), fetchone=True)
-    group_name = group_result[0] if group_result else None
-    servers = execute_db("SELECT server_id, server_name FROM hetzner_servers WHERE group_name = %s", (group_name,),
-                         fetchone=False)
+    group_name = get_user_group(message.from_user.id)
+    servers = execute_db(GROUP_SERVERS_QUERY, (group_name,), fetchone=False)
     chosen_server = None
     for server in servers:
         server_id, server_name = server
@@ -1078,22 +1441,15 @@ def process_server_selection(message):
             chosen_server = server_id
             break
     if not chosen_server:
-        bot.send_message(message.chat.id, "Сервер не знайдено. Спробуйте ще раз.")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, "Сервер не знайдено. Спробуйте ще раз.")
         return
-    selected_server[message.chat.id] = chosen_server
-    action_markup = ReplyKeyboardMarkup(one_time_keyboard=True, resize_keyboard=True)
-    action_markup.add(KeyboardButton("Увімкнути"), KeyboardButton("Вимкнути"))
-    action_markup.add(KeyboardButton("Перезавантажити"), KeyboardButton("Перевірити статус"))
-    action_markup.add(KeyboardButton("Меню"))
-    bot.send_message(message.chat.id, "Оберіть дію для сервера:", reply_markup=action_markup)
+    state.set("selected_server", message.chat.id, chosen_server)
+    bot.send_message(message.chat.id, "Оберіть дію для сервера:", reply_markup=server_actions_keyboard())
     bot.register_next_step_handler(message, process_server_action)
 
 
 def process_server_action(message):
-    user_id = message.from_user.id
-    group_result = execute_db("SELECT group_name FROM users WHERE user_id = %s", (str(user_id),), fetchone=True)
-    group_name = group_result[0] if group_result else None
+    group_name = get_user_group(message.from_user.id)
     action = message.text.strip()
     if action == "Меню":
         send_commands_menu(message)
@@ -1101,111 +1457,421 @@ def process_server_action(message):
     if action not in ["Увімкнути", "Вимкнути", "Перезавантажити", "Перевірити статус", "Меню"]:
         bot.send_message(message.chat.id, "Невідома дія. Операцію скасовано.")
         return
-    server_id = selected_server.get(message.chat.id)
+    server_id = state.get("selected_server", message.chat.id)
     if not server_id:
-        bot.send_message(message.chat.id, "Сервер не вибрано. Спробуйте знову.")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, "Сервер не вибрано. Спробуйте знову.")
         return
-    hetzner_key_result = execute_db("SELECT key_hetzner FROM groups_for_hetzner WHERE group_name = %s", (group_name,),
-                                    fetchone=True)
-    hetzner_key = hetzner_key_result[0] if hetzner_key_result else None
+    hetzner_key = get_group_key(group_name)
     if not hetzner_key:
         bot.send_message(message.chat.id, "Ключ Hetzner для вашої групи відсутній.")
         return
     if action == "Перевірити статус":
-        headers = {"Authorization": f"Bearer {hetzner_key}"}
-        base_url = "https://api.hetzner.cloud/v1/servers"
-        url = f"{base_url}/{server_id}"
-        res = requests.get(url, headers=headers)
-        if res.status_code in [200, 201]:
-            data = res.json()
-            status = data.get("server", {}).get("status", "Невідомо")
-            translations = {
-                "running": "запущено",
-                "stopped": "зупинено",
-                "rebooting": "перезавантажується"
-            }
-            status = translations.get(status.lower(), status)
-            bot.send_message(message.chat.id, f"Статус сервера: {status}")
-            bot.send_message(message.chat.id, "Оберіть опцію:", reply_markup=main_markup)
-        else:
-            bot.send_message(message.chat.id, f"❌ Помилка: {res.text}")
-            send_commands_menu(message)
+        try:
+            server = status_cache.get(hetzner_key, server_id)
+        except HetznerError as err:
+            reply_with_menu(message.chat.id, f"❌ Помилка: {err}")
+            return
+        status = translate_status(server.get("status", "Невідомо"))
+        bot.send_message(message.chat.id, f"Статус сервера: {status}", reply_markup=main_markup())
     else:
-        bot.send_message(message.chat.id, "Введіть 2FA-код для підтвердження операції:")
-        bot.register_next_step_handler(message, confirm_server_action_2fa, action, server_id, group_name, hetzner_key)
+        bot.send_message(message.chat.id, "Введіть 2FA-код для підтвердження операції:", priority=PRIORITY_URGENT)
+        # Ключ Hetzner не передається в аргументах кроку: їх зберігає на диск step persistence
+        bot.register_next_step_handler(message, confirm_server_action_2fa, action, server_id, group_name)
 
 
-def confirm_server_action_2fa(message, action, server_id, group_name, hetzner_key):
-    user_id = message.from_user.id
-    res = execute_db("SELECT secret_key FROM users WHERE user_id = %s", (str(user_id),), fetchone=True)
-    if res:
-        user_secret = res[0]
-    else:
-        bot.send_message(message.chat.id, "Неможливо отримати ваш секретний ключ для 2FA.")
-        send_commands_menu(message)
+STATUS_TRANSLATIONS = {
+    "running": "запущено",
+    "stopped": "зупинено",
+    "off": "вимкнено",
+    "rebooting": "перезавантажується",
+    "starting": "запускається",
+    "stopping": "зупиняється",
+    "initializing": "ініціалізується",
+    "migrating": "мігрує",
+    "deleting": "видаляється",
+    "unknown": "невідомо"
+}
+
+
+def translate_status(status):
+    return STATUS_TRANSLATIONS.get(status.lower(), status)
+
+
+SERVER_ACTIONS = {
+    "Увімкнути": "poweron",
+    "Вимкнути": "shutdown",
+    "Перезавантажити": "reboot"
+}
+
+
+@attempt_limited
+def confirm_server_action_2fa(message, action, server_id, group_name):
+    user_secret = get_user_secret(message.from_user.id)
+    if not user_secret:
+        reply_with_menu(message.chat.id, "Неможливо отримати ваш секретний ключ для 2FA.")
         return
-    totp = pyotp.TOTP(user_secret)
-    if not totp.verify(message.text.strip()):
-        bot.send_message(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
-        send_commands_menu(message)
+    if not check_totp(message, user_secret):
+        reply_with_menu(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
         return
-    headers = {"Authorization": f"Bearer {hetzner_key}"}
-    base_url = "https://api.hetzner.cloud/v1/servers"
-    if action == "Увімкнути":
-        url = f"{base_url}/{server_id}/actions/poweron"
-        res = requests.post(url, headers=headers)
-    elif action == "Вимкнути":
-        url = f"{base_url}/{server_id}/actions/shutdown"
-        res = requests.post(url, headers=headers)
-    elif action == "Перезавантажити":
-        url = f"{base_url}/{server_id}/actions/reboot"
-        res = requests.post(url, headers=headers)
-    elif action == "Меню":
+    api_action = SERVER_ACTIONS.get(action)
+    if action == "Меню":
         send_commands_menu(message)
-    else:
+        return
+    if not api_action:
         bot.send_message(message.chat.id, "Невідома дія.")
         return
+    # Поки чекали на код, користувача могли перевести в іншу групу
+    hetzner_key = get_group_key(group_name) if get_user_group(message.from_user.id) == group_name else None
+    if not hetzner_key:
+        reply_with_menu(message.chat.id, "Ключ Hetzner для вашої групи відсутній. Операція скасована.")
+        return
 
-    if res.status_code in [200, 201]:
+    try:
+        hetzner_action = hetzner.server_action(hetzner_key, server_id, api_action)
+    except HetznerError as err:
+        reply_with_menu(message.chat.id, f"❌ Помилка виконання команди '{action}': {err}")
+        return
+    finally:
+        status_cache.invalidate(hetzner_key, server_id)
+    # Повідомлення про прогрес редагується, а Telegram не дає редагувати повідомлення з reply-клавіатурою,
+    # тому меню надсилається разом з фінальним результатом
+    progress_msg = bot.send_message(message.chat.id, f"⏳ Команда '{action}' виконується...")
+    action_tracker.track(hetzner_key, hetzner_action,
+                         functools.partial(report_action_progress, message.chat.id, progress_msg.message_id,
+                                           action, hetzner_key, server_id))
+
+
+def report_action_progress(chat_id, msg_id, action, hetzner_key, server_id, hetzner_action, finished):
+    if not finished:
+        text = f"⏳ Команда '{action}' виконується: {hetzner_action.get('progress', 0)}%"
+    elif hetzner_action.get("status") == "success":
+        status_cache.invalidate(hetzner_key, server_id)
         action_translations = {
             "Увімкнути": "запущено",
             "Вимкнути": "зупинено",
             "Перезавантажити": "перезавантажено"
         }
-        translated_action = action_translations.get(action, action)
-        bot.send_message(message.chat.id, f"Команда '{translated_action}' виконана.")
-        send_commands_menu(message)
+        text = f"✅ Команда '{action_translations.get(action, action)}' виконана."
     else:
-        bot.send_message(message.chat.id, f"❌ Помилка виконання команди '{action}': {res.text}")
-        send_commands_menu(message)
+        status_cache.invalidate(hetzner_key, server_id)
+        error = hetzner_action.get("error") or {}
+        text = f"❌ Помилка виконання команди '{action}': {error.get('message', 'невідома помилка')}"
+    try:
+        bot.edit_message_text(text, chat_id, msg_id, priority=PRIORITY_NORMAL if finished else PRIORITY_BULK)
+    except Exception as e:
+        print(f"Помилка редагування повідомлення: {e}")
+        if finished:
+            # Результат не можна втратити: якщо редагування не вдалося, він надсилається окремо з меню
+            reply_with_menu(chat_id, text)
+            return
+    if finished:
+        bot.send_message(chat_id, "Оберіть команду або вкладку:", reply_markup=commands_menu_markup(chat_id),
+                         priority=PRIORITY_BULK)
 
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "додати сервер")
-@moderator_only
-def add_server(message):
-    groups = execute_db("SELECT group_name, group_signature FROM groups_for_hetzner", fetchone=False)
+# ==================== Статус усіх серверів групи ====================
+def group_servers_query(group_name=None):
+    query = """
+        SELECT g.group_name, g.group_signature, g.key_hetzner, s.server_id, s.server_name
+        FROM groups_for_hetzner g
+        JOIN hetzner_servers s ON s.group_name = g.group_name
+    """
+    params = None
+    if group_name is not None:
+        query += " WHERE g.group_name = %s"
+        params = (group_name,)
+    query += " ORDER BY g.group_name, s.server_name"
+    return query, params
+
+
+def group_servers_from_rows(rows):
+    """Повертає {group_name: (підпис, ключ Hetzner, [(server_id, server_name), ...])}."""
+    groups = {}
+    for gname, gsign, key, server_id, server_name in rows:
+        display = gsign if gsign and gsign.strip() != "" else gname
+        groups.setdefault(gname, (display, key, []))[2].append((server_id, server_name))
+    return groups
+
+
+def load_group_servers(group_name=None):
+    query, params = group_servers_query(group_name)
+    return group_servers_from_rows(execute_db(query, params, fetchone=False) or [])
+
+
+def fetch_servers_by_token(tokens):
+    """Один список GET /servers на кожен унікальний токен; повертає {token: {server_id: server} або HetznerError}."""
+    def fetch(token):
+        try:
+            servers = hetzner.list_servers(token, concurrency=DASHBOARD_TOKEN_CONCURRENCY)
+        except HetznerError as err:
+            return token, err
+        by_id = {}
+        for server in servers:
+            by_id[str(server["id"])] = server
+            status_cache.put(token, server["id"], server)
+        return token, by_id
+
+    with ThreadPoolExecutor(max_workers=max(1, min(DASHBOARD_MAX_TOKENS, len(tokens)))) as pool:
+        return dict(pool.map(fetch, tokens))
+
+
+def render_status_table(groups, results):
+    blocks = []
+    for gname, (display, key, servers) in groups.items():
+        found = results.get(key)
+        rows = []
+        for server_id, server_name in servers:
+            name = server_name if server_name and server_name.strip() != "" else str(server_id)
+            if isinstance(found, HetznerError):
+                status = "помилка API"
+            elif str(server_id) in found:
+                status = translate_status(found[str(server_id)].get("status", "unknown"))
+            else:
+                status = "не знайдено"
+            rows.append((name, status))
+        width = max(len(name) for name, _ in rows)
+        header = f"<b>{html.escape(display)}</b>"
+        # Довга таблиця ділиться на кілька <pre>...</pre> під ліміт повідомлення, тож split_message не рве теги
+        chunks, size = [[]], 0
+        for name, status in rows:
+            line = html.escape(f"{name.ljust(width)}  {status}")
+            if chunks[-1] and size + len(line) + 1 > STATUS_TABLE_LIMIT:
+                chunks.append([])
+                size = 0
+            chunks[-1].append(line)
+            size += len(line) + 1
+        for index, chunk in enumerate(chunks):
+            table = "\n".join(chunk)
+            blocks.append(f"{header if index == 0 else header + ' (продовження)'}\n<pre>{table}</pre>")
+        if isinstance(found, HetznerError):
+            blocks[-1] += f"\n❌ {html.escape(str(found))}"
+    return split_message(blocks)
+
+
+@text_router.command("статус усіх серверів")
+@registered_only
+def all_servers_status(message):
+    if is_moderator(message.from_user.id):
+        groups = load_group_servers()
+    else:
+        group_name = get_user_group(message.from_user.id)
+        groups = load_group_servers(group_name) if group_name else {}
     if not groups:
-        bot.send_message(message.chat.id, "Немає створених груп.")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, "Немає доданих серверів.")
         return
+    started = time.monotonic()
+    results = fetch_servers_by_token({key for _, key, _ in groups.values()})
+    elapsed = time.monotonic() - started
+    messages = render_status_table(groups, results)
+    messages[-1] += f"\n\nОновлено за {elapsed:.1f} с"
+    try:
+        for text in messages[:-1]:
+            bot.send_message(message.chat.id, text, parse_mode="HTML")
+        reply_with_menu(message.chat.id, messages[-1], parse_mode="HTML")
+    except Exception as err:
+        logging.error(f"Не вдалося надіслати статус серверів у чат {message.chat.id}: {err}")
+        reply_with_menu(message.chat.id, f"❌ Не вдалося надіслати статус серверів: {err}")
+
+
+# ==================== Масові дії над серверами групи ====================
+def bulk_actions_markup():
     markup = InlineKeyboardMarkup()
-    for group in groups:
-        group_name, group_signature = group
-        display = group_signature if group_signature and group_signature.strip() != "" else group_name
-        markup.add(InlineKeyboardButton(display, callback_data=f"select_group_add_server:{group_name}"))
-    bot.send_message(message.chat.id, "Оберіть групу, до якої бажаєте додати сервер:", reply_markup=markup)
+    for action, api_action in SERVER_ACTIONS.items():
+        markup.add(InlineKeyboardButton(action, callback_data=f"bulk_action:{api_action}"))
+    return markup
+
+
+def bulk_servers_markup(info):
+    markup = InlineKeyboardMarkup()
+    for server_id, server_name in info["servers"]:
+        mark = "✅" if server_id in info["selected"] else "▫️"
+        display = server_name if server_name and server_name.strip() != "" else server_id
+        markup.add(InlineKeyboardButton(f"{mark} {display}", callback_data=f"bulk_toggle:{server_id}"))
+    markup.add(InlineKeyboardButton("Обрати всі", callback_data="bulk_all"),
+               InlineKeyboardButton("Підтвердити", callback_data="bulk_confirm"))
+    return markup
+
+
+@text_router.command("масова дія")
+@registered_only
+def bulk_action(message):
+    group_name = get_user_group(message.from_user.id)
+    if not group_name:
+        reply_with_menu(message.chat.id, "Ви не зареєстровані або не прив'язані до групи.")
+        return
+    bot.send_message(message.chat.id, f"Оберіть дію для серверів групи '{group_name}':",
+                     reply_markup=markup_cache.get(("menu", "bulk_actions"), bulk_actions_markup))
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("bulk_action:"))
+@registered_callback_only
+def bulk_action_callback(call):
+    api_action = call.data.split(":", 1)[1]
+    chat_id = call.message.chat.id
+    # Застаріла кнопка зі старою назвою дії не має валити обробник
+    action = next((name for name, value in SERVER_ACTIONS.items() if value == api_action), None)
+    if action is None:
+        bot.answer_callback_query(call.id, "Невідома дія. Почніть знову.")
+        return
+    group_name = get_user_group(call.from_user.id)
+    servers = execute_db(GROUP_SERVERS_QUERY, (group_name,), fetchone=False)
+    if not servers:
+        bot.answer_callback_query(call.id)
+        bot.send_message(chat_id, "Для вашої групи немає доданих серверів.")
+        return
+    info = {"action": action, "group": group_name, "servers": [list(server) for server in servers], "selected": []}
+    state.set("bulk_selection", chat_id, info)
+    bot.answer_callback_query(call.id)
+    bot.edit_message_text(f"Дія '{action}'. Оберіть сервери:", chat_id, call.message.message_id,
+                          reply_markup=bulk_servers_markup(info))
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith("bulk_toggle:") or call.data == "bulk_all")
+@registered_callback_only
+def bulk_toggle_callback(call):
+    chat_id = call.message.chat.id
+    info = state.get("bulk_selection", chat_id)
+    if not info:
+        bot.answer_callback_query(call.id, "Сесія застаріла. Почніть знову.")
+        return
+    if call.data == "bulk_all":
+        info["selected"] = [server_id for server_id, _ in info["servers"]]
+    else:
+        server_id = call.data.split(":", 1)[1]
+        selected = set(info["selected"]) ^ {server_id}
+        info["selected"] = [server_id for server_id, _ in info["servers"] if server_id in selected]
+    state.set("bulk_selection", chat_id, info)
+    bot.answer_callback_query(call.id)
+    bot.edit_message_reply_markup(chat_id, call.message.message_id, reply_markup=bulk_servers_markup(info))
+
+
+@bot.callback_query_handler(func=lambda call: call.data == "bulk_confirm")
+@registered_callback_only
+def bulk_confirm_callback(call):
+    chat_id = call.message.chat.id
+    info = state.get("bulk_selection", chat_id)
+    if not info or not info["selected"]:
+        bot.answer_callback_query(call.id, "Оберіть хоча б один сервер.")
+        return
+    bot.answer_callback_query(call.id)
+    bot.edit_message_text(f"Дія '{info['action']}' для {len(info['selected'])} серверів.", chat_id,
+                          call.message.message_id, reply_markup=None)
+    bot.send_message(chat_id, "Введіть 2FA-код для підтвердження операції:", priority=PRIORITY_URGENT)
+    bot.register_next_step_handler(call.message, confirm_bulk_action_2fa)
+
+
+def run_bulk_action(hetzner_key, server_ids, api_action):
+    def run(server_id):
+        try:
+            hetzner.server_action(hetzner_key, server_id, api_action)
+            return server_id, None
+        except HetznerError as err:
+            return server_id, str(err)
+        finally:
+            status_cache.invalidate(hetzner_key, server_id)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(BULK_ACTION_CONCURRENCY, len(server_ids)))) as pool:
+        return list(pool.map(run, server_ids))
+
+
+@attempt_limited
+def confirm_bulk_action_2fa(message):
+    info = state.pop("bulk_selection", message.chat.id)
+    if not info:
+        reply_with_menu(message.chat.id, "Сесія застаріла. Почніть знову.")
+        return
+    user_secret = get_user_secret(message.from_user.id)
+    if not user_secret or not check_totp(message, user_secret):
+        reply_with_menu(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
+        return
+    # Поки користувач обирав сервери, його могли видалити з групи чи перевести в іншу
+    if get_user_group(message.from_user.id) != info["group"]:
+        reply_with_menu(message.chat.id, "Ви більше не належите до цієї групи. Операція скасована.")
+        return
+    key_result = execute_db(GROUP_KEY_QUERY, (info["group"],), fetchone=True)
+    if not key_result:
+        reply_with_menu(message.chat.id, "Ключ Hetzner для вашої групи відсутній.")
+        return
+    names = {server_id: (server_name if server_name and server_name.strip() != "" else server_id)
+             for server_id, server_name in info["servers"]}
+    server_ids = info["selected"]
+    started = time.monotonic()
+    results = run_bulk_action(key_result[0], server_ids, SERVER_ACTIONS[info["action"]])
+    elapsed = time.monotonic() - started
+    failed = [(server_id, error) for server_id, error in results if error]
+    text = (f"Дія '{info['action']}': успішно {len(results) - len(failed)} з {len(results)}, "
+            f"час виконання {elapsed:.1f} с")
+    for server_id, error in failed:
+        text += f"\n❌ {names[server_id]}: {error}"
+    reply_with_menu(message.chat.id, text)
+
+
+# ==================== Сповіщення про зміну статусу серверів ====================
+@text_router.command("сповіщення про статус")
+@registered_only
+def toggle_status_notifications(message):
+    group_name = get_user_group(message.from_user.id)
+    if not group_name:
+        reply_with_menu(message.chat.id, "Ви не зареєстровані або не прив'язані до групи.")
+        return
+    params = (message.chat.id, group_name)
+    if execute_db(WATCH_SUBSCRIPTION_QUERY, params, fetchone=True):
+        execute_db("DELETE FROM server_watch_subscribers WHERE chat_id = %s AND group_name = %s", params, commit=True)
+        reply_with_menu(message.chat.id, f"Сповіщення про статус серверів групи '{group_name}' вимкнено.")
+    else:
+        execute_db("INSERT INTO server_watch_subscribers (chat_id, group_name) VALUES (%s, %s)", params, commit=True)
+        reply_with_menu(message.chat.id, f"Ви отримуватимете сповіщення, коли сервери групи '{group_name}' "
+                                         f"змінюють статус.")
+
+
+def load_watch_targets():
+    rows = execute_db(WATCH_TARGETS_QUERY, fetchone=False)
+    if rows is None:
+        raise RuntimeError("помилка бази даних")
+    targets = {}
+    for key, server_id in rows:
+        targets.setdefault(key, set()).add(str(server_id))
+    return targets
+
+
+def notify_status_changes(hetzner_key, changes):
+    for server, _, _ in changes:
+        status_cache.put(hetzner_key, server["id"], server)
+    server_ids = [str(server["id"]) for server, _, _ in changes]
+    placeholders = ", ".join(["%s"] * len(server_ids))
+    rows = execute_db(WATCH_NOTIFY_QUERY.format(placeholders=placeholders), (hetzner_key, *server_ids),
+                      fetchone=False) or []
+    by_server = {str(server["id"]): (old, new) for server, old, new in changes}
+    by_chat = {}
+    for chat_id, server_id, server_name in rows:
+        old, new = by_server[str(server_id)]
+        display = server_name if server_name and server_name.strip() != "" else server_id
+        by_chat.setdefault(chat_id, []).append(f"{display}: {translate_status(old)} → {translate_status(new)}")
+    for chat_id, lines in by_chat.items():
+        try:
+            bot.send_message(chat_id, "🔔 Зміна статусу серверів:\n" + "\n".join(lines), priority=PRIORITY_URGENT)
+        except Exception as e:
+            logging.warning(f"Не вдалося надіслати сповіщення {chat_id}: {e}")
+
+
+status_watcher = StatusWatcher(hetzner, load_watch_targets, notify_status_changes,
+                               min_interval=WATCHER_MIN_INTERVAL, max_interval=WATCHER_MAX_INTERVAL,
+                               budget_share=WATCHER_BUDGET_SHARE)
+
+
+@text_router.command("додати сервер")
+@moderator_only
+def add_server(message):
+    if not send_group_picker(message.chat.id, "add_server"):
+        reply_with_menu(message.chat.id, "Немає створених груп.")
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("select_group_add_server:"))
 @moderator_callback_only
 def select_group_add_server_callback(call):
     group_name = call.data.split(":", 1)[1]
-    try:
-        bot.edit_message_reply_markup(call.message.chat.id, call.message.message_id, reply_markup=None)
-    except Exception as e:
-        print(f"Помилка редагування повідомлення: {e}")
-    bot.send_message(call.message.chat.id, f"Введіть ID сервера, який потрібно додати до групи '{group_name}':")
+    bot.edit_message_text(f"Введіть ID сервера, який потрібно додати до групи '{group_name}':",
+                          call.message.chat.id, call.message.message_id)
     bot.register_next_step_handler(call.message, process_server_id, group_name)
 
 
@@ -1223,80 +1889,80 @@ def process_server_name(message, group_name, server_id):
             (group_name, server_id, server_name if server_name != "" else None),
             commit=True
         )
-        bot.send_message(message.chat.id, f"✅ Сервер з ID {server_id} успішно додано до групи {group_name}!")
-        send_commands_menu(message)
+        keyboards_changed("servers")
+        reply_with_menu(message.chat.id, f"✅ Сервер з ID {server_id} успішно додано до групи {group_name}!")
     except Exception as err:
-        bot.send_message(message.chat.id, f"❌ Помилка при додаванні сервера: {err}")
-        send_commands_menu(message)
+        reply_with_menu(message.chat.id, f"❌ Помилка при додаванні сервера: {err}")
 
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "список одноразових кодів")
+@text_router.command("список одноразових кодів")
 @moderator_only
 def list_time_keys(message):
-    res = execute_db("SELECT secret_key FROM admins_2fa WHERE admin_id = %s", (str(message.from_user.id),),
-                     fetchone=True)
-    if not res:
-        bot.send_message(message.chat.id, "Ваш секретний ключ для 2FA не знайдено.")
-        send_commands_menu(message)
+    admin_secret = get_admin_secret(message.from_user.id)
+    if not admin_secret:
+        reply_with_menu(message.chat.id, "Ваш секретний ключ для 2FA не знайдено.")
         return
-    admin_secret = res[0]
-    bot.send_message(message.chat.id, "Введіть 2FA-код для перегляду тимчасових кодів:")
-    bot.register_next_step_handler(message, verify_list_time_keys, admin_secret)
+    bot.send_message(message.chat.id, "Введіть 2FA-код для перегляду тимчасових кодів:", priority=PRIORITY_URGENT)
+    bot.register_next_step_handler(message, verify_list_time_keys)
 
 
-def verify_list_time_keys(message, admin_secret):
-    totp = pyotp.TOTP(admin_secret)
-    if not totp.verify(message.text.strip()):
-        bot.send_message(message.chat.id, "❌ Невірний 2FA-код. Команда скасована.")
-        send_commands_menu(message)
-        return
-    codes = execute_db("SELECT group_name, time_key FROM time_key", fetchone=False)
+def time_keys_listing():
+    """
+    Текст і кнопки списку дійсних тимчасових кодів; (None, None), якщо кодів немає.
+    Самі коди не зберігаються, тому код позначається початком його хешу.
+    """
+    codes = one_time_codes.active()
     if not codes:
-        bot.send_message(message.chat.id, "Немає тимчасових кодів.")
-        send_commands_menu(message)
-        return
+        return None, None
     text = "Тимчасові коди:\n\n"
     markup = InlineKeyboardMarkup()
-    for group_name, time_key in codes:
-        text += f"Група: {group_name} - Код: {time_key}\n"
-        markup.add(InlineKeyboardButton(f"Видалити {group_name} - {time_key}",
-                                        callback_data=f"delete_time_key:{group_name}:{time_key}"))
-    bot.send_message(message.chat.id, text, reply_markup=markup)
+    for hash_prefix, group_name, expires_at in codes:
+        text += f"Група: {group_name} - Хеш: {hash_prefix[:8]} - Діє до: {expires_at:%d.%m %H:%M}\n"
+        markup.add(InlineKeyboardButton(f"Видалити {group_name} - {hash_prefix[:8]}",
+                                        callback_data=f"delete_time_key:{hash_prefix}"))
+    return text, markup
+
+
+@attempt_limited
+def verify_list_time_keys(message):
+    admin_secret = get_admin_secret(message.from_user.id)
+    if not admin_secret or not check_totp(message, admin_secret):
+        reply_with_menu(message.chat.id, "❌ Невірний 2FA-код. Команда скасована.")
+        return
+    try:
+        text, markup = time_keys_listing()
+    except mysql.connector.Error as err:
+        reply_with_menu(message.chat.id, f"❌ Помилка бази даних: {err}")
+        return
+    if not text:
+        reply_with_menu(message.chat.id, "Немає тимчасових кодів.")
+        return
+    bot.send_message(message.chat.id, text, reply_markup=markup, priority=PRIORITY_BULK)
     send_commands_menu(message)
 
+
 @bot.callback_query_handler(func=lambda call: call.data.startswith("delete_time_key:"))
 @moderator_callback_only
 def delete_time_key_callback(call):
-    parts = call.data.split(":")
-    if len(parts) != 3:
-        bot.answer_callback_query(call.id, "Невірний формат даних.")
-        return
-    _, group_name, time_key = parts
+    hash_prefix = call.data.split(":", 1)[1]
     try:
-        execute_db("DELETE FROM time_key WHERE group_name = %s AND time_key = %s", (group_name, time_key), commit=True)
-        bot.answer_callback_query(call.id, f"Тимчасовий код для групи {group_name} видалено.")
-        bot.send_message(call.message.chat.id, f"Тимчасовий код для групи {group_name} - {time_key} видалено.")
+        if one_time_codes.revoke(hash_prefix):
+            bot.answer_callback_query(call.id, f"Тимчасовий код {hash_prefix[:8]} видалено.")
+        else:
+            bot.answer_callback_query(call.id, "Код уже використано або строк його дії минув.")
+        # Список оновлюється на місці замість нового повідомлення після кожного видалення
+        text, markup = time_keys_listing()
+        bot.edit_message_text(text or "Немає тимчасових кодів.", call.message.chat.id, call.message.message_id,
+                              reply_markup=markup, priority=PRIORITY_BULK)
     except Exception as err:
-        bot.send_message(call.message.chat.id, f"❌ Помилка видалення коду: {err}")
-        send_commands_menu(call.message)
+        reply_with_menu(call.message.chat.id, f"❌ Помилка видалення коду: {err}")
 
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "видалити групу")
+@text_router.command("видалити групу")
 @moderator_only
 def delete_group(message):
-    groups = execute_db("SELECT group_name, group_signature FROM groups_for_hetzner", fetchone=False)
-    if not groups:
-        bot.send_message(message.chat.id, "Немає доступних груп.")
-        send_commands_menu(message)
-        return
-
-    markup = InlineKeyboardMarkup()
-    for group in groups:
-        gname, gsign = group
-        display = gsign if gsign else gname
-        markup.add(InlineKeyboardButton(display, callback_data=f"select_group_to_delete:{gname}"))
-
-    bot.send_message(message.chat.id, "Оберіть групу для видалення:", reply_markup=markup)
+    if not send_group_picker(message.chat.id, "delete"):
+        reply_with_menu(message.chat.id, "Немає доступних груп.")
 
 
 @bot.callback_query_handler(func=lambda call: call.data.startswith("select_group_to_delete:"))
@@ -1305,78 +1971,228 @@ def select_group_to_delete(call):
     group_name = call.data.split(":", 1)[1]
     user_id = call.from_user.id
 
-    pending_group_deletion[user_id] = group_name
+    state.set("pending_group_deletion", user_id, group_name)
 
-    bot.send_message(call.message.chat.id, "Введіть код з Google Authenticator для підтвердження видалення:")
+    bot.answer_callback_query(call.id)
+    bot.edit_message_text(f"Введіть код з Google Authenticator для підтвердження видалення групи '{group_name}':",
+                          call.message.chat.id, call.message.message_id, priority=PRIORITY_URGENT)
     bot.register_next_step_handler(call.message, verify_group_deletion_2fa)
 
 
+@attempt_limited
 def verify_group_deletion_2fa(message):
     user_id = message.from_user.id
-    group_name = pending_group_deletion.get(user_id)
+    group_name = state.pop("pending_group_deletion", user_id)
 
     if not group_name:
         bot.send_message(message.chat.id, "❌ Помилка: сесія не знайдена. Спробуйте знову.")
         return
 
-    res = execute_db(
-        "SELECT secret_key FROM admins_2fa WHERE admin_id = %s",
-        (str(user_id),),
-        fetchone=True
-    )
-
-    if not res:
+    secret = get_admin_secret(user_id)
+    if not secret:
         bot.send_message(message.chat.id, "❌ Ваш 2FA-профіль не знайдений")
         return
 
-    secret = res[0]
-    totp = pyotp.TOTP(secret)
-
-    if totp.verify(message.text.strip()):
+    if check_totp(message, secret):
         try:
             execute_db(
                 "DELETE FROM groups_for_hetzner WHERE group_name = %s",
                 (group_name,),
                 commit=True
             )
-            bot.send_message(message.chat.id, f"✅ Група '{group_name}' та всі пов'язані дані видалені!")
-            send_commands_menu(message)
-            update_users_cache()
+            reply_with_menu(message.chat.id, f"✅ Група '{group_name}' та всі пов'язані дані видалені!")
+            unindex_group(group_name)
+            # Сервери групи видаляються каскадно
+            keyboards_changed("groups", "servers")
         except Exception as err:
-            bot.send_message(message.chat.id, f"❌ Помилка бази даних: {err}")
-            send_commands_menu(message)
+            reply_with_menu(message.chat.id, f"❌ Помилка бази даних: {err}")
     else:
-        bot.send_message(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
-        send_commands_menu(message)
-
-    pending_group_deletion.pop(user_id, None)
+        reply_with_menu(message.chat.id, "❌ Невірний 2FA-код. Операція скасована.")
 
 
-@bot.message_handler(func=lambda message: message.text.strip().lower() == "підписатися на розсилку про вильоти")
+@text_router.command("підписатися на розсилку про вильоти")
 def subscribe_emergency(message):
     # Перевіряємо, чи є запис з даним chat_id у таблиці emergency_bot_subscribers
-    result = execute_db("SELECT chat_id FROM emergency_bot_subscribers WHERE chat_id = %s",
-                        (str(message.chat.id),), fetchone=True)
+    result = execute_db(EMERGENCY_SUBSCRIBER_QUERY, (message.chat.id,), fetchone=True)
     if result:
         # Якщо запис є, видаляємо його (відписка)
-        execute_db("DELETE FROM emergency_bot_subscribers WHERE chat_id = %s",
-                   (str(message.chat.id),), commit=True)
-        bot.send_message(message.chat.id, "Ви успішно відписані від аварійної розсилки.")
+        execute_db(EMERGENCY_UNSUBSCRIBE_QUERY, (message.chat.id,), commit=True)
+        reply_with_menu(message.chat.id, "Ви успішно відписані від аварійної розсилки.")
     else:
         # Якщо запису немає, додаємо chat_id до таблиці (підписка)
         execute_db("INSERT INTO emergency_bot_subscribers (chat_id, admin_id) VALUES (%s, %s)",
-                   (str(message.chat.id), str(message.from_user.id)), commit=True)
+                   (message.chat.id, message.from_user.id), commit=True)
 
-        bot.send_message(message.chat.id, "Ви успішно підписані на аварійну розсилку.")
-    send_commands_menu(message)
+        reply_with_menu(message.chat.id, "Ви успішно підписані на аварійну розсилку.")
 
 # ==================== Загальний обробник текстових повідомлень ====================
-@bot.message_handler(content_types=['text'])
+@text_router.default
 @registered_only
 def all_text(message):
     send_commands_menu(message)
 
 
+# Останнім серед обробників: /команди вище мають перевірятися раніше за текстові кнопки
+text_router.attach(bot)
+
+
 # ==================== Запуск бота ====================
-print("Бот запущено")
-bot.polling(timeout=120)
+webhook_server = None
+
+
+# ==================== Запуск ====================
+# Секунди від STARTED_AT: готовність приймати оновлення, кінець фонового прогріву, перше оброблене оновлення
+startup_stats = {"ready": None, "warmed": None, "first_update": None}
+
+
+def format_startup_time(key):
+    value = startup_stats[key]
+    return "-" if value is None else f"{value:.2f} с"
+
+
+def warm_caches():
+    """
+    Фоновий прогрів після запуску: індекс користувачів (на нього чекають перевірки прав),
+    розкодовані ключі 2FA і клавіатури меню. Бот тим часом уже отримує оновлення.
+    """
+    try:
+        while not load_principals():
+            # Поки база недоступна, оновлення не чекають на індекс, а завантаження повторюється у фоні
+            principals_ready.set()
+            time.sleep(PRINCIPALS_RETRY_INTERVAL)
+        with principals_lock:
+            user_secrets = [secret for record in principals.values()
+                            for secret in (record.user_secret, record.admin_secret) if secret]
+        totp_engine.warm(user_secrets)
+        main_markup()
+        for name in MENUS:
+            menu_markup(name)
+    except Exception as err:
+        print(f"Помилка фонового прогріву: {err}")
+        logging.error(f"Помилка фонового прогріву: {err}")
+    finally:
+        # Навіть якщо база недоступна, оновлення не мають чекати на індекс до PRINCIPALS_LOAD_TIMEOUT
+        principals_ready.set()
+    startup_stats["warmed"] = time.monotonic() - STARTED_AT
+    logging.info(f"Прогрів завершено через {startup_stats['warmed']:.2f} с після запуску "
+                 f"(користувачів: {len(principals)})")
+
+
+def create_change_counters():
+    """Лічильники змін для кластера. ChangeCounter пише в cache_versions, тож створюється лише після міграцій."""
+    global principals_changes, keyboards_changes
+    if CLUSTER_WORKERS:
+        principals_changes = ChangeCounter(db_pool, "principals")
+        keyboards_changes = ChangeCounter(db_pool, "keyboards")
+
+
+def start_warmup():
+    threading.Thread(target=warm_caches, name="startup-warmup", daemon=True).start()
+
+
+def mark_ready():
+    startup_stats["ready"] = time.monotonic() - STARTED_AT
+    logging.info(f"Бот готовий приймати оновлення через {startup_stats['ready']:.2f} с після запуску")
+    if startup_stats["ready"] > STARTUP_TARGET:
+        logging.warning(f"Запуск триває довше за ціль {STARTUP_TARGET} с")
+
+
+def record_first_update():
+    startup_stats["first_update"] = time.monotonic() - STARTED_AT
+    logging.info(f"Перше оновлення оброблено через {startup_stats['first_update']:.2f} с після запуску")
+
+
+def run_webhook(target=bot):
+    global webhook_server
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    webhook_server = WebhookServer(target, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, secret,
+                                   record_file=WEBHOOK_RECORD_FILE)
+    try:
+        if not bot.set_webhook(url=WEBHOOK_URL, secret_token=secret, drop_pending_updates=False):
+            raise RuntimeError("Telegram відхилив setWebhook")
+        print(f"Бот запущено (webhook {WEBHOOK_URL} -> {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH})")
+        mark_ready()
+        webhook_server.serve_forever()
+    finally:
+        # Сюди доходять, коли serve_forever не запускався (помилка setWebhook, перехід на polling) або вже
+        # завершився, тож досить закрити сокет: httpd.shutdown() тут зависав би
+        webhook_server.close()
+        webhook_server = None
+
+
+def run_polling():
+    # getUpdates не працює, поки встановлено webhook
+    bot.remove_webhook()
+    print("Бот запущено")
+    mark_ready()
+    bot.polling(timeout=120)
+
+
+def worker_main(index, updates):
+    """Процес-обробник кластера. bot.py імпортується в ньому заново, тож пул, потоки й кеші - власні."""
+    # Міграції вже застосував ingress-процес до запуску обробників
+    create_change_counters()
+    start_warmup()
+    enable_step_persistence(f"./.handler-saves/step-{index}.save")
+    principals_changes.watch(PRINCIPALS_CHECK_INTERVAL, load_principals)
+    keyboards_changes.watch(PRINCIPALS_CHECK_INTERVAL, markup_cache.invalidate)
+    print(f"Процес-обробник {index} запущено")
+    run_worker(bot, updates)
+
+
+def run_cluster():
+    router = UpdateRouter(worker_main, CLUSTER_WORKERS, queue_size=DISPATCH_QUEUE_SIZE)
+    router.start()
+    try:
+        if UPDATE_MODE == "webhook":
+            try:
+                run_webhook(router)
+                return
+            except Exception as err:
+                print(f"Не вдалося запустити webhook: {err}. Переходимо на polling.")
+                logging.error(f"Не вдалося запустити webhook: {err}. Переходимо на polling.")
+        bot.remove_webhook()
+        print(f"Бот запущено (кластер: {CLUSTER_WORKERS} процесів-обробників)")
+        mark_ready()
+        lease = Lease(db_pool, "poller", ttl=CLUSTER_LEASE_TTL)
+        try:
+            poll_updates(bot, router, lease)
+        finally:
+            lease.release()
+    except KeyboardInterrupt:
+        print("Зупинка кластера...")
+    finally:
+        if webhook_server:
+            webhook_server.shutdown()
+        router.stop()
+
+
+def main():
+    if not CLUSTER_WORKERS:
+        # Процеси для QR-кодів форкаються першими: потоки диспетчера запускаються лише з першим оновленням,
+        # а решта фонових потоків - нижче
+        qr_renderer.start()
+    # Схема має відповідати коду ще до першого оновлення; без нових міграцій це один запит
+    check_and_update_version()
+    create_change_counters()
+    if WATCHER_ENABLED:
+        status_watcher.start()
+    # Один sweeper на весь бот: у кластері main() виконується лише в ingress-процесі
+    one_time_codes.start()
+    if CLUSTER_WORKERS:
+        run_cluster()
+        return
+    start_warmup()
+    enable_step_persistence()
+    if UPDATE_MODE == "webhook":
+        try:
+            run_webhook()
+            return
+        except Exception as err:
+            print(f"Не вдалося запустити webhook: {err}. Переходимо на polling.")
+            logging.error(f"Не вдалося запустити webhook: {err}. Переходимо на polling.")
+    run_polling()
+
+
+if __name__ == "__main__":
+    main()
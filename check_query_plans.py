@@ -0,0 +1,63 @@
+"""
+Перевірка планів гарячих запитів bot.py через EXPLAIN.
+Завершується з кодом 1, якщо якийсь запит читає таблицю повним скануванням - рядків (type = ALL)
+чи всього індексу (type = index).
+
+    python check_query_plans.py
+
+Перед перевіркою застосовуються оновлення схеми (як при запуску бота), сам бот не запускається.
+"""
+import sys
+
+import auth_limiter
+import bot
+import one_time_codes
+
+FULL_SCAN_TYPES = ("ALL", "index")
+# Таблиці, які запит читає повністю за задумом: спостерігач завантажує всі підписки разом
+EXPECTED_SCANS = {"сервери для спостереження": {"w"}}
+
+# (опис, запит, параметри) - запити беруться з тих самих констант, що виконують обробники
+HOT_QUERIES = [
+    ("погашення одноразового коду", one_time_codes.CLAIM_QUERY, (1, "0" * 64)),
+    ("група погашеного коду", one_time_codes.CLAIMED_GROUP_QUERY, ("0" * 64, 1)),
+    ("прострочені одноразові коди", one_time_codes.SWEEP_QUERY, (1000,)),
+    ("невдалі спроби 2FA", auth_limiter.READ_FAILURES_QUERY, (1,)),
+    ("підписка на розсилку", bot.EMERGENCY_SUBSCRIBER_QUERY, (1,)),
+    ("відписка від розсилки", bot.EMERGENCY_UNSUBSCRIBE_QUERY, (1,)),
+    ("заблокований користувач", bot.BLOCKED_USER_QUERY, (1,)),
+    ("очікуваний модератор", bot.PENDING_ADMIN_QUERY, (1,)),
+    ("сервери групи", bot.GROUP_SERVERS_QUERY, ("group",)),
+    ("ключ Hetzner групи", bot.GROUP_KEY_QUERY, ("group",)),
+    ("підписка на статус", bot.WATCH_SUBSCRIPTION_QUERY, (1, "group")),
+    ("сервери для спостереження", bot.WATCH_TARGETS_QUERY, ()),
+    ("сповіщення про статус", bot.WATCH_NOTIFY_QUERY.format(placeholders="%s"), ("key", "1")),
+]
+
+
+def full_scans(query, params, expected=()):
+    with bot.db_pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN " + query, params)
+        columns = cursor.column_names
+        rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        cursor.close()
+    return [f"{row['table']} ({row['type']})" for row in rows
+            if row.get("type") in FULL_SCAN_TYPES and row["table"] not in expected]
+
+
+def main():
+    bot.check_and_update_version()
+    failed = False
+    for name, query, params in HOT_QUERIES:
+        tables = full_scans(query, params, EXPECTED_SCANS.get(name, ()))
+        if tables:
+            failed = True
+            print(f"❌ {name}: повне сканування {', '.join(tables)}")
+        else:
+            print(f"✅ {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+
+import mysql.connector
+
+from dispatcher import update_chat_id
+
+
+class UpdateRouter:
+    """
+    Ingress кластера: розкладає оновлення по N процесах-обробниках за chat id,
+    тож усі оновлення одного чату обробляє той самий процес і в тому ж порядку.
+    Має process_new_updates, тому підставляється замість bot у WebhookServer.
+    Процеси запускаються через spawn: кожен заново імпортує модуль з target
+    і створює власні пул з'єднань, потоки та кеші, нічого не успадковуючи від ingress.
+    """
+
+    def __init__(self, target, workers, queue_size=1000, supervise_interval=5):
+        self.target = target
+        self.workers = workers
+        self.supervise_interval = supervise_interval
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue(queue_size) for _ in range(workers)]
+        self._processes = [None] * workers
+        self._stopped = threading.Event()
+        self.stats = {"routed": [0] * workers, "restarts": 0}
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        threading.Thread(target=self._supervise, name="cluster-supervisor", daemon=True).start()
+
+    def _spawn(self, index):
+        process = self._context.Process(target=self.target, args=(index, self._queues[index]),
+                                        name=f"bot-worker-{index}", daemon=True)
+        process.start()
+        self._processes[index] = process
+
+    def _supervise(self):
+        while not self._stopped.wait(self.supervise_interval):
+            for index, process in enumerate(self._processes):
+                if process.is_alive() or self._stopped.is_set():
+                    continue
+                logging.error(f"Процес-обробник {index} завершився з кодом {process.exitcode}, перезапуск")
+                print(f"Процес-обробник {index} завершився з кодом {process.exitcode}, перезапуск")
+                self.stats["restarts"] += 1
+                self._spawn(index)
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            index = int(update_chat_id(update)) % self.workers
+            # Якщо процес не встигає, put чекає - ingress не набирає оновлень більше, ніж можна обробити
+            self._queues[index].put(update)
+            self.stats["routed"][index] += 1
+
+    def stop(self, timeout=10):
+        self._stopped.set()
+        for updates in self._queues:
+            updates.put(None)
+        for process in self._processes:
+            process.join(timeout)
+
+
+def run_worker(bot, updates):
+    """Цикл процесу-обробника: бере оновлення зі своєї черги і віддає їх bot."""
+    while True:
+        update = updates.get()
+        if update is None:
+            return
+        bot.process_new_updates([update])
+
+
+class Lease:
+    """
+    Оренда ролі (напр. poller-а) в таблиці cluster_leases: тримає той, хто продовжує її частіше, ніж раз на ttl.
+    Якщо власник зник, після закінчення ttl роль забирає наступний, хто викличе acquire().
+    """
+
+    def __init__(self, pool, name, ttl=90):
+        self.pool = pool
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+
+    def acquire(self):
+        """Отримує або продовжує оренду. Повертає True, якщо вона належить цьому процесу."""
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    # holder оновлюється першим, тому expires_at продовжується лише для нового/поточного власника
+                    cursor.execute("""
+                        INSERT INTO cluster_leases (name, holder, expires_at)
+                        VALUES (%s, %s, NOW() + INTERVAL %s SECOND)
+                        ON DUPLICATE KEY UPDATE
+                            holder = IF(holder = VALUES(holder) OR expires_at < NOW(), VALUES(holder), holder),
+                            expires_at = IF(holder = VALUES(holder), VALUES(expires_at), expires_at)
+                    """, (self.name, self.holder, self.ttl))
+                    cursor.execute("SELECT holder FROM cluster_leases WHERE name = %s", (self.name,))
+                    rows = cursor.fetchall()
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as err:
+            # Без бази не можна бути певним, що роль ще наша
+            logging.error(f"Не вдалося продовжити оренду {self.name}: {err}")
+            rows = []
+        held = bool(rows) and rows[0][0] == self.holder
+        if held != self.held:
+            logging.info(f"Оренда {self.name}: {'отримано' if held else 'втрачено'} ({self.holder})")
+        self.held = held
+        return held
+
+    def load_offset(self):
+        """offset getUpdates, збережений останнім власником оренди (None - ще не зберігався чи база недоступна)."""
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute("SELECT update_offset FROM cluster_leases WHERE name = %s", (self.name,))
+                    rows = cursor.fetchall()
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as err:
+            logging.error(f"Не вдалося прочитати offset оренди {self.name}: {err}")
+            return None
+        return rows[0][0] if rows else None
+
+    def save_offset(self, offset):
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    cursor.execute("UPDATE cluster_leases SET update_offset = %s WHERE name = %s AND holder = %s",
+                                   (offset, self.name, self.holder))
+                finally:
+                    cursor.close()
+        except mysql.connector.Error as err:
+            logging.error(f"Не вдалося зберегти offset оренди {self.name}: {err}")
+
+    def release(self):
+        if not self.held:
+            return
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("UPDATE cluster_leases SET expires_at = NOW() WHERE name = %s AND holder = %s",
+                               (self.name, self.holder))
+            finally:
+                cursor.close()
+        self.held = False
+
+
+def poll_updates(bot, target, lease, timeout=30):
+    """
+    Long polling, поки цей процес тримає оренду lease; резервні ingress-процеси тим часом чекають.
+    Отримані оновлення віддаються target.process_new_updates.
+    offset переданих оновлень зберігається разом з орендою: новий власник (чи цей процес, коли поверне
+    оренду) продовжує з нього, і getUpdates не віддає вже оброблені оновлення вдруге.
+    """
+    offset = None
+    leading = False
+    while True:
+        if not lease.acquire():
+            leading = False
+            time.sleep(lease.ttl / 3)
+            continue
+        if not leading:
+            stored = lease.load_offset()
+            if stored is not None and (offset is None or stored > offset):
+                offset = stored
+            leading = True
+        try:
+            updates = bot.get_updates(offset=offset, timeout=timeout, long_polling_timeout=timeout)
+        except Exception as err:
+            logging.error(f"Помилка getUpdates: {err}")
+            time.sleep(3)
+            continue
+        if updates:
+            target.process_new_updates(updates)
+            offset = updates[-1].update_id + 1
+            lease.save_offset(offset)
+
+
+class ChangeCounter:
+    """
+    Лічильник змін у таблиці cache_versions для кешів, які тримає кожен процес.
+    Процес, що змінив дані, викликає bump(); інші в watch() бачать нову версію й перечитують кеш.
+    Якщо on_change повертає False (кеш перечитати не вдалося), версія не вважається побаченою
+    і перечитування повторюється на наступній перевірці.
+    """
+
+    def __init__(self, pool, name):
+        self.pool = pool
+        self.name = name
+        self._lock = threading.Lock()
+        self._execute("INSERT IGNORE INTO cache_versions (name, version) VALUES (%s, 0)", (name,))
+        self.seen = self.version()
+
+    def _execute(self, query, params):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall() if cursor.with_rows else None
+            finally:
+                cursor.close()
+
+    def version(self):
+        return self._execute("SELECT version FROM cache_versions WHERE name = %s", (self.name,))[0][0]
+
+    def bump(self):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute("UPDATE cache_versions SET version = LAST_INSERT_ID(version + 1) WHERE name = %s",
+                               (self.name,))
+                cursor.execute("SELECT LAST_INSERT_ID()")
+                version = cursor.fetchall()[0][0]
+            finally:
+                cursor.close()
+        with self._lock:
+            # Власна зміна вже внесена в локальний кеш; чужі зміни між ними - ні
+            if self.seen == version - 1:
+                self.seen = version
+
+    def watch(self, interval, on_change):
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    current = self.version()
+                except mysql.connector.Error as err:
+                    logging.warning(f"Не вдалося перевірити версію кешу {self.name}: {err}")
+                    continue
+                with self._lock:
+                    if current == self.seen:
+                        continue
+                if on_change() is False:
+                    continue
+                with self._lock:
+                    self.seen = max(self.seen, current)
+
+        thread = threading.Thread(target=run, name=f"cache-watch-{self.name}", daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,149 @@
+import contextlib
+import logging
+import queue
+import threading
+import time
+
+import mysql.connector
+
+
+class ConnectionPool:
+    """
+    Обмежений пул з'єднань MySQL.
+    З'єднання створюються ліниво (не більше size), перед видачею перевіряються ping-ом,
+    якщо довго простоювали, і перепідключаються, якщо сервер їх уже закрив.
+    """
+
+    def __init__(self, size=5, timeout=10, ping_interval=30, **connect_args):
+        self.size = size
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        # autocommit, щоб повернуте в пул з'єднання не тримало старий знімок транзакції
+        connect_args.setdefault("autocommit", True)
+        # буферизовані курсори, щоб недочитаний результат (fetchone) не лишався на з'єднанні в пулі
+        connect_args.setdefault("buffered", True)
+        self.connect_args = connect_args
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time": 0.0,
+            "reconnects": 0,
+            "created": 0,
+            "discarded": 0,
+            "queries": 0,
+            "query_time": 0.0,
+        }
+
+    def _count(self, key, value=1):
+        with self._lock:
+            self.stats[key] += value
+
+    def _connect(self):
+        conn = mysql.connector.connect(**self.connect_args)
+        self._count("created")
+        return conn
+
+    def _checked(self, conn, last_used):
+        if time.monotonic() - last_used < self.ping_interval:
+            return conn
+        try:
+            conn.ping(reconnect=False)
+            return conn
+        except mysql.connector.Error:
+            pass
+        # З'єднання протухло (wait_timeout, рестарт MySQL) - відкриваємо нове на його місці
+        self._count("reconnects")
+        try:
+            conn.close()
+        except mysql.connector.Error:
+            pass
+        try:
+            return self._connect()
+        except mysql.connector.Error:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def acquire(self):
+        self._count("checkouts")
+        try:
+            conn, last_used = self._idle.get_nowait()
+            return self._checked(conn, last_used)
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._connect()
+            except mysql.connector.Error:
+                with self._lock:
+                    self._created -= 1
+                raise
+        started = time.monotonic()
+        self._count("waits")
+        try:
+            conn, last_used = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise mysql.connector.errors.PoolError(
+                f"Немає вільних з'єднань у пулі за {self.timeout} с (розмір {self.size})")
+        finally:
+            self._count("wait_time", time.monotonic() - started)
+        return self._checked(conn, last_used)
+
+    def release(self, conn, broken=False):
+        if broken:
+            self._count("discarded")
+            with self._lock:
+                self._created -= 1
+            try:
+                conn.close()
+            except mysql.connector.Error:
+                pass
+            return
+        self._idle.put((conn, time.monotonic()))
+
+    @contextlib.contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError):
+            self.release(conn, broken=True)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def record_query(self, elapsed):
+        with self._lock:
+            self.stats["queries"] += 1
+            self.stats["query_time"] += elapsed
+
+    def close_all(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                self._created -= 1
+            try:
+                conn.close()
+            except mysql.connector.Error as err:
+                logging.warning(f"Помилка закриття з'єднання з пулу: {err}")
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats["size"] = self.size
+        stats["open"] = self._created
+        stats["idle"] = self._idle.qsize()
+        return stats
@@ -0,0 +1,221 @@
+import collections
+import logging
+import queue
+import threading
+import time
+
+import telebot
+
+
+class ChatDispatcher:
+    """
+    Пул робочих потоків, який обробляє оновлення різних чатів паралельно,
+    а оновлення одного чату - строго по черзі (на цьому тримаються register_next_step_handler).
+    Загальна кількість оновлень у черзі обмежена queue_size: якщо черга повна, submit чекає.
+    Потоки запускаються при першому submit, тож імпорт bot.py не створює потоків (див. QRRenderer.start).
+    """
+
+    def __init__(self, handler, workers=8, queue_size=1000):
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._ready = queue.Queue()
+        self._chats = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            "submitted": 0,
+            "processed": 0,
+            "failed": 0,
+            "depth": 0,
+            "max_depth": 0,
+            "wait_time": 0.0,
+            "max_wait": 0.0,
+            "full_waits": 0,
+        }
+        self._threads = []
+
+    def _start_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"dispatch-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, key, item):
+        if not self._threads:
+            self._start_workers()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats["full_waits"] += 1
+            self._slots.acquire()
+        with self._lock:
+            self.stats["submitted"] += 1
+            self.stats["depth"] += 1
+            self.stats["max_depth"] = max(self.stats["max_depth"], self.stats["depth"])
+            pending = self._chats.get(key)
+            if pending is not None:
+                # Чат уже обробляється або чекає - просто стаємо в його чергу
+                pending.append((time.monotonic(), item))
+                return
+            self._chats[key] = collections.deque([(time.monotonic(), item)])
+        self._ready.put(key)
+
+    def _run(self):
+        while True:
+            key = self._ready.get()
+            if key is None:
+                return
+            with self._lock:
+                enqueued, item = self._chats[key].popleft()
+                wait = time.monotonic() - enqueued
+                self.stats["depth"] -= 1
+                self.stats["wait_time"] += wait
+                self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+            self._slots.release()
+            try:
+                self.handler(item)
+            except Exception as err:
+                with self._lock:
+                    self.stats["failed"] += 1
+                logging.exception(f"Помилка обробки оновлення чату {key}: {err}")
+            finally:
+                self._done(key)
+
+    def _done(self, key):
+        with self._lock:
+            self.stats["processed"] += 1
+            if not self._chats[key]:
+                del self._chats[key]
+                return
+        # В кінець загальної черги, щоб один активний чат не займав потік надовго
+        self._ready.put(key)
+
+    def snapshot(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["active_chats"] = len(self._chats)
+        stats["workers"] = self.workers
+        stats["queue_size"] = self.queue_size
+        return stats
+
+    def stop(self):
+        for _ in self._threads:
+            self._ready.put(None)
+
+
+class AsyncChatDispatcher:
+    """
+    asyncio-аналог ChatDispatcher: кожен активний чат обробляється окремою задачею,
+    оновлення одного чату - строго по черзі. queue_size обмежує кількість оновлень,
+    які чекають або обробляються; якщо ліміт вичерпано, submit чекає.
+    """
+
+    def __init__(self, handler, queue_size=1000):
+        # asyncio потрібен лише asyncio-рантайму, тож bot.py не витрачає на його імпорт час запуску
+        import asyncio
+
+        self.handler = handler
+        self.queue_size = queue_size
+        self._slots = asyncio.Semaphore(queue_size)
+        self._chats = {}
+        self._tasks = set()
+        self.stats = {
+            "submitted": 0,
+            "processed": 0,
+            "failed": 0,
+            "depth": 0,
+            "max_depth": 0,
+            "wait_time": 0.0,
+            "max_wait": 0.0,
+            "full_waits": 0,
+        }
+
+    async def submit(self, key, item):
+        import asyncio
+
+        if self._slots.locked():
+            self.stats["full_waits"] += 1
+        await self._slots.acquire()
+        self.stats["submitted"] += 1
+        self.stats["depth"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], self.stats["depth"])
+        pending = self._chats.get(key)
+        if pending is not None:
+            pending.append((time.monotonic(), item))
+            return
+        self._chats[key] = collections.deque([(time.monotonic(), item)])
+        task = asyncio.create_task(self._run(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key):
+        pending = self._chats[key]
+        while pending:
+            enqueued, item = pending.popleft()
+            wait = time.monotonic() - enqueued
+            self.stats["depth"] -= 1
+            self.stats["wait_time"] += wait
+            self.stats["max_wait"] = max(self.stats["max_wait"], wait)
+            try:
+                await self.handler(item)
+            except Exception as err:
+                self.stats["failed"] += 1
+                logging.exception(f"Помилка обробки оновлення чату {key}: {err}")
+            finally:
+                self.stats["processed"] += 1
+                self._slots.release()
+        # Між перевіркою while і видаленням немає await, тож нове оновлення не загубиться
+        del self._chats[key]
+
+    def snapshot(self):
+        stats = dict(self.stats)
+        stats["active_chats"] = len(self._chats)
+        stats["workers"] = len(self._tasks)
+        stats["queue_size"] = self.queue_size
+        return stats
+
+    async def join(self):
+        import asyncio
+
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+
+def update_chat_id(update):
+    for name in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        message = getattr(update, name, None)
+        if message is not None:
+            return message.chat.id
+    call = getattr(update, "callback_query", None)
+    if call is not None:
+        return call.message.chat.id if call.message else call.from_user.id
+    for name in ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query",
+                 "my_chat_member", "chat_member", "chat_join_request"):
+        event = getattr(update, name, None)
+        if event is not None and getattr(event, "from_user", None) is not None:
+            return event.from_user.id
+    return update.update_id
+
+
+class DispatchingTeleBot(telebot.TeleBot):
+    """
+    TeleBot, у якого process_new_updates лише розкладає оновлення по чергах ChatDispatcher,
+    а самі обробники виконуються в його робочих потоках.
+    """
+
+    def __init__(self, token, workers=8, queue_size=1000, **kwargs):
+        super().__init__(token, threaded=False, **kwargs)
+        self.dispatcher = ChatDispatcher(self._process_update, workers=workers, queue_size=queue_size)
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            # offset для getUpdates має зсуватися одразу, а не після обробки
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            self.dispatcher.submit(update_chat_id(update), update)
+
+    def _process_update(self, update):
+        telebot.TeleBot.process_new_updates(self, [update])
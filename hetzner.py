@@ -0,0 +1,428 @@
+import json
+import logging
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_URL = "https://api.hetzner.cloud/v1"
+SERVER_ACTIONS = ("poweron", "shutdown", "reboot")
+
+
+class HetznerError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class HetznerClientBase:
+    """
+    Спільна для синхронного й асинхронного клієнтів політика: коли повторювати запит,
+    скільки чекати перед повтором, облік заголовків RateLimit-* і текст помилки.
+    """
+
+    def __init__(self, connect_timeout=5, read_timeout=20, retries=3, backoff=0.5, max_backoff=10,
+                 pool_size=10):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self._sessions = {}
+        # token -> {"limit": int, "remaining": int, "reset": unix time}
+        self.rate_limits = {}
+
+    def _record_rate_limit(self, token, headers):
+        remaining = headers.get("RateLimit-Remaining")
+        if remaining is None:
+            return
+        try:
+            self.rate_limits[token] = {
+                "limit": int(headers.get("RateLimit-Limit", 0)),
+                "remaining": int(remaining),
+                "reset": int(headers.get("RateLimit-Reset", 0)),
+            }
+        except ValueError:
+            logging.warning(f"Некоректні заголовки RateLimit від Hetzner: {remaining}")
+
+    def remaining(self, token):
+        info = self.rate_limits.get(token)
+        return info["remaining"] if info else None
+
+    def _delay(self, attempt, status=None, headers=None):
+        if status == 429 and headers is not None:
+            reset = headers.get("RateLimit-Reset")
+            if reset and reset.isdigit():
+                return min(max(int(reset) - time.time(), self.backoff), self.max_backoff)
+        return min(self.backoff * 2 ** attempt, self.max_backoff)
+
+    @staticmethod
+    def _retryable(method, status):
+        # POST повторюємо лише тоді, коли API точно не виконав дію
+        return status in (429, 503) or (method == "GET" and status >= 500)
+
+    @staticmethod
+    def _error_message(status, text):
+        try:
+            error = json.loads(text).get("error", {})
+            return f"{error.get('code', status)}: {error.get('message', text)}"
+        except (ValueError, AttributeError):
+            return f"{status}: {text}"
+
+
+class HetznerClient(HetznerClientBase):
+    """
+    Клієнт Hetzner Cloud API: окрема keep-alive сесія на кожен токен, явні таймаути,
+    повтори з backoff на 429/5xx та облік заголовків RateLimit-*.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timeout = (self.connect_timeout, self.read_timeout)
+        self._lock = threading.Lock()
+
+    def _session(self, token):
+        session = self._sessions.get(token)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(token)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.headers["Authorization"] = f"Bearer {token}"
+                self._sessions[token] = session
+        return session
+
+    def request(self, token, method, path, **kwargs):
+        idempotent = method == "GET"
+        session = self._session(token)
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                response = session.request(method, API_URL + path, timeout=self.timeout, **kwargs)
+            except requests.ConnectTimeout as err:
+                # Запит навіть не дійшов до сервера - можна повторювати будь-який метод
+                if last:
+                    raise HetznerError(None, f"Hetzner API недоступний: {err}")
+                time.sleep(self._delay(attempt))
+                continue
+            except requests.RequestException as err:
+                if last or not idempotent:
+                    raise HetznerError(None, f"Помилка з'єднання з Hetzner API: {err}")
+                time.sleep(self._delay(attempt))
+                continue
+            self._record_rate_limit(token, response.headers)
+            status = response.status_code
+            if self._retryable(method, status) and not last:
+                logging.warning(f"Hetzner API {method} {path}: {status}, повтор {attempt + 1}")
+                time.sleep(self._delay(attempt, status, response.headers))
+                continue
+            if status >= 400:
+                raise HetznerError(status, self._error_message(status, response.text))
+            return response.json() if response.content else {}
+
+    def get_server(self, token, server_id):
+        return self.request(token, "GET", f"/servers/{server_id}").get("server", {})
+
+    def list_servers(self, token, per_page=50, concurrency=2):
+        """
+        Усі сервери проєкту одним-кількома запитами GET /servers.
+        Після першої сторінки решта завантажується паралельно, не більше concurrency запитів на токен.
+        """
+        first = self.request(token, "GET", "/servers", params={"page": 1, "per_page": per_page})
+        servers = first.get("servers", [])
+        last_page = (first.get("meta") or {}).get("pagination", {}).get("last_page") or 1
+        if last_page > 1:
+            def fetch(page):
+                return self.request(token, "GET", "/servers",
+                                    params={"page": page, "per_page": per_page}).get("servers", [])
+
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                for page_servers in pool.map(fetch, range(2, last_page + 1)):
+                    servers.extend(page_servers)
+        return servers
+
+    def get_actions(self, token, action_ids):
+        params = [("id", action_id) for action_id in action_ids]
+        return self.request(token, "GET", "/actions", params=params).get("actions", [])
+
+    def server_action(self, token, server_id, action):
+        if action not in SERVER_ACTIONS:
+            raise ValueError(f"Невідома дія {action}")
+        return self.request(token, "POST", f"/servers/{server_id}/actions/{action}").get("action", {})
+
+
+class ServerStatusCache:
+    """
+    Короткоживучий кеш GET /servers/{id} за ключем (token, server_id).
+    Одночасні запити за одним ключем об'єднуються в один запит до API,
+    а після дій через бота запис інвалідовується.
+    """
+
+    def __init__(self, client, ttl=10):
+        self.client = client
+        self.ttl = ttl
+        self._entries = {}
+        self._inflight = {}
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    def get(self, token, server_id):
+        key = (token, str(server_id))
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            with self._lock:
+                self.stats["hits"] += 1
+            return entry[1]
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = Future()
+                self._inflight[key] = call
+                generation = self._generations.get(key, 0)
+                self.stats["misses"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        if not leader:
+            return call.result()
+        try:
+            server = self.client.get_server(token, server_id)
+        except Exception as err:
+            call.set_exception(err)
+            raise
+        else:
+            call.set_result(server)
+            return server
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                # Якщо поки йшов запит сервер інвалідували, відповідь могла вже застаріти
+                if call.done() and not call.exception() and self._generations.get(key, 0) == generation:
+                    self._entries[key] = (time.monotonic() + self.ttl, call.result())
+
+    def put(self, token, server_id, server):
+        with self._lock:
+            self._entries[(token, str(server_id))] = (time.monotonic() + self.ttl, server)
+
+    def invalidate(self, token, server_id):
+        key = (token, str(server_id))
+        with self._lock:
+            self._entries.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+
+class _TrackedAction:
+    __slots__ = ("token", "callback", "interval", "next_poll", "progress")
+
+    def __init__(self, token, callback, interval):
+        self.token = token
+        self.callback = callback
+        self.interval = interval
+        self.next_poll = time.monotonic() + interval
+        self.progress = None
+
+
+class ActionTracker:
+    """
+    Фоновий потік, який стежить за діями Hetzner (GET /actions?id=..&id=..) до їх завершення.
+    Дії одного токена опитуються одним запитом; інтервал росте, поки прогрес не змінюється.
+    callback(action, finished) викликається з потоку трекера.
+    """
+
+    def __init__(self, client, min_interval=1, max_interval=10, batch_size=25):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.batch_size = batch_size
+        self._tracked = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def track(self, token, action, callback):
+        if action.get("status") != "running":
+            callback(action, True)
+            return
+        with self._cond:
+            self._tracked[action["id"]] = _TrackedAction(token, callback, self.min_interval)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="hetzner-actions", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def pending(self):
+        return len(self._tracked)
+
+    def _due(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._tracked:
+                    wake = min(item.next_poll for item in self._tracked.values())
+                    if wake <= now:
+                        break
+                    self._cond.wait(wake - now)
+                else:
+                    self._cond.wait()
+            by_token = {}
+            for action_id, item in self._tracked.items():
+                if item.next_poll <= now:
+                    by_token.setdefault(item.token, []).append(action_id)
+            return by_token
+
+    def _run(self):
+        # Потік трекера один на всі дії: помилка в ньому не повинна зупиняти стеження за рештою
+        while True:
+            try:
+                for token, action_ids in self._due().items():
+                    for start in range(0, len(action_ids), self.batch_size):
+                        self._poll(token, action_ids[start:start + self.batch_size])
+            except Exception as err:
+                logging.exception(f"Помилка трекера дій Hetzner: {err}")
+                time.sleep(self.min_interval)
+
+    def _poll(self, token, action_ids):
+        try:
+            actions = {action["id"]: action for action in self.client.get_actions(token, action_ids)}
+        except HetznerError as err:
+            logging.warning(f"Не вдалося отримати стан дій Hetzner {action_ids}: {err}")
+            actions = {}
+        except Exception as err:
+            # Напр. некоректний JSON у відповіді 200 - дії опитуються знову, як після помилки API
+            logging.exception(f"Некоректна відповідь Hetzner для дій {action_ids}: {err}")
+            actions = {}
+        for action_id in action_ids:
+            item = self._tracked.get(action_id)
+            action = actions.get(action_id)
+            if action is None:
+                item.interval = min(item.interval * 2, self.max_interval)
+            elif action.get("status") != "running":
+                with self._cond:
+                    del self._tracked[action_id]
+                self._notify(item, action, True)
+                continue
+            elif action.get("progress") != item.progress:
+                item.progress = action.get("progress")
+                item.interval = self.min_interval
+                self._notify(item, action, False)
+            else:
+                item.interval = min(item.interval * 1.5, self.max_interval)
+            item.next_poll = time.monotonic() + item.interval
+
+    @staticmethod
+    def _notify(item, action, finished):
+        try:
+            item.callback(action, finished)
+        except Exception as err:
+            logging.error(f"Помилка обробника дії Hetzner {action.get('id')}: {err}")
+
+
+class StatusWatcher:
+    """
+    Фонове опитування статусів серверів: один список GET /servers на токен за цикл,
+    порівняння з попереднім станом і виклик on_changes(token, [(server, old, new), ...]) лише для змін.
+    Інтервал кожного токена підбирається так, щоб витрачати не більше budget_share його ліміту запитів.
+    """
+
+    def __init__(self, client, load_targets, on_changes, min_interval=30, max_interval=600, budget_share=0.3,
+                 targets_ttl=60, per_page=50):
+        self.client = client
+        self.load_targets = load_targets
+        self.on_changes = on_changes
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget_share = budget_share
+        self.targets_ttl = targets_ttl
+        self.per_page = per_page
+        self._states = {}
+        self._next_poll = {}
+        self._targets = {}
+        self._targets_loaded = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="status-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _interval(self, token, servers_count):
+        pages = max(1, math.ceil(servers_count / self.per_page))
+        info = self.client.rate_limits.get(token)
+        if not info or not info["limit"]:
+            return self.min_interval
+        # Ліміт Hetzner поповнюється рівномірно протягом години
+        refill_per_second = info["limit"] / 3600
+        interval = pages / (refill_per_second * self.budget_share)
+        if info["remaining"] < info["limit"] * 0.1:
+            interval *= 4
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def _refresh_targets(self):
+        if time.monotonic() - self._targets_loaded < self.targets_ttl:
+            return
+        # Час спроби, а не успіху: недоступна база перепитується раз на targets_ttl, а не щосекунди,
+        # а спостерігач тим часом опитує попередній список
+        self._targets_loaded = time.monotonic()
+        try:
+            self._targets = self.load_targets()
+        except Exception as err:
+            logging.error(f"Не вдалося завантажити сервери для спостереження: {err}")
+            return
+        for token in list(self._states):
+            if token not in self._targets:
+                del self._states[token]
+                self._next_poll.pop(token, None)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._refresh_targets()
+            now = time.monotonic()
+            for token, server_ids in self._targets.items():
+                if self._next_poll.get(token, 0) > now:
+                    continue
+                try:
+                    self._poll(token, server_ids)
+                except Exception as err:
+                    # Напр. некоректна відповідь API: токен опитується пізніше, а потік і решта токенів працюють далі
+                    logging.exception(f"Спостерігач статусів: помилка опитування: {err}")
+                    self._next_poll[token] = time.monotonic() + self.max_interval
+            wake = min(self._next_poll.values(), default=now + self.min_interval)
+            self._stop.wait(max(1, min(wake, self._targets_loaded + self.targets_ttl) - time.monotonic()))
+
+    def _poll(self, token, server_ids):
+        try:
+            servers = self.client.list_servers(token, per_page=self.per_page, concurrency=1)
+        except HetznerError as err:
+            logging.warning(f"Спостерігач статусів: помилка Hetzner API: {err}")
+            self._next_poll[token] = time.monotonic() + self.max_interval
+            return
+        previous = self._states.get(token)
+        current = {}
+        changes = []
+        for server in servers:
+            server_id = str(server["id"])
+            if server_id not in server_ids:
+                continue
+            status = server.get("status")
+            current[server_id] = status
+            # Перше опитування лише запам'ятовує стан
+            if previous is not None and previous.get(server_id, status) != status:
+                changes.append((server, previous[server_id], status))
+        self._states[token] = current
+        self._next_poll[token] = time.monotonic() + self._interval(token, len(servers))
+        if changes:
+            try:
+                self.on_changes(token, changes)
+            except Exception as err:
+                logging.error(f"Помилка надсилання змін статусу: {err}")
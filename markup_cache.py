@@ -0,0 +1,48 @@
+import threading
+
+
+class MarkupCache:
+    """
+    Готові клавіатури у вигляді JSON: кожна будується і серіалізується один раз,
+    далі в send_message/edit_message_* передається той самий рядок.
+    Ключ - кортеж, перший елемент якого - область ("menu", "servers", "groups"),
+    за нею кеш скидається, коли змінюються дані, з яких будувалися клавіатури.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.stats = {"hits": 0, "builds": 0, "invalidations": 0}
+
+    def get(self, key, build):
+        """Повертає JSON клавіатури з кешу або будує її через build(). None (немає даних) не кешується."""
+        cached = self._items.get(key)
+        if cached is not None:
+            self.stats["hits"] += 1
+            return cached
+        generation = self._generation
+        markup = build()
+        if markup is None:
+            return None
+        cached = markup.to_json()
+        with self._lock:
+            # Якщо під час побудови кеш скинули, клавіатура могла зібратися зі старих даних
+            if generation == self._generation:
+                self._items[key] = cached
+            self.stats["builds"] += 1
+        return cached
+
+    def invalidate(self, *scopes):
+        """Скидає клавіатури вказаних областей, без аргументів - усі."""
+        with self._lock:
+            self._generation += 1
+            self.stats["invalidations"] += 1
+            if not scopes:
+                self._items.clear()
+                return
+            for key in [key for key in self._items if key[0] in scopes]:
+                del self._items[key]
+
+    def __len__(self):
+        return len(self._items)
@@ -0,0 +1,395 @@
+import hashlib
+import logging
+
+import mysql.connector
+
+MIGRATIONS_LOCK = "hetzner_bot_migrations"
+
+create_migrations_table = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    id INT NOT NULL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    checksum CHAR(64) NOT NULL,
+    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Перевірки для ідемпотентності: запит повертає рядок, якщо зміна вже є в базі
+_COLUMN_IS = """
+SELECT 1 FROM information_schema.columns
+WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s AND data_type = %s
+"""
+_HAS_INDEX = """
+SELECT 1 FROM information_schema.statistics
+WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s LIMIT 1
+"""
+_HAS_CONSTRAINT = """
+SELECT 1 FROM information_schema.table_constraints
+WHERE table_schema = DATABASE() AND table_name = %s AND constraint_name = %s
+"""
+_NO_COLUMN = """
+SELECT 1 FROM DUAL WHERE NOT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+)
+"""
+_NO_TABLE = """
+SELECT 1 FROM DUAL WHERE NOT EXISTS (
+    SELECT 1 FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s
+)
+"""
+_NO_CONSTRAINT = """
+SELECT 1 FROM DUAL WHERE NOT EXISTS (
+    SELECT 1 FROM information_schema.table_constraints
+    WHERE table_schema = DATABASE() AND table_name = %s AND constraint_name = %s
+)
+"""
+
+
+class MigrationError(Exception):
+    pass
+
+
+class Step:
+    __slots__ = ("sql", "skip_if", "skip_params")
+
+    def __init__(self, sql, skip_if=None, skip_params=()):
+        self.sql = sql
+        self.skip_if = skip_if
+        self.skip_params = skip_params
+
+
+def column_is(table, column, data_type):
+    return {"skip_if": _COLUMN_IS, "skip_params": (table, column, data_type)}
+
+
+def has_index(table, index):
+    return {"skip_if": _HAS_INDEX, "skip_params": (table, index)}
+
+
+def has_constraint(table, name):
+    return {"skip_if": _HAS_CONSTRAINT, "skip_params": (table, name)}
+
+
+def no_constraint(table, name):
+    return {"skip_if": _NO_CONSTRAINT, "skip_params": (table, name)}
+
+
+def no_column(table, column):
+    return {"skip_if": _NO_COLUMN, "skip_params": (table, column)}
+
+
+def no_table(table):
+    return {"skip_if": _NO_TABLE, "skip_params": (table,)}
+
+
+class Migration:
+    def __init__(self, id, name, steps):
+        self.id = id
+        self.name = name
+        self.steps = [step if isinstance(step, Step) else Step(step) for step in steps]
+
+    @property
+    def checksum(self):
+        digest = hashlib.sha256()
+        for step in self.steps:
+            for part in (step.sql, step.skip_if or "", repr(step.skip_params)):
+                digest.update(" ".join(part.split()).encode("utf-8"))
+                digest.update(b"\0")
+        return digest.hexdigest()
+
+
+# Вже застосовані міграції не можна змінювати (перевіряється контрольна сума) - лише додавати нові в кінець.
+MIGRATIONS = [
+    Migration(1, "initial schema", [
+        """
+        CREATE TABLE IF NOT EXISTS blocked_users (
+            user_id VARCHAR(50) PRIMARY KEY,
+            block_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            nickname VARCHAR(255),
+            reason TEXT
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS groups_for_hetzner (
+            group_name VARCHAR(255) NOT NULL,
+            key_hetzner VARCHAR(255) NOT NULL,
+            group_signature VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci DEFAULT NULL,
+            PRIMARY KEY (group_name)
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id VARCHAR(50) NOT NULL,
+            username VARCHAR(255) CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci DEFAULT NULL,
+            group_name VARCHAR(255) NOT NULL,
+            secret_key VARCHAR(255) NOT NULL,
+            PRIMARY KEY (user_id),
+            FOREIGN KEY (group_name) REFERENCES groups_for_hetzner(group_name) ON DELETE CASCADE
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS time_key (
+            group_name VARCHAR(255) NOT NULL,
+            time_key VARCHAR(255) NOT NULL,
+            FOREIGN KEY (group_name) REFERENCES groups_for_hetzner(group_name) ON DELETE CASCADE
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS admins_2fa (
+            admin_id VARCHAR(50) NOT NULL PRIMARY KEY,
+            username VARCHAR(255) NOT NULL,
+            secret_key VARCHAR(255) NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS pending_admins (
+            moderator_id VARCHAR(50) NOT NULL PRIMARY KEY
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS hetzner_servers (
+            group_name VARCHAR(255) NOT NULL,
+            server_id VARCHAR(255) NOT NULL,
+            server_name VARCHAR(255) DEFAULT NULL,
+            PRIMARY KEY (group_name, server_id),
+            FOREIGN KEY (group_name) REFERENCES groups_for_hetzner(group_name) ON DELETE CASCADE
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS emergency_bot_subscribers (
+            chat_id VARCHAR(50),
+            admin_id VARCHAR(50),
+            FOREIGN KEY (admin_id) REFERENCES admins_2fa(admin_id) ON DELETE CASCADE
+        );
+        """,
+    ]),
+    Migration(2, "recreate emergency_bot_subscribers", [
+        "DROP TABLE IF EXISTS emergency_bot_subscribers;",
+        """
+        CREATE TABLE IF NOT EXISTS emergency_bot_subscribers (
+            chat_id VARCHAR(50),
+            admin_id VARCHAR(50),
+            FOREIGN KEY (admin_id) REFERENCES admins_2fa(admin_id) ON DELETE CASCADE
+        );
+        """,
+    ]),
+    Migration(3, "server_watch_subscribers", [
+        """
+        CREATE TABLE IF NOT EXISTS server_watch_subscribers (
+            chat_id VARCHAR(50) NOT NULL,
+            group_name VARCHAR(255) NOT NULL,
+            PRIMARY KEY (chat_id, group_name),
+            FOREIGN KEY (group_name) REFERENCES groups_for_hetzner(group_name) ON DELETE CASCADE
+        );
+        """,
+    ]),
+    # Індекси для гарячих запитів і числові (BIGINT) id Telegram замість VARCHAR(50)
+    Migration(4, "hot query indexes and BIGINT ids", [
+        "DELETE FROM pending_admins WHERE moderator_id NOT REGEXP '^-?[0-9]+$'",
+        "DELETE FROM emergency_bot_subscribers WHERE chat_id IS NULL OR chat_id NOT REGEXP '^-?[0-9]+$'",
+        Step("ALTER TABLE emergency_bot_subscribers DROP FOREIGN KEY emergency_bot_subscribers_ibfk_1",
+             **no_constraint("emergency_bot_subscribers", "emergency_bot_subscribers_ibfk_1")),
+        Step("ALTER TABLE admins_2fa MODIFY admin_id BIGINT NOT NULL",
+             **column_is("admins_2fa", "admin_id", "bigint")),
+        # Для унікального chat_id лишається перша підписка чату. Тимчасовий номер рядка відрізняє і повні дублікати,
+        # і рядки з admin_id = NULL, яких порівняння admin_id не бачить
+        Step("ALTER TABLE emergency_bot_subscribers ADD COLUMN dedup_id BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY",
+             **column_is("emergency_bot_subscribers", "dedup_id", "bigint")),
+        Step("""
+            DELETE e1 FROM emergency_bot_subscribers e1
+            JOIN emergency_bot_subscribers e2 ON e1.chat_id = e2.chat_id AND e1.dedup_id > e2.dedup_id
+        """, **no_column("emergency_bot_subscribers", "dedup_id")),
+        Step("ALTER TABLE emergency_bot_subscribers DROP COLUMN dedup_id",
+             **no_column("emergency_bot_subscribers", "dedup_id")),
+        Step("ALTER TABLE emergency_bot_subscribers MODIFY chat_id BIGINT NOT NULL",
+             **column_is("emergency_bot_subscribers", "chat_id", "bigint")),
+        Step("ALTER TABLE emergency_bot_subscribers MODIFY admin_id BIGINT",
+             **column_is("emergency_bot_subscribers", "admin_id", "bigint")),
+        Step("ALTER TABLE emergency_bot_subscribers ADD UNIQUE KEY uq_emergency_chat_id (chat_id)",
+             **has_index("emergency_bot_subscribers", "uq_emergency_chat_id")),
+        Step("""
+            ALTER TABLE emergency_bot_subscribers ADD CONSTRAINT fk_emergency_admin
+            FOREIGN KEY (admin_id) REFERENCES admins_2fa(admin_id) ON DELETE CASCADE
+        """, **has_constraint("emergency_bot_subscribers", "fk_emergency_admin")),
+        Step("ALTER TABLE users MODIFY user_id BIGINT NOT NULL",
+             **column_is("users", "user_id", "bigint")),
+        Step("ALTER TABLE pending_admins MODIFY moderator_id BIGINT NOT NULL",
+             **column_is("pending_admins", "moderator_id", "bigint")),
+        Step("ALTER TABLE blocked_users MODIFY user_id BIGINT NOT NULL",
+             **column_is("blocked_users", "user_id", "bigint")),
+        Step("ALTER TABLE server_watch_subscribers MODIFY chat_id BIGINT NOT NULL",
+             **column_is("server_watch_subscribers", "chat_id", "bigint")),
+        Step("ALTER TABLE groups_for_hetzner ADD KEY idx_key_hetzner (key_hetzner)",
+             **has_index("groups_for_hetzner", "idx_key_hetzner")),
+    ]),
+    # Стан незавершених діалогів для DBStateStore (state_store.py)
+    Migration(5, "conversation_state", [
+        """
+        CREATE TABLE IF NOT EXISTS conversation_state (
+            namespace VARCHAR(64) NOT NULL,
+            state_key VARCHAR(64) NOT NULL,
+            value TEXT NOT NULL,
+            expires_at DATETIME NOT NULL,
+            PRIMARY KEY (namespace, state_key),
+            KEY idx_conversation_state_expires (expires_at)
+        );
+        """,
+    ]),
+    # Оренда ролі poller-а і лічильники змін кешів для кількох процесів бота (cluster.py)
+    Migration(6, "cluster leases and cache versions", [
+        """
+        CREATE TABLE IF NOT EXISTS cluster_leases (
+            name VARCHAR(64) PRIMARY KEY,
+            holder VARCHAR(255) NOT NULL,
+            expires_at DATETIME NOT NULL
+        );
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name VARCHAR(64) PRIMARY KEY,
+            version BIGINT NOT NULL DEFAULT 0
+        );
+        """,
+    ]),
+    # Одноразові коди зберігаються як SHA-256 з терміном дії замість відкритого тексту в time_key (one_time_codes.py).
+    # Наявні коди переносяться з хешем і діють ще добу.
+    Migration(7, "hashed one-time codes", [
+        """
+        CREATE TABLE IF NOT EXISTS one_time_codes (
+            code_hash CHAR(64) NOT NULL PRIMARY KEY,
+            group_name VARCHAR(255) NOT NULL,
+            created_at DATETIME NOT NULL,
+            expires_at DATETIME NOT NULL,
+            claimed_by BIGINT DEFAULT NULL,
+            KEY idx_one_time_codes_expires (expires_at),
+            FOREIGN KEY (group_name) REFERENCES groups_for_hetzner(group_name) ON DELETE CASCADE
+        );
+        """,
+        Step("""
+            INSERT IGNORE INTO one_time_codes (code_hash, group_name, created_at, expires_at)
+            SELECT SHA2(time_key, 256), group_name, NOW(), NOW() + INTERVAL 1 DAY FROM time_key
+        """, **no_table("time_key")),
+        "DROP TABLE IF EXISTS time_key",
+    ]),
+    # Лічильники невдалих спроб 2FA/одноразових кодів по відрізках ковзного вікна (auth_limiter.py)
+    Migration(8, "auth_failures", [
+        """
+        CREATE TABLE IF NOT EXISTS auth_failures (
+            subject BIGINT NOT NULL,
+            window_length INT NOT NULL,
+            bucket BIGINT NOT NULL,
+            failures INT NOT NULL,
+            expires_at DATETIME NOT NULL,
+            PRIMARY KEY (subject, window_length, bucket),
+            KEY idx_auth_failures_expires (expires_at)
+        );
+        """,
+    ]),
+    # Сповіщення про статус шукають підписки за групою (check_query_plans.py)
+    Migration(9, "server_watch_subscribers group index", [
+        Step("ALTER TABLE server_watch_subscribers ADD KEY idx_watch_group (group_name)",
+             **has_index("server_watch_subscribers", "idx_watch_group")),
+    ]),
+    # offset getUpdates зберігається разом з орендою poller-а, щоб новий власник не отримав оновлення вдруге
+    Migration(10, "cluster lease update offset", [
+        Step("ALTER TABLE cluster_leases ADD COLUMN update_offset BIGINT DEFAULT NULL",
+             **column_is("cluster_leases", "update_offset", "bigint")),
+    ]),
+]
+
+# Стара схема версіонувалася таблицею version: версія -> остання міграція, що їй відповідає
+LEGACY_VERSIONS = {"1.1": 1, "1.2": 2, "1.3": 3, "1.4": 4}
+
+
+def _applied(cursor):
+    try:
+        cursor.execute("SELECT id, checksum FROM schema_migrations")
+    except mysql.connector.errors.ProgrammingError as err:
+        if err.errno != 1146:  # ER_NO_SUCH_TABLE
+            raise
+        return None
+    return dict(cursor.fetchall())
+
+
+def _bootstrap(cursor, migrations):
+    """Створює schema_migrations і переносить у неї стан зі старої таблиці version."""
+    cursor.execute(create_migrations_table)
+    cursor.execute("SHOW TABLES LIKE 'version'")
+    if not cursor.fetchall():
+        return {}
+    cursor.execute("SELECT version FROM version WHERE id = 1")
+    rows = cursor.fetchall()
+    if not rows:
+        return {}
+    row = rows[0]
+    if row[0] not in LEGACY_VERSIONS:
+        raise MigrationError(f"Невідома версія бази {row[0]}, автоматичне оновлення неможливе")
+    applied = {}
+    for migration in migrations:
+        if migration.id <= LEGACY_VERSIONS[row[0]]:
+            cursor.execute("INSERT IGNORE INTO schema_migrations (id, name, checksum) VALUES (%s, %s, %s)",
+                           (migration.id, migration.name, migration.checksum))
+            applied[migration.id] = migration.checksum
+    logging.info(f"Стара версія бази {row[0]} перенесена в schema_migrations")
+    return applied
+
+
+def _verify(applied, migrations):
+    known = {migration.id: migration for migration in migrations}
+    for migration_id, checksum in applied.items():
+        migration = known.get(migration_id)
+        if migration is None:
+            raise MigrationError(f"База містить міграцію {migration_id}, якої немає в коді (код застарів?)")
+        if migration.checksum != checksum:
+            raise MigrationError(f"Міграцію {migration_id} ({migration.name}) змінено після застосування")
+
+
+def _apply(cursor, migration):
+    for step in migration.steps:
+        if step.skip_if:
+            cursor.execute(step.skip_if, step.skip_params)
+            if cursor.fetchall():
+                continue
+        cursor.execute(step.sql)
+    cursor.execute("INSERT INTO schema_migrations (id, name, checksum) VALUES (%s, %s, %s)",
+                   (migration.id, migration.name, migration.checksum))
+
+
+def migrate(pool, migrations=MIGRATIONS):
+    """
+    Застосовує всі незастосовані міграції по порядку.
+    Якщо схема актуальна, виконується рівно один запит (SELECT з schema_migrations).
+    Повертає список застосованих міграцій.
+    """
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        try:
+            applied = _applied(cursor)
+            if applied is not None:
+                _verify(applied, migrations)
+                if all(migration.id in applied for migration in migrations):
+                    return []
+            # Кілька процесів бота не повинні застосовувати міграції одночасно
+            cursor.execute("SELECT GET_LOCK(%s, 60)", (MIGRATIONS_LOCK,))
+            if cursor.fetchall()[0][0] != 1:
+                raise MigrationError("Не вдалося отримати блокування для міграцій")
+            try:
+                applied = _applied(cursor)
+                if applied is None:
+                    applied = _bootstrap(cursor, migrations)
+                _verify(applied, migrations)
+                done = []
+                for migration in migrations:
+                    if migration.id in applied:
+                        continue
+                    logging.info(f"Застосування міграції {migration.id}: {migration.name}")
+                    print(f"Застосування міграції {migration.id}: {migration.name}")
+                    _apply(cursor, migration)
+                    done.append(migration)
+                return done
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATIONS_LOCK,))
+                cursor.fetchall()
+        finally:
+            cursor.close()
@@ -0,0 +1,113 @@
+import hashlib
+import logging
+import secrets
+import string
+import threading
+
+import mysql.connector
+
+CODE_LENGTH = 25
+CODE_ALPHABET = string.ascii_letters + string.digits + string.punctuation
+HASH_PREFIX_LENGTH = 16  # скільки символів хешу показується в списку і передається в callback_data
+
+# Запити погашення і sweeper-а; їхні плани перевіряє check_query_plans.py
+CLAIM_QUERY = """
+    UPDATE one_time_codes SET claimed_by = %s, expires_at = NOW()
+    WHERE code_hash = %s AND claimed_by IS NULL AND expires_at > NOW()
+"""
+CLAIMED_GROUP_QUERY = "SELECT group_name FROM one_time_codes WHERE code_hash = %s AND claimed_by = %s"
+SWEEP_QUERY = "DELETE FROM one_time_codes WHERE expires_at <= NOW() LIMIT %s"
+
+
+def hash_code(code):
+    # У коді ~160 біт випадковості, тому підбір за хешем неможливий і повільний KDF не потрібен
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+class OneTimeCodes:
+    """
+    Одноразові коди реєстрації в таблиці one_time_codes. Зберігається лише SHA-256 коду
+    (первинний ключ), тож пошук - за індексом, а витік бази не розкриває дійсних кодів.
+    Кожен код має термін дії; прострочені та погашені коди видаляє фоновий sweeper пакетами.
+    """
+
+    def __init__(self, pool, ttl=86400, sweep_interval=600, sweep_batch=1000):
+        self.pool = pool
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _execute(self, query, params, fetch=False):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall() if fetch else cursor.rowcount
+            finally:
+                cursor.close()
+
+    def create(self, group_name, ttl=None):
+        """Генерує код для групи і повертає його. Відкритий текст коду ніде не зберігається."""
+        code = "".join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+        self._execute("""
+            INSERT INTO one_time_codes (code_hash, group_name, created_at, expires_at)
+            VALUES (%s, %s, NOW(), NOW() + INTERVAL %s SECOND)
+        """, (hash_code(code), group_name, int(ttl or self.ttl)))
+        return code
+
+    def claim(self, code, user_id):
+        """
+        Погашає код і повертає назву його групи або None.
+        Погашення - один UPDATE: з кількох одночасних спроб рядок змінює лише одна,
+        а expires_at = NOW() одразу робить код недійсним і віддає рядок sweeper-у.
+        """
+        code_hash = hash_code(code)
+        claimed = self._execute(CLAIM_QUERY, (user_id, code_hash))
+        if claimed != 1:
+            return None
+        rows = self._execute(CLAIMED_GROUP_QUERY, (code_hash, user_id), fetch=True)
+        return rows[0][0] if rows else None
+
+    def active(self):
+        """Дійсні коди: (префікс хешу, група, термін дії), найближчі до закінчення - першими."""
+        rows = self._execute("""
+            SELECT code_hash, group_name, expires_at FROM one_time_codes
+            WHERE expires_at > NOW() ORDER BY expires_at
+        """, (), fetch=True)
+        return [(code_hash[:HASH_PREFIX_LENGTH], group_name, expires_at) for code_hash, group_name, expires_at in rows]
+
+    def revoke(self, hash_prefix):
+        """Видаляє код за префіксом хешу з active(). Повертає True, якщо код знайдено."""
+        if len(hash_prefix) != HASH_PREFIX_LENGTH or any(char not in string.hexdigits for char in hash_prefix):
+            return False
+        # LIKE з префіксом без % на початку читає діапазон первинного ключа
+        return self._execute("DELETE FROM one_time_codes WHERE code_hash LIKE %s LIMIT 1",
+                             (hash_prefix + "%",)) > 0
+
+    def sweep(self):
+        deleted = 0
+        while True:
+            batch = self._execute(SWEEP_QUERY, (self.sweep_batch,))
+            deleted += batch
+            if batch < self.sweep_batch:
+                return deleted
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="one-time-codes-sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                deleted = self.sweep()
+            except mysql.connector.Error as err:
+                logging.error(f"Не вдалося видалити прострочені одноразові коди: {err}")
+                continue
+            if deleted:
+                logging.info(f"Видалено прострочених/погашених одноразових кодів: {deleted}")
@@ -0,0 +1,84 @@
+import logging
+import multiprocessing
+import struct
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+
+def encode_png(matrix, scale):
+    """1-бітний PNG у відтінках сірого з матриці QR-коду (True - темний модуль), модуль = scale x scale пікселів."""
+    size = len(matrix) * scale
+    padding = "0" * (-size % 8)
+    # У 1-бітному PNG 1 - білий піксель
+    dark_bits, light_bits = "0" * scale, "1" * scale
+    rows = []
+    for matrix_row in matrix:
+        bits = "".join(dark_bits if dark else light_bits for dark in matrix_row) + padding
+        # Перед кожним рядком - байт фільтра 0 (без фільтра)
+        row = b"\x00" + int(bits, 2).to_bytes(len(bits) // 8, "big")
+        rows.append(row * scale)
+    header = struct.pack(">IIBBBBB", size, size, 1, 0, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + _png_chunk(b"IHDR", header)
+            + _png_chunk(b"IDAT", zlib.compress(b"".join(rows), 9)) + _png_chunk(b"IEND", b""))
+
+
+def render_png(data, scale=4, border=4):
+    """
+    QR-код для data у вигляді PNG. Рівень корекції L дає найменшу матрицю, а рамка з border модулів -
+    мінімум, потрібний сканерам. qrcode імпортується лише тут - у процесі, що рендерить.
+    """
+    import qrcode
+
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L, border=border)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return encode_png(qr.get_matrix(), scale)
+
+
+class QRRenderer:
+    """
+    Рендерить QR-коди в окремих процесах, тож CPU-робота qrcode не тримає GIL потоків-обробників
+    і хвиля реєстрацій не гальмує інші чати. Процеси створюються через fork у start(), і лише поки
+    в процесі немає інших потоків: fork багатопотокового процесу може успадкувати захоплені ними
+    блокування. spawn і forkserver не підходять - кожен процес пулу заново виконав би bot.py.
+    Без start(), якщо потоки вже є, і в процесі-обробнику кластера (daemon не може мати дочірніх процесів)
+    рендер іде в окремому потоці - обробники все одно не рендерять паралельно.
+    """
+
+    def __init__(self, processes=1, scale=4, border=4, timeout=30):
+        self.processes = processes
+        self.scale = scale
+        self.border = border
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._executor is None and self.processes and not multiprocessing.current_process().daemon:
+                if threading.active_count() > 1:
+                    logging.warning("QRRenderer.start: у процесі вже є потоки, QR-коди рендеряться в окремому потоці")
+                    return
+                self._executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("fork"))
+        # Для fork пул створює всі процеси при першому завданні
+        self._pool().submit(int).result(self.timeout)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(1, thread_name_prefix="qr-render")
+            return self._executor
+
+    def render(self, data):
+        return self._pool().submit(render_png, data, self.scale, self.border).result(self.timeout)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
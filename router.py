@@ -0,0 +1,43 @@
+class TextRouter:
+    """
+    Таблиця текстових команд (кнопок меню): текст повідомлення нормалізується один раз
+    і обробник шукається в dict, замість перебору десятків func-фільтрів telebot.
+    У telebot реєструється як один обробник content_types=["text"] і має стояти останнім,
+    щоб команди на кшталт /start потрапляли до своїх обробників раніше.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.fallback = None
+
+    @staticmethod
+    def normalize(text):
+        return text.strip().lower()
+
+    def command(self, *texts):
+        """Декоратор: func обробляє повідомлення з будь-яким із texts (без урахування регістру та пробілів)."""
+        def decorator(func):
+            for text in texts:
+                key = self.normalize(text)
+                if key in self.routes:
+                    raise ValueError(f"Команда '{key}' вже зареєстрована для {self.routes[key].__name__}")
+                self.routes[key] = func
+            return func
+
+        return decorator
+
+    def default(self, func):
+        """Декоратор: func обробляє текст, для якого немає команди."""
+        self.fallback = func
+        return func
+
+    def resolve(self, text):
+        return self.routes.get(self.normalize(text), self.fallback) if text else None
+
+    def dispatch(self, message):
+        handler = self.resolve(message.text)
+        if handler is not None:
+            return handler(message)
+
+    def attach(self, bot):
+        bot.register_message_handler(self.dispatch, content_types=["text"])
@@ -0,0 +1,192 @@
+import collections
+import threading
+import time
+
+from telebot.apihelper import ApiTelegramException
+
+# Смуги пріоритету: менше число - раніше отримує дозвіл на відправку
+PRIORITY_URGENT = 0  # запити 2FA-коду, аварійні сповіщення
+PRIORITY_NORMAL = 1  # звичайні відповіді
+PRIORITY_BULK = 2  # меню, списки, проміжний прогрес
+
+
+class _Bucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def ready_in(self, now):
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class _Ticket:
+    __slots__ = ("chat_id", "granted")
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.granted = False
+
+
+class SendLimiter:
+    """
+    Черга дозволів на вихідні запити до Telegram: спільний token bucket (global_rate за секунду)
+    і окремий bucket на кожен чат (per_chat_rate, для груп - group_rate).
+    Потік-обробник чекає в acquire() свого дозволу й сам виконує запит, тож порядок повідомлень
+    одного обробника зберігається, а відповіді з вищою смугою пріоритету проходять раніше.
+    """
+
+    def __init__(self, global_rate=30, per_chat_rate=1, per_chat_burst=3, group_rate=20 / 60, retries=3):
+        self.global_rate = global_rate
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.group_rate = group_rate
+        self.retries = retries
+        self._cond = threading.Condition()
+        self._global = _Bucket(global_rate, global_rate, time.monotonic())
+        self._chats = {}
+        self._lanes = collections.defaultdict(collections.deque)
+        self.stats = {"sent": 0, "waits": 0, "wait_time": 0.0, "retry_after": 0, "max_waiting": 0}
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Від'ємний chat id - група або канал, там ліміт Telegram нижчий
+            rate = self.group_rate if chat_id < 0 else self.per_chat_rate
+            bucket = _Bucket(rate, self.per_chat_burst, now)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _grant(self, now):
+        """Роздає дозволи чекаючим у порядку смуг; повертає, через скільки секунд варто спробувати знову."""
+        retry_in = None
+        for priority in sorted(self._lanes):
+            lane = self._lanes[priority]
+            for ticket in list(lane):
+                global_wait = self._global.ready_in(now)
+                if global_wait:
+                    return global_wait
+                chat_wait = self._chat_bucket(ticket.chat_id, now).ready_in(now)
+                if chat_wait:
+                    retry_in = chat_wait if retry_in is None else min(retry_in, chat_wait)
+                    continue
+                self._global.tokens -= 1
+                self._chats[ticket.chat_id].tokens -= 1
+                ticket.granted = True
+                lane.remove(ticket)
+                self._cond.notify_all()
+        return retry_in
+
+    def _prune(self, now):
+        # Повні bucket-и нічим не відрізняються від нових - їх можна забути
+        for chat_id in [key for key, bucket in self._chats.items() if bucket.ready_in(now) == 0
+                        and bucket.tokens >= bucket.burst]:
+            del self._chats[chat_id]
+
+    def acquire(self, chat_id, priority=PRIORITY_NORMAL):
+        started = time.monotonic()
+        ticket = _Ticket(int(chat_id))
+        with self._cond:
+            self._lanes[priority].append(ticket)
+            waiting = sum(len(lane) for lane in self._lanes.values())
+            self.stats["max_waiting"] = max(self.stats["max_waiting"], waiting)
+            while True:
+                retry_in = self._grant(time.monotonic())
+                if ticket.granted:
+                    break
+                self._cond.wait(retry_in)
+            self.stats["sent"] += 1
+            waited = time.monotonic() - started
+            if waited > 0.001:
+                self.stats["waits"] += 1
+                self.stats["wait_time"] += waited
+            if len(self._chats) > 10000:
+                self._prune(time.monotonic())
+
+    def penalize(self, chat_id, retry_after):
+        """Telegram відповів 429: чат не отримує дозволів наступні retry_after секунд."""
+        with self._cond:
+            now = time.monotonic()
+            bucket = self._chat_bucket(int(chat_id), now)
+            bucket.refill(now)
+            bucket.tokens = min(bucket.tokens, 1) - retry_after * bucket.rate
+            self.stats["retry_after"] += 1
+
+    def call(self, chat_id, priority, func, *args, **kwargs):
+        for attempt in range(self.retries + 1):
+            self.acquire(chat_id, priority)
+            try:
+                return func(*args, **kwargs)
+            except ApiTelegramException as err:
+                if err.error_code != 429 or attempt == self.retries:
+                    raise
+                parameters = (err.result_json or {}).get("parameters") or {}
+                self.penalize(chat_id, parameters.get("retry_after", 1))
+
+    def snapshot(self):
+        with self._cond:
+            stats = dict(self.stats)
+            stats["waiting"] = sum(len(lane) for lane in self._lanes.values())
+            stats["chats"] = len(self._chats)
+        return stats
+
+
+class RateLimitedSendMixin:
+    """
+    Міксин для TeleBot: send_message/send_photo/edit_message_* проходять через SendLimiter.
+    Смуга задається аргументом priority (за замовчуванням PRIORITY_NORMAL).
+    reply_to викликає send_message, тому обмежується автоматично.
+    calls_made() рахує запити до Telegram, зроблені обробником у поточному потоці.
+    """
+
+    limiter = None
+    _calls = threading.local()
+
+    def calls_made(self, func, *args, **kwargs):
+        """Виконує func і повертає, скільки запитів до Telegram він зробив."""
+        self._calls.count = 0
+        try:
+            func(*args, **kwargs)
+            return self._calls.count
+        finally:
+            self._calls.count = None
+
+    def _count_call(self):
+        if getattr(self._calls, "count", None) is not None:
+            self._calls.count += 1
+
+    def _limited(self, chat_id, priority, func, *args, **kwargs):
+        self._count_call()
+        if self.limiter is None or chat_id is None:
+            return func(*args, **kwargs)
+        return self.limiter.call(chat_id, priority, func, *args, **kwargs)
+
+    def send_message(self, chat_id, text, *args, priority=PRIORITY_NORMAL, **kwargs):
+        return self._limited(chat_id, priority, super().send_message, chat_id, text, *args, **kwargs)
+
+    def send_photo(self, chat_id, photo, *args, priority=PRIORITY_NORMAL, **kwargs):
+        return self._limited(chat_id, priority, super().send_photo, chat_id, photo, *args, **kwargs)
+
+    def edit_message_text(self, text, chat_id=None, *args, priority=PRIORITY_NORMAL, **kwargs):
+        return self._limited(chat_id, priority, super().edit_message_text, text, chat_id, *args, **kwargs)
+
+    def edit_message_reply_markup(self, chat_id=None, *args, priority=PRIORITY_NORMAL, **kwargs):
+        return self._limited(chat_id, priority, super().edit_message_reply_markup, chat_id, *args, **kwargs)
+
+    def answer_callback_query(self, *args, **kwargs):
+        # Відповідь на callback не рахується в ліміт повідомлень чату, але це окремий запит
+        self._count_call()
+        return super().answer_callback_query(*args, **kwargs)
+
+    def delete_message(self, *args, **kwargs):
+        self._count_call()
+        return super().delete_message(*args, **kwargs)
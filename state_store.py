@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+
+
+class _Record:
+    __slots__ = ("value", "expires_at")
+
+    def __init__(self, value, expires_at):
+        self.value = value
+        self.expires_at = expires_at
+
+
+class MemoryStateStore:
+    """
+    Стан незавершених діалогів у пам'яті процесу.
+    Кожен запис має TTL; прострочені записи видаляються при зверненні та періодичним проходом.
+    """
+
+    def __init__(self, default_ttl=900, sweep_interval=60):
+        self.default_ttl = default_ttl
+        self.sweep_interval = sweep_interval
+        self._data = {}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    # Ключі приводяться до str, як і в DBStateStore, щоб 123 і "123" були одним записом
+    def get(self, namespace, key, default=None):
+        record = self._data.get((namespace, str(key)))
+        if record is None:
+            return default
+        if record.expires_at <= time.monotonic():
+            with self._lock:
+                self._data.pop((namespace, str(key)), None)
+            return default
+        return record.value
+
+    def set(self, namespace, key, value, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            self._data[(namespace, str(key))] = _Record(value, now + (ttl or self.default_ttl))
+            if now >= self._next_sweep:
+                self._sweep(now)
+
+    def pop(self, namespace, key, default=None):
+        with self._lock:
+            record = self._data.pop((namespace, str(key)), None)
+        if record is None or record.expires_at <= time.monotonic():
+            return default
+        return record.value
+
+    def _sweep(self, now):
+        for item_key in [k for k, record in self._data.items() if record.expires_at <= now]:
+            del self._data[item_key]
+        self._next_sweep = now + self.sweep_interval
+
+    def sweep(self):
+        with self._lock:
+            self._sweep(time.monotonic())
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DBStateStore:
+    """
+    Стан незавершених діалогів у таблиці conversation_state, спільний для кількох процесів бота
+    і такий, що переживає перезапуск. Значення зберігаються як JSON.
+    """
+
+    def __init__(self, pool, default_ttl=900, sweep_interval=60, sweep_batch=1000):
+        self.pool = pool
+        self.default_ttl = default_ttl
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def _execute(self, query, params, fetch=False):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(query, params)
+                return cursor.fetchall() if fetch else cursor.rowcount
+            finally:
+                cursor.close()
+
+    def get(self, namespace, key, default=None):
+        rows = self._execute(
+            "SELECT value FROM conversation_state WHERE namespace = %s AND state_key = %s AND expires_at > NOW()",
+            (namespace, str(key)), fetch=True)
+        return json.loads(rows[0][0]) if rows else default
+
+    def set(self, namespace, key, value, ttl=None):
+        self._execute("""
+            INSERT INTO conversation_state (namespace, state_key, value, expires_at)
+            VALUES (%s, %s, %s, NOW() + INTERVAL %s SECOND)
+            ON DUPLICATE KEY UPDATE value = VALUES(value), expires_at = VALUES(expires_at)
+        """, (namespace, str(key), json.dumps(value), int(ttl or self.default_ttl)))
+        if time.monotonic() >= self._next_sweep:
+            self.sweep()
+
+    def pop(self, namespace, key, default=None):
+        value = self.get(namespace, key, default)
+        self._execute("DELETE FROM conversation_state WHERE namespace = %s AND state_key = %s",
+                      (namespace, str(key)))
+        return value
+
+    def sweep(self):
+        self._next_sweep = time.monotonic() + self.sweep_interval
+        while self._execute("DELETE FROM conversation_state WHERE expires_at <= NOW() LIMIT %s",
+                            (self.sweep_batch,)) >= self.sweep_batch:
+            pass
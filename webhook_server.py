@@ -0,0 +1,95 @@
+import hmac
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import telebot
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    Локальний HTTP-сервер, який приймає оновлення від Telegram (setWebhook)
+    і передає їх у звичайні обробники telebot через bot.process_new_updates.
+    process_new_updates лише ставить оновлення в чергу (ChatDispatcher або черги кластера), тож коректне
+    оновлення завжди підтверджується 200: Telegram не повторює доставку, а помилки обробників
+    логуються і рахуються там, де оновлення обробляється.
+    """
+
+    def __init__(self, bot, host, port, path, secret, record_file=None):
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.record_file = record_file
+        self._record_lock = threading.Lock()
+        self.stats = {"received": 0, "rejected": 0}
+        self._stats_lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self._serving = threading.Event()
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _record(self, body):
+        with self._record_lock:
+            with open(self.record_file, "ab") as f:
+                f.write(body.replace(b"\n", b"") + b"\n")
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, code):
+                self.send_response(code)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                if self.path != server.path:
+                    server._count("rejected")
+                    return self._reply(404)
+                token = self.headers.get(SECRET_HEADER, "")
+                if not hmac.compare_digest(token.encode(), server.secret.encode()):
+                    server._count("rejected")
+                    return self._reply(403)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                try:
+                    update = telebot.types.Update.de_json(body.decode("utf-8"))
+                except Exception as err:
+                    server._count("rejected")
+                    logging.warning(f"Некоректне оновлення від webhook: {err}")
+                    return self._reply(400)
+                server._count("received")
+                if server.record_file:
+                    server._record(body)
+                server.bot.process_new_updates([update])
+                self._reply(200)
+
+            def do_GET(self):
+                self._reply(405)
+
+            def log_message(self, format, *args):
+                logging.debug("webhook: " + format % args)
+
+        return Handler
+
+    def serve_forever(self):
+        self._serving.set()
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self._serving.clear()
+
+    def shutdown(self):
+        # httpd.shutdown() чекає на кінець serve_forever і зависає назавжди, якщо сервер не обслуговує запити
+        if self._serving.is_set():
+            self.httpd.shutdown()
+        self.close()
+
+    def close(self):
+        """Закриває сокет сервера, що не обслуговує запити (serve_forever не запускався чи вже завершився)."""
+        self.httpd.server_close()